@@ -0,0 +1,73 @@
+"""
+Run many searches over stored conversations in one go.
+
+    python3 batch_search.py queries.txt [--top-k 5] [--mode vector] [--session ID] > results.jsonl
+    cat queries.txt | python3 batch_search.py --mode lexical
+
+Reads one query per line (blank lines are skipped) from a file or stdin and writes one JSON
+line per query, {"query", "results"}, in input order. Queries are searched --batch-size at a
+time with semantic_search_many, so each batch costs one embedding call and one
+multi-vector search, and results stream out as each batch completes. Searches span all
+sessions unless --session is given.
+"""
+
+import argparse
+import contextlib
+import json
+import sys
+from itertools import islice
+
+from project import SEARCH_MODES, PersonaAgent, runtime
+
+
+def read_queries(lines):
+    for line in lines:
+        query = line.strip()
+        if query:
+            yield query
+
+
+def search_batches(agent, queries, out, top_k=5, mode=None, current_session_only=False, batch_size=256):
+    """Search queries batch_size at a time, writing a JSON line per query to out. Returns the query count."""
+    queries = iter(queries)
+    count = 0
+    while True:
+        batch = list(islice(queries, batch_size))
+        if not batch:
+            return count
+        results = agent.semantic_search_many(batch, top_k=top_k, current_session_only=current_session_only,
+                                             mode=mode)
+        for query, hits in zip(batch, results):
+            out.write(json.dumps({"query": query, "results": hits}, ensure_ascii=False) + "\n")
+        out.flush()
+        count += len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search stored conversations for many queries")
+    parser.add_argument("input", nargs="?", default="-", help="file with one query per line (default: stdin)")
+    parser.add_argument("--collection", help="collection to search (default: the agent's collection)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--mode", choices=SEARCH_MODES, help="default: SEARCH_MODE")
+    parser.add_argument("--session", help="only search this session")
+    parser.add_argument("--batch-size", type=int, default=256, help="queries per embedding call and search")
+    args = parser.parse_args()
+
+    collection_name = args.collection or runtime.collection_name
+    out = sys.stdout
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    # stdout carries only results; the agent's own messages and warnings go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        agent = PersonaAgent(runtime.milvus, collection_name, session_id=args.session)
+        try:
+            count = search_batches(agent, read_queries(source), out, top_k=args.top_k, mode=args.mode,
+                                   current_session_only=args.session is not None, batch_size=args.batch_size)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            agent.close()
+    print(f"✓ Searched {count} queries", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
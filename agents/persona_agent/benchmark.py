@@ -0,0 +1,288 @@
+"""
+Offline benchmark for the persona agent's storage and retrieval paths.
+
+    python3 benchmark.py [--sizes 1000 10000 100000] [--sessions 100] [--store milvus|numpy]
+                         [--layout full|reduced:<dim>|int8|binary] [--rerank] [--output results.json]
+                         [--compare baseline.json]
+
+Seeds a scratch Milvus Lite database (or NumpyVectorStore) with synthetic conversations,
+growing it through each size, and at every size times:
+    seed         bulk inserts of the synthetic rows (per batch)
+    save         PersonaAgent.save_message
+    resume       PersonaAgent.load_conversation of an existing session (restoring the recent
+                 window only; summarizer folds are not part of it)
+    search_*     semantic_search: vector within a session, vector across sessions,
+                 lexical within a session, hybrid within a session
+    chat         a full PersonaAgent.chat turn
+    summarize    each summarizer fold of older history, reported on its own (only at sizes
+                 where one ran)
+
+Embeddings and the chat model are deterministic fakes, so no API key or network is used
+and runs are comparable. Results (p50/p95/p99/mean latency in ms and throughput per
+second) are written as JSON; --compare prints the p95 change against an earlier run.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import cycle
+
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+WORDS = (
+    "weather sailing pasta python milvus river mountain coffee guitar rocket garden winter "
+    "budget travel museum soccer recipe laptop ocean bakery library tomato jazz camera"
+).split()
+REPLIES = ["Arrr, that be a fine question!", "Let me think about that.", "Here's what I found."]
+SEED_BATCH_SIZE = 5000
+
+
+def percentiles(samples_ms):
+    """Summary statistics of a list of latencies in milliseconds."""
+    values = np.asarray(samples_ms, dtype=np.float64)
+    if not len(values):
+        return {"count": 0}
+    total_s = values.sum() / 1000
+    return {
+        "count": int(len(values)),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+        "throughput_per_s": round(len(values) / total_s, 1) if total_s > 0 else None,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    fn(*args, **kwargs)
+    return (time.perf_counter() - started) * 1000
+
+
+def fold_times(spans):
+    """Milliseconds spent in each summarizer fold among an agent's telemetry spans."""
+    return [span["ms"] for span in spans or () if span["stage"] == "summarize"]
+
+
+def synthetic_text(rng, n_words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(n_words))
+
+
+def seed_rows(rng, np_rng, start, count, sessions, dim):
+    """Synthetic message rows start..start+count, spread round-robin over `sessions` sessions."""
+    vectors = np_rng.standard_normal((count, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    base_ts = int(datetime(2024, 1, 1).timestamp() * 1000)
+    rows = []
+    for i, vector in zip(range(start, start + count), vectors):
+        rows.append({
+            "vector": vector.tolist(),
+            "session_id": f"bench_{i % sessions:05d}",
+            "timestamp": base_ts + i * 1000,
+            "role": "user" if (i // sessions) % 2 == 0 else "assistant",
+            "content": synthetic_text(rng),
+            "persona": "neutral",
+        })
+    return rows
+
+
+@contextlib.contextmanager
+def fake_backends(project, dim):
+    """Swap the agent's embeddings and LLM for deterministic fakes for the duration of the block."""
+    runtime = project.runtime
+    saved = {name: runtime.__dict__[name] for name in ("embeddings", "llm") if runtime.built(name)}
+    runtime.embeddings = DeterministicFakeEmbedding(size=dim)
+    runtime.llm = GenericFakeChatModel(messages=cycle([AIMessage(content=r) for r in REPLIES]))
+    try:
+        yield
+    finally:
+        for name in ("embeddings", "llm"):
+            if name in saved:
+                setattr(runtime, name, saved[name])
+            else:
+                delattr(runtime, name)
+
+
+def run_benchmark(client, collection_name, sizes, sessions=100, dim=384, samples=50, seed=0, layout="full",
+                  rerank=False):
+    """Grow the collection through `sizes` and time each stage; returns a list of result dicts."""
+    import project
+    from lexical_index import LexicalIndex
+
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    if client.has_collection(collection_name):
+        client.drop_collection(collection_name)
+    project.create_conversation_collection(client, collection_name, dim=dim,
+                                           layout=project.vector_layout(dim, layout, rerank=rerank))
+
+    results = []
+    seeded = 0
+    lexical = LexicalIndex()
+    with fake_backends(project, dim), contextlib.redirect_stdout(io.StringIO()):
+        for size in sorted(sizes):
+            def record(stage, samples_ms, **extra):
+                results.append(dict(size=size, stage=stage, **percentiles(samples_ms), **extra))
+
+            seed_ms = []
+            while seeded < size:
+                count = min(SEED_BATCH_SIZE, size - seeded)
+                rows = seed_rows(rng, np_rng, seeded, count, sessions, dim)
+                seed_ms.append(timed(client.insert, collection_name=collection_name, data=rows))
+                seeded += count
+            if seed_ms:
+                record("seed", seed_ms, batch_size=SEED_BATCH_SIZE)
+
+            session_ids = [f"bench_{rng.randrange(min(sessions, size)):05d}" for _ in range(samples)]
+
+            resume_ms, fold_ms = [], []
+            agents = []
+            for session_id in session_ids[:max(1, samples // 10)]:
+                agent = project.PersonaAgent(client, collection_name, session_id=session_id,
+                                             write_behind=False, lexical_index=lexical)
+                elapsed = timed(agent.load_conversation)
+                # Resuming shouldn't fold; if it ever does, the fold is reported as its own stage
+                folds = fold_times(agent._spans)
+                fold_ms += folds
+                resume_ms.append(elapsed - sum(folds))
+                agents.append(agent)
+            record("resume", resume_ms, messages_per_session=size // min(sessions, size), folds=len(fold_ms))
+
+            agent = agents[0]
+            record("save", [timed(agent.save_message, "user", synthetic_text(rng)) for _ in range(samples)])
+
+            # The first lexical search backfills the index with one scan of the collection
+            backfill_ms = timed(agent.semantic_search, "warm up", mode="lexical")
+            record("lexical_backfill", [backfill_ms], documents=len(lexical))
+
+            for stage, kwargs in (
+                ("search_vector_session", {"mode": "vector"}),
+                ("search_vector_all", {"mode": "vector", "current_session_only": False}),
+                ("search_lexical_session", {"mode": "lexical"}),
+                ("search_hybrid_session", {"mode": "hybrid"}),
+            ):
+                record(stage, [timed(agent.semantic_search, synthetic_text(rng, 3), **kwargs)
+                               for _ in range(samples)])
+
+            agent.agent_with_history  # the executor is built on first use; keep that out of the timings
+            chat_ms = []
+            for _ in range(max(1, samples // 4)):
+                chat_ms.append(timed(agent.chat, synthetic_text(rng, 8)))
+                fold_ms += fold_times(agent.last_turn)
+            record("chat", chat_ms)
+            if fold_ms:
+                record("summarize", fold_ms)
+            seeded += samples + 2 * max(1, samples // 4)
+    return results
+
+
+def print_table(results, compare=None, file=sys.stderr):
+    baseline = {(r["size"], r["stage"]): r for r in (compare or [])}
+    print(f"{'size':>9} {'stage':<24} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}"
+          + ("  p95 vs baseline" if compare else ""), file=file)
+    for r in results:
+        line = (f"{r['size']:>9} {r['stage']:<24} {r['count']:>5} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                f"{r['p99_ms']:>9.2f} {r['throughput_per_s'] or 0:>9.1f}")
+        old = baseline.get((r["size"], r["stage"]))
+        if old and old.get("p95_ms"):
+            line += f"  {(r['p95_ms'] / old['p95_ms'] - 1) * 100:+.1f}%"
+        print(line, file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark persona agent storage and retrieval offline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="collection sizes (messages) to measure at, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--sessions", type=int, default=100, help="sessions the seeded messages are spread over")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    parser.add_argument("--samples", type=int, default=50, help="timed calls per stage")
+    parser.add_argument("--store", choices=("milvus", "numpy"), default="milvus")
+    parser.add_argument("--layout", default="full", help="vector layout: full, reduced:<dim>, int8 or binary")
+    parser.add_argument("--rerank", action="store_true",
+                        help="keep full-precision vectors next to a compact layout to re-rank candidates")
+    parser.add_argument("--workdir", help="where the scratch database goes (default: a temporary directory)")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON results to compare p95 latencies against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="persona-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    compare = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare = json.load(f)["results"]
+
+    # Keep anything project writes relative to the working directory inside the scratch directory
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["EMBEDDING_BACKEND"] = "openai"
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["WRITE_BEHIND"] = "false"
+    os.environ["VECTOR_STORE"] = args.store
+
+    if args.store == "numpy":
+        from numpy_store import NumpyVectorStore
+
+        client = NumpyVectorStore(os.path.join(workdir, "bench.npstore"))
+    else:
+        from pymilvus import MilvusClient
+        from vector_layout import RerankingClient
+
+        client = RerankingClient(MilvusClient(uri=os.path.join(workdir, "bench.db")))
+
+    from vector_layout import VectorLayout
+
+    layout = VectorLayout.parse(args.layout, args.dim, rerank=args.rerank)
+    full_bytes = VectorLayout.parse("full", args.dim).bytes_per_vector()
+    print(f"Benchmarking {args.store} in {workdir} ...", file=sys.stderr)
+    started = time.time()
+    results = run_benchmark(client, "bench_conversations", args.sizes, sessions=args.sessions,
+                            dim=args.dim, samples=args.samples, seed=args.seed, layout=args.layout,
+                            rerank=args.rerank)
+    client.close()
+
+    report = {
+        "meta": {
+            "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            "duration_s": round(time.time() - started, 1),
+            "store": args.store,
+            "layout": args.layout,
+            "rerank": layout.rerank,
+            "bytes_per_vector": layout.bytes_per_vector(),
+            "full_bytes_per_vector": full_bytes,
+            "sizes": sorted(args.sizes),
+            "sessions": args.sessions,
+            "dim": args.dim,
+            "samples": args.samples,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    print_table(results, compare)
+    print(f"Vector storage: {layout.bytes_per_vector()} B per message with {layout.spec}"
+          f"{' + full vectors for re-rank' if layout.rerank else ''} ({full_bytes} B with the full layout)",
+          file=sys.stderr)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Results written to {output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
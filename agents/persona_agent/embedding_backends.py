@@ -0,0 +1,78 @@
+"""
+Embedding backends selectable by configuration: OpenAI (default) or a local SentenceTransformer on CPU.
+"""
+
+from langchain_core.embeddings import Embeddings
+
+OPENAI_DEFAULT_MODEL = "text-embedding-3-small"
+LOCAL_DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+# Output sizes of the OpenAI embedding models (without a `dimensions` override)
+OPENAI_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """Local SentenceTransformer embeddings, encoded in batches on CPU threads.
+
+    The model is loaded and warmed up once at construction, so the first real call
+    doesn't pay for lazy initialization.
+    """
+
+    def __init__(self, model_name=LOCAL_DEFAULT_MODEL, device="cpu", batch_size=64, num_threads=None):
+        from sentence_transformers import SentenceTransformer
+
+        if num_threads:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(model_name, device=device)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.model.encode(["warm up"], batch_size=1)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def describe_embeddings(backend="openai", model=None):
+    """Return (model_name, dimension) without building the backend, or None if only loading the model can tell."""
+    if backend == "openai":
+        model = model or OPENAI_DEFAULT_MODEL
+        return model, OPENAI_DIMENSIONS.get(model, 1536)
+    return None
+
+
+def build_embeddings(backend="openai", model=None, batch_size=64, num_threads=None):
+    """Return (embeddings, model_name, dimension) for the named backend ("openai" or "local")."""
+    if backend == "local":
+        local = SentenceTransformerEmbeddings(
+            model or LOCAL_DEFAULT_MODEL,
+            batch_size=batch_size,
+            num_threads=num_threads,
+        )
+        return local, f"local:{local.model_name}", local.dimension
+
+    if backend != "openai":
+        raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected 'openai' or 'local')")
+
+    from langchain_openai import OpenAIEmbeddings
+
+    model = model or OPENAI_DEFAULT_MODEL
+    return OpenAIEmbeddings(model=model), model, OPENAI_DIMENSIONS.get(model, 1536)
@@ -0,0 +1,185 @@
+"""
+Content-hash embedding cache with an in-memory LRU tier and an on-disk SQLite tier.
+"""
+
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an Embeddings object and cache vectors by model name + text hash."""
+
+    def __init__(self, embeddings, model_name, path=None, memory_size=1024, max_disk_bytes=64 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.memory_size = memory_size
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._disk_bytes = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+            self._db.commit()
+            row = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+            self._disk_bytes = row[0]
+
+    def _key(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _get(self, key):
+        """Look up a vector in memory, then on disk; returns None on miss."""
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = array("f", row[0]).tolist()
+                    self._db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _put(self, key, vector):
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is None:
+                return
+            blob = array("f", vector).tobytes()
+            old = self._db.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            self._disk_bytes += len(blob) - (old[0] if old else 0)
+            self._evict_disk()
+            self._db.commit()
+
+    def _evict_disk(self):
+        """Drop least recently used rows until the disk tier is back under 90% of its budget."""
+        if self._disk_bytes <= self.max_disk_bytes:
+            return
+        target = int(self.max_disk_bytes * 0.9)
+        rows = self._db.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC").fetchall()
+        doomed = []
+        for key, size in rows:
+            if self._disk_bytes <= target:
+                break
+            doomed.append((key,))
+            self._disk_bytes -= size
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def _lookup(self, texts):
+        """Cached vectors for texts (None where missing) and the distinct texts still to embed."""
+        vectors = [self._get(self._key(t)) for t in texts]
+        # De-duplicate within the batch so each distinct text is embedded once
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        return vectors, missing
+
+    def _fill(self, texts, vectors, missing, embedded):
+        """Cache the vectors embedded for `missing` and return the complete list for texts."""
+        fresh = dict(zip(missing, embedded))
+        for text, vector in fresh.items():
+            self._put(self._key(text), vector)
+        return [vector if vector is not None else fresh[text] for text, vector in zip(texts, vectors)]
+
+    async def _off_loop(self, fn, *args):
+        # SQLite reads and writes block, so with a disk tier they run in a worker thread
+        if self._db is None:
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    def embed_query(self, text):
+        vectors, missing = self._lookup([text])
+        if not missing:
+            return vectors[0]
+        return self._fill([text], vectors, missing, [self.embeddings.embed_query(text)])[0]
+
+    def embed_documents(self, texts):
+        vectors, missing = self._lookup(texts)
+        if not missing:
+            return vectors
+        return self._fill(texts, vectors, missing, self.embeddings.embed_documents(missing))
+
+    async def aembed_query(self, text):
+        vectors, missing = await self._off_loop(self._lookup, [text])
+        if not missing:
+            return vectors[0]
+        embedded = [await self.embeddings.aembed_query(text)]
+        return (await self._off_loop(self._fill, [text], vectors, missing, embedded))[0]
+
+    async def aembed_documents(self, texts):
+        vectors, missing = await self._off_loop(self._lookup, texts)
+        if not missing:
+            return vectors
+        embedded = await self.embeddings.aembed_documents(missing)
+        return await self._off_loop(self._fill, texts, vectors, missing, embedded)
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def cached_embeddings_from_env(embeddings, model_name):
+    """Build a CachedEmbeddings using EMBEDDING_CACHE_* environment settings."""
+    path = os.getenv("EMBEDDING_CACHE_PATH", "embedding-cache.db")
+    memory_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+    max_mb = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "64"))
+    return CachedEmbeddings(
+        embeddings,
+        model_name=model_name,
+        path=path or None,
+        memory_size=memory_size,
+        max_disk_bytes=int(max_mb * 1024 * 1024),
+    )
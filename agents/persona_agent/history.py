@@ -0,0 +1,161 @@
+"""
+Token-budgeted chat history that keeps recent turns verbatim and folds older turns into a rolling summary.
+"""
+
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+def estimate_tokens(message):
+    """Cheap, offline token estimate (~4 characters per token plus per-message overhead)."""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content) // 4 + 4
+
+
+def fallback_summary(summary, messages, max_chars):
+    """Summary used when the summarizer is unavailable: clipped transcript lines."""
+    lines = [summary] if summary else []
+    for m in messages:
+        speaker = "User" if isinstance(m, HumanMessage) else "Assistant"
+        lines.append(f"{speaker}: {m.content[:120]}")
+    text = "\n".join(lines)
+    return text[-max_chars:]
+
+
+class SummarizingHistory(BaseChatMessageHistory):
+    """Chat history with a token budget.
+
+    The last keep_turns turns stay verbatim. Once fold_turns turns beyond keep_turns have
+    accumulated, or the token budget is exceeded, the oldest messages are folded into the
+    summary by summarizer(summary, messages), and on_summary(summary, covered) is called so
+    the caller can persist it. covered is the total number of messages folded so far.
+    """
+
+    def __init__(self, summarizer=None, on_summary=None, max_tokens=2000, keep_turns=6, fold_turns=4):
+        self.summarizer = summarizer
+        self.on_summary = on_summary
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.fold_turns = fold_turns
+        self.summary = ""
+        self.covered = 0
+        self.recent = []
+
+    @property
+    def messages(self):
+        if not self.summary:
+            return list(self.recent)
+        return [SystemMessage(content=f"Summary of the earlier conversation:\n{self.summary}")] + self.recent
+
+    def load_summary(self, summary, covered):
+        """Restore a persisted summary without triggering on_summary."""
+        self.summary = summary or ""
+        self.covered = covered or 0
+
+    def load_messages(self, messages, covered):
+        """Restore messages that follow the first `covered` ones, without folding or calling on_summary."""
+        self.recent = list(messages)
+        self.covered = covered
+
+    def add_message(self, message):
+        self.recent.append(message)
+        self._fold()
+
+    def add_messages(self, messages):
+        # Fold once for the whole batch
+        self.recent.extend(messages)
+        self._fold()
+
+    def clear(self):
+        self.summary = ""
+        self.covered = 0
+        self.recent = []
+
+    def token_count(self):
+        return sum(estimate_tokens(m) for m in self.messages)
+
+    def _fold(self):
+        # Summarize in batches of turns rather than on every message, unless over budget
+        overflow = len(self.recent) - self.keep_turns * 2
+        if overflow < self.fold_turns * 2 and self.token_count() <= self.max_tokens:
+            return
+
+        keep = len(self.recent)
+        # Keep at most keep_turns user/assistant pairs...
+        keep = min(keep, self.keep_turns * 2)
+        # ...and drop more of the oldest turns while the window alone is over budget
+        summary_tokens = len(self.summary) // 4 + 4 if self.summary else 0
+        while keep > 2 and summary_tokens + sum(estimate_tokens(m) for m in self.recent[-keep:]) > self.max_tokens:
+            keep -= 2
+
+        folded = self.recent[:len(self.recent) - keep]
+        if not folded:
+            return
+
+        try:
+            if self.summarizer is None:
+                raise RuntimeError("no summarizer")
+            summary = self.summarizer(self.summary, folded)
+        except Exception:
+            summary = fallback_summary(self.summary, folded, max_chars=self.max_tokens * 2)
+
+        self.summary = summary
+        self.covered += len(folded)
+        self.recent = self.recent[len(folded):]
+        if self.on_summary is not None:
+            self.on_summary(self.summary, self.covered)
+
+
+class SessionHistoryStore:
+    """LRU map of session_id -> chat history, bounded by session count and total messages.
+
+    Missing sessions are built with factory(session_id) and filled by loader(session_id, history),
+    so a session evicted from memory is transparently rehydrated from storage when touched again.
+    """
+
+    def __init__(self, factory, loader=None, max_sessions=100, max_messages=10000):
+        self.factory = factory
+        self.loader = loader
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.evictions = 0
+        self.rehydrations = 0
+        self._histories = OrderedDict()
+
+    def __contains__(self, session_id):
+        return session_id in self._histories
+
+    def __len__(self):
+        return len(self._histories)
+
+    def get(self, session_id):
+        history = self._histories.get(session_id)
+        if history is not None:
+            self._histories.move_to_end(session_id)
+            # Histories grow between lookups, so re-check the message cap
+            self._evict()
+            return history
+        history = self.factory(session_id)
+        if self.loader is not None:
+            self.loader(session_id, history)
+            self.rehydrations += 1
+        self.put(session_id, history)
+        return history
+
+    def put(self, session_id, history):
+        self._histories[session_id] = history
+        self._histories.move_to_end(session_id)
+        self._evict()
+
+    def message_count(self):
+        return sum(len(h.messages) for h in self._histories.values())
+
+    def _evict(self):
+        # The most recently used session is never evicted
+        while len(self._histories) > 1 and (
+            len(self._histories) > self.max_sessions or self.message_count() > self.max_messages
+        ):
+            self._histories.popitem(last=False)
+            self.evictions += 1
@@ -0,0 +1,141 @@
+"""
+Incremental in-memory BM25 index over stored messages, plus reciprocal rank fusion
+for combining lexical and vector rankings.
+"""
+
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+# Compound tokens keep identifiers, paths and versions whole ("foo.bar_baz", "v2.5", "san-francisco");
+# their word parts are indexed too, so either form matches.
+_TOKEN_RE = re.compile(r"\w+(?:[.\-:/]\w+)*")
+_PART_RE = re.compile(r"\w+")
+
+# Fields kept per document so lexical hits can be returned without a Milvus round trip
+DOC_FIELDS = ("timestamp", "role", "content", "persona", "session_id")
+
+
+def tokenize(text):
+    tokens = []
+    for match in _TOKEN_RE.finditer((text or "").lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def doc_key(row):
+    """Identity of a stored message that is known before Milvus assigns an id."""
+    return (row.get("session_id"), row.get("timestamp"), row.get("role"), row.get("content"))
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked lists of keys: score(key) = sum of 1 / (k + rank). Returns [(key, score)], best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """BM25 index updated as messages are saved; backfilled once from storage on first search.
+
+    Summary rows are not indexed: they are rewritten as the conversation grows.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.loaded = False
+        self._docs = {}          # doc number -> stored fields
+        self._lengths = {}       # doc number -> token count
+        self._postings = {}      # term -> {doc number: term frequency}
+        self._keys = {}          # doc_key -> doc number
+        self._total_length = 0
+        self._next_doc = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, row):
+        """Index one message row; rows already indexed (same doc_key) are ignored."""
+        if row.get("role") == "summary" or not row.get("content"):
+            return
+        key = doc_key(row)
+        terms = Counter(tokenize(row["content"]))
+        with self._lock:
+            if key in self._keys:
+                return
+            doc = self._next_doc
+            self._next_doc += 1
+            self._keys[key] = doc
+            self._docs[doc] = {field: row.get(field) for field in DOC_FIELDS}
+            length = sum(terms.values())
+            self._lengths[doc] = length
+            self._total_length += length
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc] = tf
+
+    def remove(self, keys):
+        """Drop the rows with these doc keys (rows deleted from storage); returns how many were indexed."""
+        removed = 0
+        with self._lock:
+            for key in keys:
+                doc = self._keys.pop(key, None)
+                if doc is None:
+                    continue
+                del self._docs[doc]
+                length = self._lengths.pop(doc)
+                self._total_length -= length
+                # Term frequencies aren't kept per document, so walk the row's terms again
+                for term in set(tokenize(key[3])):
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        continue
+                    postings.pop(doc, None)
+                    if not postings:
+                        del self._postings[term]
+                removed += 1
+        return removed
+
+    def ensure_loaded(self, loader):
+        """Backfill from loader() (an iterable of rows) once; later saves keep the index current."""
+        with self._lock:
+            if self.loaded:
+                return
+            for row in loader():
+                self.add(row)
+            self.loaded = True
+
+    def search(self, query, top_k=5, session_id=None):
+        """Return [(row, score)] for the best BM25 matches, optionally within one session."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._docs)
+            if not terms or not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings.items():
+                    if session_id is not None and self._docs[doc]["session_id"] != session_id:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[doc] / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [(dict(self._docs[doc]), score) for doc, score in best]
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._docs), "terms": len(self._postings), "loaded": self.loaded}
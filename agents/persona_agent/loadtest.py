@@ -0,0 +1,496 @@
+"""
+End-to-end load test: many simulated users chatting through PersonaAgent.chat at once.
+
+    python3 loadtest.py [--users 20] [--turns 10] [--think 0.5] [--ramp 5] [--store milvus|numpy]
+                        [--latency 0.3] [--token-rate 50] [--reply-tokens 40] [--tool-call-rate 0.2]
+                        [--error-rate 0] [--output report.json]
+    python3 loadtest.py --stub-only [--port 8900]
+
+Starts StubOpenAI, a local server speaking the OpenAI chat-completions and embeddings API
+(plus the two Open-Meteo endpoints get_weather calls), and points ChatOpenAI and
+OpenAIEmbeddings at it. Each simulated user is a thread with its own session that sends
+--turns messages through the real chat() path (recall, embedding, the tools agent,
+saving) with --think seconds between turns; users start spread over --ramp seconds.
+The stub answers after --latency seconds plus --reply-tokens at --token-rate tokens/s,
+and asks for a get_weather call on --tool-call-rate of the turns, so tool steps are
+exercised too; --error-rate of the chat requests get a 503 instead. Nothing leaves the
+machine.
+
+The report gives turns/sec and turn latency percentiles (ms) over the turns that
+succeeded, failed turns by the stage that failed, the stub's request
+counts, and resident memory sampled every --sample-interval seconds, with its growth from
+start to end. With --stub-only the stub just serves until interrupted, for pointing
+project.py or server.py at it via OPENAI_BASE_URL.
+"""
+
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+from benchmark import WORDS, percentiles, synthetic_text
+
+CITIES = ["Austin", "Oslo", "Lisbon", "Nairobi", "Osaka", "Lima", "Perth", "Quebec"]
+STUB_EMBEDDING_DIM = 1536
+
+
+def rss_bytes():
+    """Resident set size of this process (peak RSS where the current value isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def stub_vector(text, dim):
+    """Deterministic unit vector for a text (or a list of token ids)."""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(text).encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubOpenAI:
+    """Local OpenAI-compatible server for load tests, run on a background thread.
+
+    latency is the delay before the first token, token_rate the tokens per second after
+    it (0 for no delay). Chat replies are reply_tokens words; when tools are offered and
+    the last message isn't a tool result, tool_call_rate of the requests get a tool call
+    instead (to one of tool_names the request offers). error_rate of the chat requests
+    are answered with a 503, retries included. Decisions are seeded by the request's last
+    message, so a run is repeatable.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.3, token_rate=50.0, reply_tokens=40,
+                 tool_call_rate=0.2, tool_names=("get_weather",), error_rate=0.0, seed=0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.reply_tokens = reply_tokens
+        self.tool_call_rate = tool_call_rate
+        self.tool_names = tuple(tool_names)
+        self.error_rate = error_rate
+        self.seed = seed
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _pause(self, tokens):
+        time.sleep(self.latency + (tokens / self.token_rate if self.token_rate else 0))
+
+    def fails(self, body):
+        """Whether a chat-completions request is answered with an error (seeded like chat_completion)."""
+        if not self.error_rate:
+            return False
+        messages = body.get("messages") or []
+        last = messages[-1] if messages else {}
+        return random.Random(f"error:{self.seed}:{len(messages)}:{last.get('content')}").random() < self.error_rate
+
+    def chat_completion(self, body):
+        """(message dict, finish_reason, completion tokens) for a chat-completions request."""
+        messages = body.get("messages") or []
+        last = messages[-1] if messages else {}
+        rng = random.Random(f"{self.seed}:{len(messages)}:{last.get('content')}")
+        offered = [t["function"]["name"] for t in body.get("tools") or [] if t.get("type") == "function"]
+        callable_tools = [name for name in self.tool_names if name in offered]
+        if callable_tools and last.get("role") != "tool" and rng.random() < self.tool_call_rate:
+            self.count("tool_calls")
+            name = rng.choice(callable_tools)
+            arguments = {"city": rng.choice(CITIES)} if name == "get_weather" else {"query": synthetic_text(rng, 3)}
+            call = {"id": f"call_{rng.getrandbits(48):012x}", "type": "function",
+                    "function": {"name": name, "arguments": json.dumps(arguments)}}
+            return {"role": "assistant", "content": None, "tool_calls": [call]}, "tool_calls", 12
+        words = [rng.choice(WORDS) for _ in range(self.reply_tokens)]
+        return {"role": "assistant", "content": " ".join(words).capitalize() + "."}, "stop", self.reply_tokens
+
+    def embeddings(self, body):
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dim = body.get("dimensions") or STUB_EMBEDDING_DIM
+        data = []
+        for i, text in enumerate(inputs or []):
+            vector = stub_vector(text, dim)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        time.sleep(self.latency / 4)
+        return {"object": "list", "data": data, "model": body.get("model"),
+                "usage": {"prompt_tokens": len(data), "total_tokens": len(data)}}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, body, status=200, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, message, finish_reason):
+                # Server-sent events: the reply a word at a time, paced at the token rate
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": "stub"}
+
+                def send(delta, finish=None):
+                    payload = dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": finish}])
+                    self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                    self.wfile.flush()
+
+                time.sleep(stub.latency)
+                if message.get("tool_calls"):
+                    send({"role": "assistant", "tool_calls": [dict(call, index=i) for i, call
+                                                              in enumerate(message["tool_calls"])]})
+                else:
+                    words = message["content"].split(" ")
+                    for i, word in enumerate(words):
+                        send({"role": "assistant", "content": word if i == 0 else " " + word})
+                        if stub.token_rate:
+                            time.sleep(1 / stub.token_rate)
+                send({}, finish_reason)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if path.endswith("/chat/completions"):
+                    stub.count("chat")
+                    if stub.fails(body):
+                        stub.count("chat_errors")
+                        # Ask the client to retry at once, so a failing run stays quick
+                        return self._send_json({"error": {"message": "stub overloaded", "type": "server_error"}},
+                                               status=503, headers={"retry-after-ms": "10"})
+                    message, finish_reason, tokens = stub.chat_completion(body)
+                    if body.get("stream"):
+                        return self._stream(message, finish_reason)
+                    stub._pause(tokens)
+                    self._send_json({
+                        "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                        "usage": {"prompt_tokens": len(body.get("messages") or []), "completion_tokens": tokens,
+                                  "total_tokens": len(body.get("messages") or []) + tokens},
+                    })
+                elif path.endswith("/embeddings"):
+                    stub.count("embeddings")
+                    self._send_json(stub.embeddings(body))
+                else:
+                    self._send_json({"error": {"message": f"unknown endpoint {path}"}}, status=404)
+
+            def do_GET(self):
+                # The Open-Meteo endpoints behind get_weather
+                path = urlparse(self.path).path
+                if path == "/v1/search":
+                    stub.count("geocode")
+                    body = {"results": [{"name": "Austin", "admin1": "Texas", "country": "United States",
+                                         "latitude": 30.26715, "longitude": -97.74306}]}
+                elif path == "/v1/forecast":
+                    stub.count("forecast")
+                    body = {"daily": {"time": ["2024-01-01", "2024-01-02", "2024-01-03"],
+                                      "temperature_2m_min": [40, 41, 42], "temperature_2m_max": [60, 61, 62]}}
+                else:
+                    return self._send_json({"error": {"message": f"unknown endpoint {path}"}}, status=404)
+                time.sleep(stub.latency / 4)
+                self._send_json(body)
+
+        return Handler
+
+
+@contextlib.contextmanager
+def stub_backends(project, stub):
+    """Point the agent's chat model, embeddings and weather tool at the stub for the duration of the block."""
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    from embedding_cache import CachedEmbeddings
+
+    runtime = project.runtime
+    saved = {name: runtime.__dict__[name] for name in ("embeddings", "llm") if runtime.built(name)}
+    saved_urls = project.WEATHER_GEOCODE_URL, project.WEATHER_FORECAST_URL
+    # The stub takes plain text, so skip the client-side tokenization (and tiktoken's download)
+    embeddings = OpenAIEmbeddings(model="text-embedding-3-small", base_url=stub.base_url, api_key="sk-stub",
+                                  check_embedding_ctx_length=False)
+    runtime.embeddings = CachedEmbeddings(embeddings, model_name="text-embedding-3-small")
+    runtime.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.8, base_url=stub.base_url, api_key="sk-stub")
+    project.WEATHER_GEOCODE_URL = f"{stub.url}/v1/search"
+    project.WEATHER_FORECAST_URL = f"{stub.url}/v1/forecast"
+    try:
+        yield
+    finally:
+        project.WEATHER_GEOCODE_URL, project.WEATHER_FORECAST_URL = saved_urls
+        for name in ("embeddings", "llm"):
+            if name in saved:
+                setattr(runtime, name, saved[name])
+            else:
+                delattr(runtime, name)
+
+
+def failed_stage(spans):
+    """Stage a failed turn failed in: its first errored span below the turn itself."""
+    return next((span["stage"] for span in spans or () if span["error"] and span["stage"] != "turn"), "turn")
+
+
+def user_message(rng, turn):
+    if rng.random() < 0.25:
+        return f"What's the weather like in {rng.choice(CITIES)} this week?"
+    return f"Turn {turn}: tell me about {synthetic_text(rng, 6)}"
+
+
+def run_load(client, collection_name, stub, users=20, turns=10, think=0.5, ramp=5.0, sample_interval=1.0,
+             seed=0):
+    """Drive `users` concurrent sessions through `turns` chat() calls each against the stub; returns a report dict."""
+    import project
+    from lexical_index import LexicalIndex
+    from write_behind import WriteBehindQueue
+
+    latencies, errors = [], Counter()
+    done = [0]
+    lock = threading.Lock()
+    timeline = []
+    stop = threading.Event()
+
+    def sample(started):
+        with lock:
+            completed = done[0]
+        timeline.append({"t_s": round(time.monotonic() - started, 2), "rss_mb": round(rss_bytes() / 2**20, 1),
+                         "turns": completed})
+
+    with stub_backends(project, stub), contextlib.redirect_stdout(io.StringIO()):
+        if not client.has_collection(collection_name):
+            project.create_conversation_collection(client, collection_name, dim=project.runtime.embedding_dim)
+        # Like the server, sessions share one BM25 index and (with WRITE_BEHIND) one write queue
+        lexical = LexicalIndex()
+        writer = None
+        if project.WRITE_BEHIND:
+            writer = WriteBehindQueue(client, collection_name, project.runtime.embeddings,
+                                      project.runtime.embedding_dim,
+                                      batch_size=project.WRITE_BEHIND_BATCH_SIZE,
+                                      flush_interval=project.WRITE_BEHIND_FLUSH_SECONDS)
+        agents = [project.PersonaAgent(client, collection_name, session_id=f"load_{seed}_{i:04d}",
+                                       write_behind=writer if writer is not None else False,
+                                       lexical_index=lexical)
+                  for i in range(users)]
+        # Build the shared agent executor pieces once, outside the timings
+        agents[0].agent_with_history
+
+        def simulate(index, agent):
+            rng = random.Random(f"{seed}:{index}")
+            time.sleep(ramp * index / max(1, users))
+            for turn in range(turns):
+                started = time.perf_counter()
+                try:
+                    reply = agent.chat(user_message(rng, turn))
+                except Exception as e:
+                    failure = type(e).__name__
+                else:
+                    # chat() reports a failed turn by returning None rather than raising
+                    failure = failed_stage(agent.last_turn) if reply is None else None
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                with lock:
+                    # Failed turns stay out of the latencies and the throughput
+                    if failure is not None:
+                        errors[failure] += 1
+                    else:
+                        latencies.append(elapsed_ms)
+                        done[0] += 1
+                if think and turn < turns - 1:
+                    time.sleep(rng.uniform(0.5, 1.5) * think)
+
+        def sampler(started):
+            while not stop.wait(sample_interval):
+                sample(started)
+
+        started = time.monotonic()
+        sample(started)
+        watcher = threading.Thread(target=sampler, args=(started,), name="rss-sampler", daemon=True)
+        watcher.start()
+        threads = [threading.Thread(target=simulate, args=(i, agent), name=f"user-{i}")
+                   for i, agent in enumerate(agents)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.monotonic() - started
+        stop.set()
+        watcher.join()
+        sample(started)
+        for agent in agents:
+            agent.close()
+        if writer is not None:
+            writer.close()
+
+    rss = [point["rss_mb"] for point in timeline]
+    return {
+        "users": users,
+        "turns_per_user": turns,
+        "turns": len(latencies),
+        "errors": dict(errors),
+        "duration_s": round(duration, 2),
+        "turns_per_s": round(len(latencies) / duration, 2) if duration > 0 else None,
+        "latency": percentiles(latencies),
+        "memory": {"start_mb": rss[0], "end_mb": rss[-1], "peak_mb": max(rss),
+                   "growth_mb": round(rss[-1] - rss[0], 1), "timeline": timeline},
+        "stub_requests": dict(stub.requests),
+    }
+
+
+def print_report(report, file=sys.stderr):
+    latency, memory = report["latency"], report["memory"]
+    print(f"{report['turns']} turns from {report['users']} users in {report['duration_s']}s: "
+          f"{report['turns_per_s']} turns/s, {sum(report['errors'].values())} errors", file=file)
+    if latency.get("count"):
+        print(f"  turn latency p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+              f"p99 {latency['p99_ms']:.0f} ms", file=file)
+    print(f"  memory {memory['start_mb']} MB -> {memory['end_mb']} MB (peak {memory['peak_mb']} MB, "
+          f"{memory['growth_mb']:+} MB)", file=file)
+    print(f"  {'t (s)':>8} {'turns':>7} {'RSS MB':>9}", file=file)
+    for point in memory["timeline"]:
+        print(f"  {point['t_s']:>8.1f} {point['turns']:>7} {point['rss_mb']:>9.1f}", file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test PersonaAgent.chat against a local OpenAI stub")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users (one session each)")
+    parser.add_argument("--turns", type=int, default=10, help="chat turns per user")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds a user waits between turns")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument("--latency", type=float, default=0.3, help="stub seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="stub tokens per second (0: instant)")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="words in each stub reply")
+    parser.add_argument("--tool-call-rate", type=float, default=0.2, help="share of turns answered with a tool call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of chat requests answered with a 503")
+    parser.add_argument("--tools", default="get_weather", help="comma-separated tools the stub may call")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="seconds between memory samples")
+    parser.add_argument("--store", choices=("milvus", "numpy"), default="milvus")
+    parser.add_argument("--workdir", help="where the scratch database goes (default: a temporary directory)")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-only", action="store_true", help="only run the stub server until interrupted")
+    parser.add_argument("--port", type=int, default=0, help="stub port (default: any free port)")
+    args = parser.parse_args()
+
+    stub = StubOpenAI(port=args.port, latency=args.latency, token_rate=args.token_rate,
+                      reply_tokens=args.reply_tokens, tool_call_rate=args.tool_call_rate,
+                      tool_names=[t.strip() for t in args.tools.split(",") if t.strip()],
+                      error_rate=args.error_rate, seed=args.seed)
+    if args.stub_only:
+        print(f"✓ Stub serving at {stub.base_url}")
+        print(f"  OPENAI_BASE_URL={stub.base_url} WEATHER_GEOCODE_URL={stub.url}/v1/search "
+              f"WEATHER_FORECAST_URL={stub.url}/v1/forecast")
+        stub.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            stub.stop()
+        return
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="persona-load-")
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    # Keep anything project writes inside the scratch directory, and nothing on the network
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+    os.environ["EMBEDDING_BACKEND"] = "openai"
+    os.environ["EMBEDDING_CACHE_PATH"] = ""
+    os.environ["SEARCH_PROVIDER"] = "stub"
+    os.environ["VECTOR_STORE"] = args.store
+
+    if args.store == "numpy":
+        from numpy_store import NumpyVectorStore
+
+        client = NumpyVectorStore(os.path.join(workdir, "load.npstore"))
+    else:
+        from pymilvus import MilvusClient
+        from vector_layout import RerankingClient
+
+        client = RerankingClient(MilvusClient(uri=os.path.join(workdir, "load.db")))
+
+    print(f"Load testing {args.users} users x {args.turns} turns ({args.store} in {workdir}) ...", file=sys.stderr)
+    started = time.time()
+    with stub:
+        report = run_load(client, "load_conversations", stub, users=args.users, turns=args.turns,
+                          think=args.think, ramp=args.ramp, sample_interval=args.sample_interval, seed=args.seed)
+    client.close()
+    report["meta"] = {
+        "started": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "store": args.store,
+        "stub": {"latency_s": args.latency, "token_rate": args.token_rate, "reply_tokens": args.reply_tokens,
+                 "tool_call_rate": args.tool_call_rate, "tools": args.tools},
+        "think_s": args.think,
+        "ramp_s": args.ramp,
+    }
+    print_report(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Report written to {output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
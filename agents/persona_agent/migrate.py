@@ -0,0 +1,106 @@
+"""
+One-shot migration of a legacy dynamic-field conversation collection to the typed layout.
+
+    python3 migrate.py [--collection persona_conversations] [--batch-size 1000] [--drop-source]
+
+Rows are copied in primary-key (insertion) order in batches into a new typed collection,
+ISO timestamps are converted to epoch milliseconds, and the collections are then swapped:
+the old one is kept as <collection>_legacy unless --drop-source is given.
+"""
+
+import argparse
+from datetime import datetime
+
+from project import (
+    COLLECTION_NAME,
+    PERSONA_MAX_LENGTH,
+    ROLE_MAX_LENGTH,
+    SESSION_ID_MAX_LENGTH,
+    clip_text,
+    create_conversation_collection,
+    is_typed_collection,
+    runtime,
+)
+
+
+def _to_epoch_ms(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def convert_row(row):
+    """Map a legacy row onto the typed fields; unknown keys are kept as dynamic fields."""
+    data = {k: v for k, v in row.items() if k != "id"}
+    data["timestamp"] = _to_epoch_ms(row.get("timestamp"))
+    data["session_id"] = clip_text(str(row.get("session_id") or ""), SESSION_ID_MAX_LENGTH)
+    data["role"] = clip_text(str(row.get("role") or ""), ROLE_MAX_LENGTH)
+    data["persona"] = clip_text(str(row.get("persona") or "neutral"), PERSONA_MAX_LENGTH)
+    data["content"] = clip_text(str(row.get("content") or ""))
+    return data
+
+
+def migrate(client, collection_name, batch_size=1000, drop_source=False, dim=None):
+    """Copy a legacy collection into the typed layout and swap it in. Returns rows copied."""
+    if not client.has_collection(collection_name):
+        print(f"Collection '{collection_name}' does not exist; nothing to migrate.")
+        return 0
+    if is_typed_collection(client, collection_name):
+        print(f"Collection '{collection_name}' already uses the typed layout.")
+        return 0
+
+    target = f"{collection_name}_typed"
+    legacy = f"{collection_name}_legacy"
+    if client.has_collection(target):
+        # Leftover from an interrupted run; start the copy over
+        client.drop_collection(target)
+    create_conversation_collection(client, target, dim)
+
+    client.load_collection(collection_name)
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter="",
+        output_fields=["*"],
+    )
+    copied = 0
+    try:
+        while True:
+            page = iterator.next()
+            if not page:
+                break
+            client.insert(collection_name=target, data=[convert_row(row) for row in page])
+            copied += len(page)
+            print(f"  copied {copied} rows")
+    finally:
+        iterator.close()
+
+    if drop_source:
+        client.drop_collection(collection_name)
+    else:
+        if client.has_collection(legacy):
+            client.drop_collection(legacy)
+        client.rename_collection(collection_name, legacy)
+    client.rename_collection(target, collection_name)
+    client.load_collection(collection_name)
+
+    print(f"✓ Migrated {copied} rows into typed collection '{collection_name}'")
+    if not drop_source:
+        print(f"  Previous collection kept as '{legacy}'")
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate conversation storage to the typed schema")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-source", action="store_true", help="drop the legacy collection instead of keeping it")
+    args = parser.parse_args()
+    migrate(runtime.milvus, args.collection, batch_size=args.batch_size, drop_source=args.drop_source)
+
+
+if __name__ == "__main__":
+    main()
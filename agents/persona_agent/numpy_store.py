@@ -0,0 +1,464 @@
+"""
+In-process exact vector search over memory-mapped NumPy arrays.
+
+NumpyVectorStore implements the subset of the MilvusClient API used in this project
+(create/has/describe/drop collection, insert, upsert, delete, query, query_iterator, search,
+compact), so it can replace Milvus Lite for small corpora where per-query overhead dominates.
+The template agent imports this module too (with vector_layout.py) rather than keeping a copy.
+
+Each collection is a directory holding:
+    vectors.npy   the searched vectors, memory-mapped and grown by doubling: normalized embeddings
+                  (float32 or float16), or compact codes for a reduced/int8/binary layout
+    full.npy      full-precision embeddings for re-ranking, if the layout keeps them
+    rows.jsonl    append-only log of inserted rows (without vectors) and deletions
+    meta.json     dimension, dtype, field names, collection properties (including the layout) and,
+                  after a compaction, the next id to assign
+"""
+
+import ast
+import json
+import os
+import re
+import shutil
+import threading
+
+import numpy as np
+
+from vector_layout import LAYOUTS, VectorLayout, normalize
+
+_CONDITION_RE = re.compile(r'\s*(\w+)\s*(==|!=|>=|<=|>|<|in)\s*("(?:[^"\\]|\\.)*"|\[[^\]]*\]|-?\d+(?:\.\d+)?)\s*')
+_AND_RE = re.compile(r"and\b", re.IGNORECASE)
+_SEARCH_BLOCK_ROWS = 65536
+
+
+def parse_filter(expr):
+    """Parse a Milvus-style filter made of comparisons joined by `and` into (field, op, value) tuples."""
+    expr = (expr or "").strip()
+    conditions = []
+    pos = 0
+    while pos < len(expr):
+        match = _CONDITION_RE.match(expr, pos)
+        if not match:
+            raise ValueError(f"Unsupported filter expression: {expr}")
+        field, op, raw = match.groups()
+        conditions.append((field, op, ast.literal_eval(raw)))
+        pos = match.end()
+        if pos < len(expr):
+            joiner = _AND_RE.match(expr, pos)
+            if not joiner:
+                raise ValueError(f"Unsupported filter expression: {expr}")
+            pos = joiner.end()
+    return conditions
+
+
+class _IndexParams:
+    """Accepts add_index calls; exact search needs no index."""
+
+    def add_index(self, **kwargs):
+        pass
+
+
+class _Collection:
+    def __init__(self, path, dim=None, dtype="float32", fields=None, properties=None):
+        self.path = path
+        self.lock = threading.RLock()
+        meta_path = os.path.join(path, "meta.json")
+        if dim is not None:
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "dtype": dtype, "fields": fields or [], "properties": properties or {}}, f)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.fields = meta["fields"]
+        self.properties = meta.get("properties", {})
+        self._meta = meta
+        self.layout = VectorLayout.from_properties(self.properties, self.dim)
+        # Codes of a compact layout keep their own dtype; float codes follow the store's dtype
+        self.code_dtype = self.dtype if self.layout.code_dtype == np.float32 else np.dtype(self.layout.code_dtype)
+
+        self.rows = []          # slot -> row dict, or None once deleted
+        self.id_to_slot = {}
+        # Ids are never reused, even for rows dropped by compaction
+        self.next_id = meta.get("next_id", 1)
+        self._columns = {}
+        self._replay()
+        capacity = max(len(self.rows), 1024)
+        self.vectors = self._open_array("vectors", self.code_dtype, self.layout.code_width, capacity)
+        self.full = None
+        if self.layout.rerank:
+            self.full = self._open_array("full", self.dtype, self.dim, capacity)
+        self._log = open(os.path.join(path, "rows.jsonl"), "a", encoding="utf-8")
+
+    def _replay(self):
+        log_path = os.path.join(self.path, "rows.jsonl")
+        if not os.path.exists(log_path):
+            return
+        with open(log_path, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["op"] == "insert":
+                    row = entry["row"]
+                    self.id_to_slot[row["id"]] = len(self.rows)
+                    self.rows.append(row)
+                    if isinstance(row["id"], int):
+                        self.next_id = max(self.next_id, row["id"] + 1)
+                else:
+                    slot = self.id_to_slot.pop(entry["id"], None)
+                    if slot is not None:
+                        self.rows[slot] = None
+
+    def _open_array(self, name, dtype, width, min_capacity):
+        path = os.path.join(self.path, f"{name}.npy")
+        if os.path.exists(path):
+            array = np.load(path, mmap_mode="r+")
+            if array.shape[0] >= min_capacity:
+                return array
+            return self._grow(name, array, min_capacity)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(min_capacity, width))
+
+    def _grow(self, name, array, min_capacity):
+        """Copy into a larger file (capacity doubles) and swap it in."""
+        path = os.path.join(self.path, f"{name}.npy")
+        tmp_path = os.path.join(self.path, f"{name}.tmp.npy")
+        capacity = max(min_capacity, array.shape[0] * 2)
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=array.dtype, shape=(capacity, array.shape[1]))
+        grown[:len(self.rows)] = array[:len(self.rows)]
+        grown.flush()
+        del grown, array
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode="r+")
+
+    def column(self, field):
+        """Metadata column as an object array (None for deleted rows or missing keys)."""
+        col = self._columns.get(field)
+        if col is None:
+            col = np.empty(len(self.rows), dtype=object)
+            col[:] = [row.get(field) if row is not None else None for row in self.rows]
+            self._columns[field] = col
+        return col
+
+    def mask(self, expr):
+        """Boolean mask of live rows matching a filter expression."""
+        alive = np.fromiter((row is not None for row in self.rows), dtype=bool, count=len(self.rows))
+        for field, op, value in parse_filter(expr):
+            col = self.column(field)
+            if op == "==":
+                alive &= col == value
+            elif op == "!=":
+                alive &= col != value
+            elif op == "in":
+                wanted = set(value)
+                alive &= np.fromiter((v in wanted for v in col), dtype=bool, count=len(col))
+            else:
+                compare = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}[op]
+                alive &= np.fromiter(
+                    (v is not None and bool(compare(v, value)) for v in col), dtype=bool, count=len(col)
+                )
+        return alive
+
+    def insert(self, data):
+        ids = []
+        vectors = normalize(np.asarray([row["vector"] for row in data], dtype=np.float32).reshape(len(data), self.dim))
+
+        start = len(self.rows)
+        if start + len(data) > self.vectors.shape[0]:
+            self.vectors = self._grow("vectors", self.vectors, start + len(data))
+            if self.full is not None:
+                self.full = self._grow("full", self.full, start + len(data))
+        self.vectors[start:start + len(data)] = self.layout.encode(vectors).astype(self.code_dtype)
+        self.vectors.flush()
+        if self.full is not None:
+            self.full[start:start + len(data)] = vectors.astype(self.dtype)
+            self.full.flush()
+
+        for row in data:
+            row = {k: v for k, v in row.items() if k != "vector"}
+            if "id" not in row:
+                row["id"] = self.next_id
+                self.next_id += 1
+            self.id_to_slot[row["id"]] = len(self.rows)
+            self.rows.append(row)
+            ids.append(row["id"])
+            self._log.write(json.dumps({"op": "insert", "row": row}) + "\n")
+        self._log.flush()
+        self._columns = {}
+        return ids
+
+    def delete(self, ids):
+        deleted = 0
+        for row_id in ids:
+            slot = self.id_to_slot.pop(row_id, None)
+            if slot is None:
+                continue
+            self.rows[slot] = None
+            self._log.write(json.dumps({"op": "delete", "id": row_id}) + "\n")
+            deleted += 1
+        self._log.flush()
+        self._columns = {}
+        return deleted
+
+    def compact_into(self, path, block_rows=_SEARCH_BLOCK_ROWS):
+        """Write a copy without deleted rows to a new collection directory; returns rows kept.
+
+        Vectors and codes are copied as stored (not re-encoded), a block of rows at a time.
+        """
+        live = np.array([slot for slot, row in enumerate(self.rows) if row is not None], dtype=np.int64)
+        os.makedirs(path)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(dict(self._meta, next_id=self.next_id), f)
+        capacity = max(len(live), 1024)
+        for name, array in (("vectors", self.vectors), ("full", self.full)):
+            if array is None:
+                continue
+            copy = np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=array.dtype,
+                                             shape=(capacity, array.shape[1]))
+            for start in range(0, len(live), block_rows):
+                block = live[start:start + block_rows]
+                copy[start:start + len(block)] = array[block]
+            copy.flush()
+            del copy
+        with open(os.path.join(path, "rows.jsonl"), "w", encoding="utf-8") as f:
+            for slot in live.tolist():
+                f.write(json.dumps({"op": "insert", "row": self.rows[slot]}) + "\n")
+        return len(live)
+
+    def vector(self, slot):
+        """Stored vector of a slot: full precision if kept, otherwise decoded from its code."""
+        if self.full is not None:
+            return self.full[slot].astype(np.float32)
+        if not self.layout.compact:
+            return self.vectors[slot].astype(np.float32)
+        return self.layout.decode(self.vectors[slot:slot + 1])[0]
+
+    def project(self, slot, output_fields):
+        row = self.rows[slot]
+        if not output_fields or "*" in output_fields:
+            out = dict(row)
+            if output_fields:
+                out["vector"] = self.vector(slot).tolist()
+            return out
+        out = {"id": row["id"]}
+        for field in output_fields:
+            if field == "vector":
+                out["vector"] = self.vector(slot).tolist()
+            elif field in row:
+                out[field] = row[field]
+        return out
+
+    def close(self):
+        self._log.close()
+        self.vectors.flush()
+        if self.full is not None:
+            self.full.flush()
+
+
+class _QueryIterator:
+    def __init__(self, collection, slots, batch_size, output_fields):
+        self._collection = collection
+        self._slots = slots
+        self._batch_size = batch_size
+        self._output_fields = output_fields
+        self._pos = 0
+
+    def next(self):
+        page = self._slots[self._pos:self._pos + self._batch_size]
+        self._pos += len(page)
+        return [self._collection.project(slot, self._output_fields) for slot in page]
+
+    def close(self):
+        pass
+
+
+class NumpyVectorStore:
+    """MilvusClient-compatible store doing exact cosine search with NumPy.
+
+    dtype="float16" halves disk and memory; scores are computed in float32 either way.
+    A collection created with a compact layout (see vector_layout) scans its codes instead,
+    then re-ranks rerank_candidates times the limit exactly if it keeps full vectors.
+    """
+
+    VECTOR_LAYOUTS = LAYOUTS
+
+    def __init__(self, root, dtype="float32", rerank_candidates=4):
+        self.root = root
+        self.dtype = dtype
+        self.rerank_candidates = rerank_candidates
+        self._collections = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, collection_name):
+        return os.path.join(self.root, collection_name)
+
+    def _get(self, collection_name):
+        with self._lock:
+            collection = self._collections.get(collection_name)
+            if collection is None:
+                if not self.has_collection(collection_name):
+                    raise ValueError(f"Collection '{collection_name}' does not exist")
+                collection = _Collection(self._path(collection_name))
+                self._collections[collection_name] = collection
+            return collection
+
+    def has_collection(self, collection_name):
+        return os.path.exists(os.path.join(self._path(collection_name), "meta.json"))
+
+    @staticmethod
+    def prepare_index_params():
+        return _IndexParams()
+
+    def create_collection(self, collection_name, dimension=None, schema=None, properties=None, **kwargs):
+        if self.has_collection(collection_name):
+            return
+        fields = []
+        if schema is not None:
+            for field in schema.fields:
+                fields.append(field.name)
+                if field.name == "vector":
+                    dimension = field.params.get("dim")
+        # Rows always carry full-dimension vectors; the layout decides what is stored
+        layout = VectorLayout.from_properties(properties, dimension)
+        with self._lock:
+            self._collections[collection_name] = _Collection(
+                self._path(collection_name), dim=layout.full_dim, dtype=self.dtype, fields=fields,
+                properties=properties,
+            )
+
+    def describe_collection(self, collection_name):
+        collection = self._get(collection_name)
+        fields = [{"name": "id", "params": {}}, {"name": "vector", "params": {"dim": collection.dim}}]
+        fields += [{"name": name, "params": {}} for name in collection.fields if name not in ("id", "vector")]
+        return {"collection_name": collection_name, "fields": fields, "enable_dynamic_field": True,
+                "properties": dict(collection.properties)}
+
+    def drop_collection(self, collection_name):
+        with self._lock:
+            collection = self._collections.pop(collection_name, None)
+            if collection is not None:
+                collection.close()
+            shutil.rmtree(self._path(collection_name), ignore_errors=True)
+
+    def load_collection(self, collection_name):
+        self._get(collection_name)
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def insert(self, collection_name, data):
+        collection = self._get(collection_name)
+        with collection.lock:
+            ids = collection.insert(data)
+        return {"insert_count": len(ids), "ids": ids}
+
+    def upsert(self, collection_name, data):
+        collection = self._get(collection_name)
+        with collection.lock:
+            collection.delete([row["id"] for row in data if "id" in row])
+            ids = collection.insert(data)
+        return {"upsert_count": len(ids), "ids": ids}
+
+    def delete(self, collection_name, ids=None, filter=None):
+        collection = self._get(collection_name)
+        with collection.lock:
+            if ids is None:
+                slots = np.flatnonzero(collection.mask(filter or ""))
+                ids = [collection.rows[slot]["id"] for slot in slots]
+            return collection.delete(ids)
+
+    def compact(self, collection_name):
+        """Rewrite a collection without its deleted rows, shrinking the log and vector files.
+
+        The copy is built beside the collection and swapped in with two renames.
+        Returns {"rows": rows kept, "removed": deleted rows dropped}.
+        """
+        path = self._path(collection_name)
+        collection = self._get(collection_name)
+        with self._lock, collection.lock:
+            total = len(collection.rows)
+            shutil.rmtree(f"{path}.compact", ignore_errors=True)
+            kept = collection.compact_into(f"{path}.compact")
+            collection.close()
+            os.replace(path, f"{path}.old")
+            os.replace(f"{path}.compact", path)
+            shutil.rmtree(f"{path}.old", ignore_errors=True)
+            self._collections[collection_name] = _Collection(path)
+        return {"rows": kept, "removed": total - kept}
+
+    def query(self, collection_name, filter="", output_fields=None, limit=None, **kwargs):
+        collection = self._get(collection_name)
+        with collection.lock:
+            slots = np.flatnonzero(collection.mask(filter))
+            if limit:
+                slots = slots[:limit]
+            return [collection.project(slot, output_fields) for slot in slots]
+
+    def query_iterator(self, collection_name, batch_size=1000, filter="", output_fields=None, **kwargs):
+        collection = self._get(collection_name)
+        with collection.lock:
+            slots = np.flatnonzero(collection.mask(filter)).tolist()
+        return _QueryIterator(collection, slots, batch_size, output_fields)
+
+    def search(self, collection_name, data, limit=10, filter=None, output_fields=None, **kwargs):
+        """Exact cosine top-k for a batch of query vectors: blocked matmul + argpartition.
+
+        For a compact layout the scan scores codes, and with full vectors kept the
+        rerank_candidates * limit best candidates are re-scored exactly.
+        """
+        collection = self._get(collection_name)
+        layout = collection.layout
+        queries = normalize(np.asarray(data, dtype=np.float32).reshape(len(data), collection.dim))
+        prepared = layout.prepare(queries)
+
+        with collection.lock:
+            count = len(collection.rows)
+            mask = collection.mask(filter or "")
+            alive = int(mask.sum())
+            k = min(limit * self.rerank_candidates if layout.rerank else limit, alive)
+            if k == 0:
+                return [[] for _ in queries]
+
+            # Running per-query top-k over blocks, so memory stays O(queries x block)
+            best_scores = np.empty((len(queries), 0), dtype=np.float32)
+            best_slots = np.empty((len(queries), 0), dtype=np.int64)
+            for start in range(0, count, _SEARCH_BLOCK_ROWS):
+                end = min(start + _SEARCH_BLOCK_ROWS, count)
+                block_mask = mask[start:end]
+                if not block_mask.any():
+                    continue
+                scores = layout.scores(prepared, collection.vectors[start:end])
+                scores[:, ~block_mask] = -np.inf
+                kb = min(k, end - start)
+                top = np.argpartition(-scores, kb - 1, axis=1)[:, :kb]
+                best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                best_slots = np.concatenate([best_slots, top + start], axis=1)
+                if best_scores.shape[1] > k:
+                    keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_slots = np.take_along_axis(best_slots, keep, axis=1)
+
+            if layout.rerank:
+                # Exact scores for the candidates only, from the full-precision vectors
+                full = np.asarray(collection.full[best_slots.ravel()], dtype=np.float32).reshape(
+                    len(queries), best_slots.shape[1], collection.dim)
+                exact = np.einsum("qkd,qd->qk", full, queries)
+                best_scores = np.where(best_scores == -np.inf, -np.inf, exact)
+
+            order = np.argsort(-best_scores, axis=1)[:, :min(limit, alive)]
+            results = []
+            for q_scores, q_slots, q_order in zip(best_scores, best_slots, order):
+                hits = []
+                for i in q_order:
+                    if q_scores[i] == -np.inf:
+                        continue
+                    entity = collection.project(int(q_slots[i]), output_fields)
+                    hits.append({"id": entity["id"], "distance": float(q_scores[i]), "entity": entity})
+                results.append(hits)
+            return results
+
+    def close(self):
+        with self._lock:
+            for collection in self._collections.values():
+                collection.close()
+            self._collections = {}
@@ -1,58 +1,286 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import os
+import re
+import json
+import hashlib
+import asyncio
+import importlib.util
+import logging
+import threading
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module=r"milvus_lite")
+# Milvus Lite has no MVCC timestamps, which query_iterator logs a warning about on every scan
+logging.getLogger("pymilvus").setLevel(logging.ERROR)
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents import AgentExecutor, create_openai_tools_agent
-from pymilvus import MilvusClient
-from langchain_core.tools import Tool, StructuredTool
-import requests
+from langchain_core.tools import StructuredTool
+from ttl_cache import TTLCache
+from embedding_cache import cached_embeddings_from_env
+from embedding_backends import build_embeddings, describe_embeddings
+from write_behind import WriteBehindQueue
+from history import SessionHistoryStore, SummarizingHistory
+from lexical_index import LexicalIndex, doc_key, reciprocal_rank_fusion
+from response_cache import ResponseCache
+from vector_layout import FULL_VECTOR_FIELD, RerankingClient, VectorLayout
+from telemetry import Telemetry, TelemetryCallbackHandler, format_stats
 
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-EMBEDDING_DIM = 1536
 METRIC_TYPE = "COSINE"
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "persona_conversations")
+
+# Typed collection layout; roles and personas are short enum-like strings
+SESSION_ID_MAX_LENGTH = 64
+ROLE_MAX_LENGTH = 16
+PERSONA_MAX_LENGTH = 64
+CONTENT_MAX_LENGTH = 65535
+# Session ids are stored in a VARCHAR field and quoted into filter expressions
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_.:-]+")
+# Scalar fields used in filters, each with an inverted index
+INDEXED_FIELDS = ["session_id", "timestamp", "role", "persona"]
 
 # Load .env
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "32"))
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "1.0"))
+# "summary" keeps a token-budgeted window plus a rolling summary; "full" replays the whole session
+HISTORY_STRATEGY = os.getenv("HISTORY_STRATEGY", "summary").lower()
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "2000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+# Messages replayed on resume; older ones are paged in on demand
+RESUME_WINDOW = int(os.getenv("RESUME_WINDOW", "50"))
+# In-memory histories are LRU-evicted past these limits and rehydrated from Milvus on next use
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "100"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "10000"))
+# retention.py condenses sessions idle for longer than this into one summary row each
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS", "90"))
+PAGE_SIZE = 1000
+# /search ranking: "hybrid" (BM25 + vector, fused), "vector", or "lexical" (no embedding call)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid").lower()
+SEARCH_MODES = ("hybrid", "vector", "lexical")
+# Candidates taken from each ranking before fusion, as a multiple of top_k
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+RRF_K = 60
+
+# Long-term memory: before each turn, recall relevant messages from earlier sessions into the prompt
+LONG_TERM_MEMORY = os.getenv("LONG_TERM_MEMORY", "false").lower() == "true"
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "4"))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.3"))
+MEMORY_BUDGET_MS = float(os.getenv("MEMORY_BUDGET_MS", "300"))
+MEMORY_SNIPPET_CHARS = int(os.getenv("MEMORY_SNIPPET_CHARS", "240"))
+
+# Response cache: a near-duplicate user message (same persona) gets the earlier answer without an LLM call
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Answers that used a tool (weather, web search) go stale sooner
+RESPONSE_CACHE_TOOL_TTL = float(os.getenv("RESPONSE_CACHE_TOOL_TTL", "300"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+
+# Per-stage latency/error tracking; optionally dumped (JSON for *.json, else Prometheus text)
+TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "1000"))
+TELEMETRY_DUMP_PATH = os.getenv("TELEMETRY_DUMP_PATH", "")
+TELEMETRY_DUMP_SECONDS = float(os.getenv("TELEMETRY_DUMP_SECONDS", "10"))
+telemetry = Telemetry(window=TELEMETRY_WINDOW)
+_last_telemetry_dump = 0.0
+
+
+def dump_telemetry(last_turn=None, force=False):
+    """Write TELEMETRY_DUMP_PATH, at most every TELEMETRY_DUMP_SECONDS unless forced."""
+    global _last_telemetry_dump
+    if not TELEMETRY_DUMP_PATH:
+        return
+    now = time.monotonic()
+    if not force and now - _last_telemetry_dump < TELEMETRY_DUMP_SECONDS:
+        return
+    _last_telemetry_dump = now
+    try:
+        telemetry.dump(TELEMETRY_DUMP_PATH, last_turn)
+    except OSError as e:
+        print(f"⚠️  Could not write telemetry to {TELEMETRY_DUMP_PATH}: {e}")
+
+# Embedding backend: "openai" (default) or "local" (SentenceTransformer on CPU, no API calls)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai").lower()
+
+# Vector store: "milvus" (Milvus Lite, default) or "numpy" (in-process exact search over
+# memory-mapped arrays; lower per-query overhead for small corpora)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus").lower()
+MILVUS_URI = os.getenv("MILVUS_LITE_PATH", "agent-conversations.db")
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", "agent-conversations.npstore")
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float32")
+# Vector layout of newly created collections: "full", "reduced:<dim>", "int8" or "binary" (numpy store
+# only). With VECTOR_RERANK a compact layout also stores the full-precision vector, to re-rank
+# RERANK_CANDIDATES x top_k candidates exactly; that costs more storage than the full layout alone
+VECTOR_LAYOUT = os.getenv("VECTOR_LAYOUT", "full").lower()
+VECTOR_RERANK = os.getenv("VECTOR_RERANK", "false").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "4"))
+
+# Cold start (import to first prompt) target; heavy clients are then warmed in the background
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "2000"))
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+
+
+def open_vector_store():
+    """Open the configured vector store; both expose the same MilvusClient-style API."""
+    if VECTOR_STORE == "numpy":
+        from numpy_store import NumpyVectorStore
+
+        return NumpyVectorStore(NUMPY_STORE_PATH, dtype=NUMPY_STORE_DTYPE, rerank_candidates=RERANK_CANDIDATES)
+    from pymilvus import MilvusClient
+
+    return RerankingClient(MilvusClient(uri=MILVUS_URI), rerank_candidates=RERANK_CANDIDATES)
+
+
+def vector_layout(dim=None, spec=None, rerank=None):
+    """VectorLayout for a new collection (VECTOR_LAYOUT / VECTOR_RERANK unless given)."""
+    return VectorLayout.parse(spec or VECTOR_LAYOUT, dim or runtime.embedding_dim,
+                              rerank=VECTOR_RERANK if rerank is None else rerank)
+
+
+def conversation_schema(dim=None, layout=None):
+    """Explicit schema for conversation storage; other keys (e.g. covered_messages) stay dynamic."""
+    from pymilvus import DataType, MilvusClient
+
+    layout = layout or vector_layout(dim, "full")
+    schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=True)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=layout.dim)
+    if layout.rerank:
+        # Read only to re-rank search candidates, so it has no index
+        schema.add_field(FULL_VECTOR_FIELD, DataType.FLOAT_VECTOR, dim=layout.full_dim)
+    schema.add_field("session_id", DataType.VARCHAR, max_length=SESSION_ID_MAX_LENGTH)
+    schema.add_field("timestamp", DataType.INT64)  # epoch milliseconds
+    schema.add_field("role", DataType.VARCHAR, max_length=ROLE_MAX_LENGTH)
+    schema.add_field("persona", DataType.VARCHAR, max_length=PERSONA_MAX_LENGTH)
+    schema.add_field("content", DataType.VARCHAR, max_length=CONTENT_MAX_LENGTH)
+    return schema
+
 
-# Initialize Milvus
-client_milvus = MilvusClient(uri="agent-conversations.db")
+def conversation_index_params(client):
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_name="idx_vector", index_type="AUTOINDEX", metric_type=METRIC_TYPE)
+    for field in INDEXED_FIELDS:
+        index_params.add_index(field_name=field, index_name=f"idx_{field}", index_type="INVERTED")
+    return index_params
 
-def init_milvus():
+
+def create_conversation_collection(client, name, dim=None, layout=None):
+    """Create a typed conversation collection with vector and scalar indexes.
+
+    layout is a VectorLayout or a spec such as "reduced:256" (default: VECTOR_LAYOUT).
+    """
+    if not isinstance(layout, VectorLayout):
+        layout = vector_layout(dim, layout)
+    supported = getattr(client, "VECTOR_LAYOUTS", ("full",)) if layout.compact else ()
+    if layout.compact and layout.kind not in supported:
+        raise ValueError(f"The {layout.kind} vector layout is not supported by this store "
+                         f"(supported: {', '.join(supported)}); use VECTOR_STORE=numpy for int8 and binary")
+    properties = layout.to_properties() if layout.compact else None
+    client.create_collection(
+        collection_name=name,
+        schema=conversation_schema(layout=layout),
+        index_params=conversation_index_params(client),
+        **({"properties": properties} if properties else {}),
+    )
+
+
+def collection_layout(client, name):
+    """VectorLayout a collection was created with (collections without one are "full")."""
+    description = client.describe_collection(name)
+    dim = next((f["params"].get("dim") for f in description["fields"] if f["name"] == "vector"), None)
+    return VectorLayout.from_properties(description.get("properties"), dim)
+
+
+def collection_dim(client, name):
+    """Dimension of the vectors a collection stores (before any reduction)."""
+    return collection_layout(client, name).full_dim
+
+
+def is_typed_collection(client, name):
+    """True if the collection has the explicit schema (not the legacy dynamic-field layout)."""
+    fields = {f["name"] for f in client.describe_collection(name)["fields"]}
+    return "session_id" in fields
+
+
+def clip_text(text, max_bytes=CONTENT_MAX_LENGTH):
+    """Trim text so its UTF-8 encoding fits a VARCHAR field."""
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode("utf-8", errors="ignore")
+
+
+def check_session_id(session_id):
+    """Return session_id if it fits the session_id field and SESSION_ID_PATTERN; raise ValueError otherwise."""
+    if (not isinstance(session_id, str) or len(session_id) > SESSION_ID_MAX_LENGTH
+            or not SESSION_ID_PATTERN.fullmatch(session_id)):
+        raise ValueError(f"Invalid session id {session_id!r}: use up to {SESSION_ID_MAX_LENGTH} "
+                         f"letters, digits, '_', '-', '.' or ':'")
+    return session_id
+
+
+def clip_persona(persona):
+    """Persona name trimmed to fit the persona field ("neutral" if empty)."""
+    return clip_text(" ".join(str(persona or "").split()), PERSONA_MAX_LENGTH) or "neutral"
+
+
+# Tag of summarizer model runs; they run with no callbacks so a streamed turn never sees their tokens
+SUMMARIZER_TAG = "summarizer"
+
+
+def summarize_messages(llm, summary, messages):
+    """Fold chat messages into a running summary with the LLM; returns the updated summary."""
+    transcript = "\n".join(
+        f"{'User' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}" for m in messages
+    )
+    result = llm.invoke([
+        SystemMessage(content=(
+            "You maintain a running summary of a conversation. Merge the new lines into the summary. "
+            "Keep names, facts, preferences and open questions. Reply with the updated summary only, "
+            "in under 200 words."
+        )),
+        HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nNew lines:\n{transcript}"),
+    ], config={"callbacks": [], "run_name": "summarize", "tags": [SUMMARIZER_TAG]})
+    return result.content
+
+
+def format_timestamp(value):
+    """Render a stored timestamp (epoch ms, or legacy ISO string) for display."""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000).isoformat(timespec="seconds")
+    return value or ""
+
+
+def init_milvus(client=None, dim=None, model_name=None):
     """Initialize Milvus collection for conversation storage."""
-    collection_name = "persona_conversations"
-    
+    client_milvus = client if client is not None else runtime.milvus
+    dim = dim or runtime.embedding_dim
+    model_name = model_name or runtime.embedding_model
+    collection_name = COLLECTION_NAME
+
+    # Vectors from a different embedding backend can't share a collection
+    if client_milvus.has_collection(collection_name):
+        stored_dim = collection_dim(client_milvus, collection_name)
+        if stored_dim and stored_dim != dim:
+            collection_name = f"{COLLECTION_NAME}_{dim}d"
+            print(f"⚠️  '{COLLECTION_NAME}' stores {stored_dim}-d vectors but {model_name} produces "
+                  f"{dim}-d; using '{collection_name}' instead.")
+
     # Create collection if it doesn't exist
     if not client_milvus.has_collection(collection_name):
-        client_milvus.create_collection(
-            collection_name=collection_name,
-            dimension=EMBEDDING_DIM,
-            metric_type=METRIC_TYPE,
-            auto_id=True,
-            enable_dynamic_field=True,
-        )
+        create_conversation_collection(client_milvus, collection_name, dim)
         if DEBUG:
             print(f"Created collection: {collection_name}")
-        # Create default index for vector field
-        try:
-            client_milvus.create_index(
-                collection_name=collection_name,
-                index_name="idx_vector",
-                field_name="vector",
-                index_params={"index_type": "AUTOINDEX", "metric_type": METRIC_TYPE}
-            )
-            if DEBUG:
-                print("Created vector index: idx_vector")
-        except Exception as e:
-            if DEBUG:
-                print(f"⚠️  Skipped index creation: {e}")
+    elif not is_typed_collection(client_milvus, collection_name):
+        print(f"⚠️  Collection '{collection_name}' uses the legacy dynamic-field layout; "
+              f"run `python3 migrate.py` to add typed fields and scalar indexes.")
     # Ensure collection is loaded for search
     try:
         client_milvus.load_collection(collection_name)
@@ -61,121 +289,304 @@ def init_milvus():
     
     return collection_name
 
-# Initialize collection
-collection_name = init_milvus()
-
-# Initialize LLM
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.8, api_key=openai_api_key)
-
-# Tool: DuckDuckGo search (if available)
-SEARCH_AVAILABLE = True
-try:
-    import time
-    from duckduckgo_search import DDGS
-
-    def web_search_safe(query: str) -> str:
-        """DuckDuckGo web search with retries; returns concise bullet list."""
-        query = (query or "").strip()
-        if not query:
-            return "(no query)"
-        last_err = None
-        for attempt in range(3):
-            try:
-                with DDGS() as ddgs:
-                    results = list(ddgs.text(query, max_results=5))
-                if not results:
-                    return "(no results)"
-                lines = []
-                for r in results:
-                    title = r.get("title") or r.get("body") or "result"
-                    href = r.get("href") or r.get("link") or ""
-                    lines.append(f"- {title} {(' - ' + href) if href else ''}")
-                return "\n".join(lines)
-            except Exception as e:
-                last_err = e
-                time.sleep(2 ** attempt)
-        return f"(search unavailable: {last_err})"
-
-    search_tool = StructuredTool.from_function(
-        func=web_search_safe,
-        name="web_search",
-        description="Search the web and return up to 5 concise results",
-    )
-except Exception as e:
-    SEARCH_AVAILABLE = False
-    search_tool = None
-    if DEBUG:
-        print(f"⚠️  Could not initialize search tool: {e}")
+
+# Memory recall runs on these threads so a slow embedding or search can be abandoned at the budget
+memory_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory")
+
+# Tool: web search (DuckDuckGo by default, if available)
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_DEADLINE_SECONDS = float(os.getenv("SEARCH_DEADLINE_SECONDS", "8"))
+# Tool calls of one agent step run concurrently; each gets TOOL_TIMEOUT_SECONDS (or its entry in
+# TOOL_TIMEOUTS, e.g. "get_weather=5,web_search=8") and the step as a whole TOOL_STEP_TIMEOUT_SECONDS
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "10"))
+TOOL_TIMEOUTS = os.getenv("TOOL_TIMEOUTS", "")
+TOOL_STEP_TIMEOUT_SECONDS = float(os.getenv("TOOL_STEP_TIMEOUT_SECONDS", "15"))
+
+
+def web_search_safe(query: str) -> str:
+    """Web search with caching and deadline-bounded retries; returns concise bullet list."""
+    return runtime.web_search.search(query)
+
+
+async def aweb_search_safe(query: str) -> str:
+    """Async web search; retries never block the event loop."""
+    return await runtime.web_search.asearch(query)
+
 
 # Weather tool (StructuredTool)
-WEATHER_AVAILABLE = True
-try:
+WEATHER_GEOCODE_URL = os.getenv("WEATHER_GEOCODE_URL", "https://geocoding-api.open-meteo.com/v1/search")
+WEATHER_FORECAST_URL = os.getenv("WEATHER_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+GEOCODE_TTL_SECONDS = 30 * 24 * 3600  # city coordinates essentially never change
+FORECAST_TTL_SECONDS = 3600
+HTTP_POOL_SIZE = 16
+
+geocode_cache = TTLCache(ttl=GEOCODE_TTL_SECONDS, max_entries=4096)
+forecast_cache = TTLCache(ttl=FORECAST_TTL_SECONDS, max_entries=1024)
+
+
+def new_http_session(pool_size=HTTP_POOL_SIZE):
+    """requests.Session with a connection pool sized for concurrent tool calls."""
     import requests
+    from requests.adapters import HTTPAdapter
 
-    def get_weather(city: str) -> str:
-        """Get 3-day weather forecast for a city using Open-Meteo geocoding + forecast APIs."""
-        if not city:
-            return "Please provide a city name. Example: /weather Austin, TX"
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-        # 1) Geocode the city to latitude/longitude
-        try:
-            geo_resp = requests.get(
-                "https://geocoding-api.open-meteo.com/v1/search",
-                params={"name": city, "count": 1, "language": "en", "format": "json"},
-                timeout=10,
-            )
-            geo_resp.raise_for_status()
-            geo = geo_resp.json()
-            results = geo.get("results") or []
-            if not results:
-                return f"Could not find coordinates for '{city}'. Try a more specific name."
-            top = results[0]
-            lat = float(top.get("latitude"))
-            lon = float(top.get("longitude"))
-            city_name = top.get("name") or city
-            admin = top.get("admin1") or ""
-            country = top.get("country") or ""
-        except Exception as e:
-            return f"Geocoding failed for '{city}': {e}"
 
-        # 2) Fetch forecast (Fahrenheit units, auto-timezone)
+def _geocode(city):
+    """Return the top Open-Meteo geocoding result for a city, or None."""
+    with telemetry.span("weather.geocode"):
+        resp = runtime.http_session.get(
+            WEATHER_GEOCODE_URL,
+            params={"name": city, "count": 1, "language": "en", "format": "json"},
+            timeout=10,
+        )
+        resp.raise_for_status()
+    results = resp.json().get("results") or []
+    return results[0] if results else None
+
+
+def _forecast(lat, lon):
+    """Return the Open-Meteo daily forecast block (Fahrenheit units, auto-timezone)."""
+    with telemetry.span("weather.forecast"):
+        resp = runtime.http_session.get(
+            WEATHER_FORECAST_URL,
+            params={
+                "latitude": lat,
+                "longitude": lon,
+                "daily": "temperature_2m_max,temperature_2m_min",
+                "timezone": "auto",
+                "temperature_unit": "fahrenheit",
+            },
+            timeout=10,
+        )
+        resp.raise_for_status()
+    return resp.json().get("daily", {})
+
+
+def get_weather(city: str) -> str:
+    """Get 3-day weather forecast for a city using Open-Meteo geocoding + forecast APIs."""
+    if not city:
+        return "Please provide a city name. Example: /weather Austin, TX"
+
+    # 1) Geocode the city to latitude/longitude (cached by normalized name)
+    key = " ".join(city.lower().split())
+    try:
+        top = geocode_cache.get_or_load(key, lambda: _geocode(city))
+        if not top:
+            return f"Could not find coordinates for '{city}'. Try a more specific name."
+        lat = float(top.get("latitude"))
+        lon = float(top.get("longitude"))
+        city_name = top.get("name") or city
+        admin = top.get("admin1") or ""
+        country = top.get("country") or ""
+    except Exception as e:
+        return f"Geocoding failed for '{city}': {e}"
+
+    # 2) Fetch forecast (cached by coordinates rounded to ~1 km)
+    try:
+        rounded = (round(lat, 2), round(lon, 2))
+        temps = forecast_cache.get_or_load(rounded, lambda: _forecast(*rounded))
+        times = temps.get("time", [])
+        tmin = temps.get("temperature_2m_min", [])
+        tmax = temps.get("temperature_2m_max", [])
+        days = list(zip(times, tmin, tmax))[:3]
+        if not days:
+            return f"No forecast available for {city_name}."
+        forecast = "\n".join([f"{d}: {low}°F - {high}°F" for d, low, high in days])
+        loc = f"{city_name}{(', ' + admin) if admin else ''}{(', ' + country) if country else ''}"
+        return f"3-day forecast for {loc} ({lat:.2f},{lon:.2f}):\n{forecast}"
+    except Exception as e:
+        return f"Weather lookup failed for '{city}': {e}"
+
+
+class _lazy:
+    """Runtime attribute built on first access, once, under the runtime's lock.
+
+    The value is stored in the instance __dict__, so later reads skip the descriptor
+    entirely, and assigning the attribute (e.g. a fake in tests) replaces it.
+    """
+
+    def __init__(self, build):
+        self.build = build
+        self.__doc__ = build.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        with obj._lock:
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.build(obj)
+            return obj.__dict__[self.name]
+
+
+class Runtime:
+    """The heavy clients every agent shares, each created on first use.
+
+    Importing this module builds none of them: the vector store is opened when the first
+    agent is created, and the LLM, embeddings and tools when a turn first needs them, or
+    earlier if warm_up() is run (the CLI does so in the background once the prompt is up).
+    """
+
+    WARM_UP = ("llm", "embeddings", "search_tool", "weather_tool")
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def built(self, name):
+        """True if the named client has been created (or assigned)."""
+        return name in self.__dict__
+
+    @_lazy
+    def embedding_backend(self):
+        """(embeddings, model name, dimension) of the configured EMBEDDING_BACKEND."""
+        return build_embeddings(
+            EMBEDDING_BACKEND,
+            model=os.getenv("EMBEDDING_MODEL") or None,
+            batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "64")),
+            num_threads=int(os.getenv("EMBEDDING_THREADS", "0")) or None,
+        )
+
+    @_lazy
+    def embedding_spec(self):
+        """(model name, dimension), without loading a model when the backend's sizes are known."""
+        spec = describe_embeddings(EMBEDDING_BACKEND, model=os.getenv("EMBEDDING_MODEL") or None)
+        return spec or self.embedding_backend[1:]
+
+    @property
+    def embedding_model(self):
+        return self.embedding_spec[0]
+
+    @property
+    def embedding_dim(self):
+        return self.embedding_spec[1]
+
+    @_lazy
+    def embeddings(self):
+        """Embeddings behind a content-hash cache (memory LRU + SQLite on disk)."""
+        return cached_embeddings_from_env(self.embedding_backend[0], self.embedding_model)
+
+    @_lazy
+    def milvus(self):
+        return open_vector_store()
+
+    @_lazy
+    def collection_name(self):
+        return init_milvus(self.milvus, self.embedding_dim, self.embedding_model)
+
+    @_lazy
+    def llm(self):
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0.8, api_key=openai_api_key)
+
+    @_lazy
+    def response_cache(self):
+        """ResponseCache shared by all agents, or None unless RESPONSE_CACHE is on."""
+        if not RESPONSE_CACHE:
+            return None
+        return ResponseCache(threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+                             max_entries=RESPONSE_CACHE_SIZE)
+
+    @_lazy
+    def http_session(self):
+        return new_http_session()
+
+    @_lazy
+    def web_search(self):
+        from web_search import WebSearch, provider_from_env
+
+        return WebSearch(provider_from_env(), ttl=SEARCH_CACHE_TTL, deadline=SEARCH_DEADLINE_SECONDS,
+                         on_fetch=lambda ms, error: telemetry.record("web_search.fetch", ms, error=error))
+
+    @_lazy
+    def search_tool(self):
+        """web_search as a tool, or None if no search provider could be initialized."""
         try:
-            fc_resp = requests.get(
-                "https://api.open-meteo.com/v1/forecast",
-                params={
-                    "latitude": lat,
-                    "longitude": lon,
-                    "daily": "temperature_2m_max,temperature_2m_min",
-                    "timezone": "auto",
-                    "temperature_unit": "fahrenheit",
-                },
-                timeout=10,
-            )
-            fc_resp.raise_for_status()
-            data = fc_resp.json()
-            temps = data.get("daily", {})
-            times = temps.get("time", [])
-            tmin = temps.get("temperature_2m_min", [])
-            tmax = temps.get("temperature_2m_max", [])
-            days = list(zip(times, tmin, tmax))[:3]
-            if not days:
-                return f"No forecast available for {city_name}."
-            forecast = "\n".join([f"{d}: {low}°F - {high}°F" for d, low, high in days])
-            loc = f"{city_name}{(', ' + admin) if admin else ''}{(', ' + country) if country else ''}"
-            return f"3-day forecast for {loc} ({lat:.2f},{lon:.2f}):\n{forecast}"
+            self.web_search
         except Exception as e:
-            return f"Weather lookup failed for '{city}': {e}"
+            if DEBUG:
+                print(f"⚠️  Could not initialize search tool: {e}")
+            return None
+        return StructuredTool.from_function(
+            func=web_search_safe,
+            coroutine=aweb_search_safe,
+            name="web_search",
+            description="Search the web and return up to 5 concise results",
+        )
 
-    weather_tool = StructuredTool.from_function(
-        func=get_weather,
-        name="get_weather",
-        description="Get a 3-day weather forecast for a given city name",
-    )
-except Exception as e:
-    WEATHER_AVAILABLE = False
-    weather_tool = None
-    if DEBUG:
-        print(f"⚠️  Could not initialize weather tool: {e}")
+    @_lazy
+    def weather_tool(self):
+        """get_weather as a tool, or None without the requests package."""
+        if importlib.util.find_spec("requests") is None:
+            if DEBUG:
+                print("⚠️  Could not initialize weather tool: requests is not installed")
+            return None
+        return StructuredTool.from_function(
+            func=get_weather,
+            name="get_weather",
+            description="Get a 3-day weather forecast for a given city name",
+        )
+
+    @property
+    def tools(self):
+        return [t for t in (self.search_tool, self.weather_tool) if t is not None]
+
+    @_lazy
+    def tool_pool(self):
+        """Bounded thread pool running the sync tool calls of every agent."""
+        return ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+    def warm_up(self, names=WARM_UP):
+        """Build the named clients now, timing each as a "startup.<name>" stage.
+
+        Failures are recorded and otherwise ignored; they surface again on first real use.
+        """
+        for name in names:
+            if self.built(name):
+                continue
+            try:
+                with telemetry.span(f"startup.{name}"):
+                    getattr(self, name)
+            except Exception as e:
+                if DEBUG:
+                    print(f"⚠️  Could not warm up {name}: {e}")
+
+
+runtime = Runtime()
+
+# Module-level names from before the runtime existed; resolved (and built) on first access
+_RUNTIME_ALIASES = {
+    "embeddings": "embeddings",
+    "base_embeddings": "embedding_backend",
+    "EMBEDDING_MODEL": "embedding_model",
+    "EMBEDDING_DIM": "embedding_dim",
+    "client_milvus": "milvus",
+    "collection_name": "collection_name",
+    "llm": "llm",
+    "http_session": "http_session",
+    "web_search": "web_search",
+    "search_tool": "search_tool",
+    "weather_tool": "weather_tool",
+}
+
+
+def __getattr__(name):
+    if name in _RUNTIME_ALIASES:
+        value = getattr(runtime, _RUNTIME_ALIASES[name])
+        return value[0] if name == "base_embeddings" else value
+    if name == "SEARCH_AVAILABLE":
+        return runtime.search_tool is not None
+    if name == "WEATHER_AVAILABLE":
+        return runtime.weather_tool is not None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # Persona system prompt
@@ -195,16 +606,54 @@ def persona_prompt(persona_name: str) -> str:
 class PersonaAgent:
     """Agent with persona and conversation storage."""
     
-    def __init__(self, milvus_client, collection_name, session_id=None):
+    def __init__(self, milvus_client, collection_name, session_id=None, write_behind=None, history_store=None,
+                 lexical_index=None):
+        """Create an agent for one session.
+
+        write_behind may be True/False, None (use WRITE_BEHIND), or a shared WriteBehindQueue.
+        history_store replaces the default SessionHistoryStore for in-memory chat histories.
+        lexical_index lets several agents on one collection share a LexicalIndex.
+        """
         self.milvus = milvus_client
         self.collection_name = collection_name
-        self.session_id = session_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.session_id = check_session_id(session_id or datetime.now().strftime("%Y%m%d_%H%M%S"))
         self.persona = "neutral"
-        self.llm = llm
-        self.search_tool = search_tool
+        self.runtime = runtime
 
-        # Session-scoped chat histories
-        self._history_by_session = {}
+        # Optional write-behind queue: messages are embedded and inserted in batches off the chat path
+        if write_behind is None:
+            write_behind = WRITE_BEHIND
+        self.writer = None
+        # A queue passed in is shared with other agents and closed by its owner, not by close()
+        self._owns_writer = not isinstance(write_behind, WriteBehindQueue)
+        if isinstance(write_behind, WriteBehindQueue):
+            self.writer = write_behind
+        elif write_behind:
+            self.writer = WriteBehindQueue(
+                milvus_client,
+                collection_name,
+                self.runtime.embeddings,
+                self.runtime.embedding_dim,
+                batch_size=WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=WRITE_BEHIND_FLUSH_SECONDS,
+                debug=DEBUG,
+            )
+
+        # Session-scoped chat histories, bounded and rehydrated from Milvus after eviction
+        self.history_store = history_store or SessionHistoryStore(
+            factory=self._new_history,
+            loader=self._rehydrate_history,
+            max_sessions=HISTORY_MAX_SESSIONS,
+            max_messages=HISTORY_MAX_MESSAGES,
+        )
+        self._older_ids = []
+
+        # BM25 index kept current by save_message, for lexical and hybrid /search
+        self.lexical = lexical_index or LexicalIndex()
+
+        # Spans of the turn in progress, and of the last completed one
+        self._spans = []
+        self.last_turn = []
 
         # Build tools-enabled agent prompt (must include agent_scratchpad)
         self.prompt = ChatPromptTemplate.from_messages([
@@ -214,157 +663,501 @@ class PersonaAgent:
             MessagesPlaceholder("agent_scratchpad"),
         ])
 
-        # Assemble active tools
-        active_tools = [t for t in [search_tool, weather_tool] if t is not None]
+        # The tools agent needs the LLM and tools, so it is built on the first turn (or by warm_up)
+        self.agent = None
+        self._agent_with_history = None
+        self._agent_lock = threading.Lock()
+        
+        # Load existing conversation and persona
+        self.load_conversation()
 
-        # Create an OpenAI tools agent (required per setup)
-        agent_graph = create_openai_tools_agent(self.llm, active_tools, self.prompt)
-        self.agent = AgentExecutor(
-            agent=agent_graph,
-            tools=active_tools,
-            verbose=DEBUG,
-            handle_parsing_errors=True,
-        )
+    @property
+    def llm(self):
+        return self.runtime.llm
+
+    @property
+    def agent_with_history(self):
+        """The tools agent wrapped with session-scoped message history, built on first use."""
+        if self._agent_with_history is None:
+            with self._agent_lock:
+                if self._agent_with_history is None:
+                    from langchain.agents import create_openai_tools_agent
+                    from tool_execution import ConcurrentAgentExecutor, parse_tool_timeouts
 
-        # Wrap executor with session-scoped message history
-        def _get_session_history(session_id: str):
-            return self._history_by_session.setdefault(session_id, ChatMessageHistory())
+                    # Create an OpenAI tools agent (required per setup)
+                    active_tools = self.runtime.tools
+                    agent_graph = create_openai_tools_agent(self.llm, active_tools, self.prompt)
+                    self.agent = ConcurrentAgentExecutor(
+                        agent=agent_graph,
+                        tools=active_tools,
+                        verbose=DEBUG,
+                        handle_parsing_errors=True,
+                        pool=self.runtime.tool_pool,
+                        tool_timeout=TOOL_TIMEOUT_SECONDS or None,
+                        tool_timeouts=parse_tool_timeouts(TOOL_TIMEOUTS),
+                        step_timeout=TOOL_STEP_TIMEOUT_SECONDS or None,
+                        on_timeout=self._tool_timed_out,
+                    )
+                    self._agent_with_history = RunnableWithMessageHistory(
+                        self.agent,
+                        get_session_history=self.get_session_history,
+                        input_messages_key="input",
+                        history_messages_key="chat_history",
+                    )
+        return self._agent_with_history
 
-        self.agent_with_history = RunnableWithMessageHistory(
-            self.agent,
-            get_session_history=_get_session_history,
-            input_messages_key="input",
-            history_messages_key="chat_history",
+    def warm_up(self):
+        """Build the shared clients and this agent's executor ahead of the first turn."""
+        self.runtime.warm_up()
+        try:
+            with telemetry.span("startup.agent"):
+                self.agent_with_history
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Could not warm up the agent: {e}")
+
+    def _tool_timed_out(self, tool_name, waited):
+        """Record a tool call the agent stopped waiting for as an error of "tool_timeout:<name>"."""
+        error = TimeoutError(f"{tool_name} gave no result within {waited:.1f}s")
+        telemetry.record(f"tool_timeout:{tool_name}", waited * 1000, error=error, spans=self._spans)
+        if DEBUG:
+            print(f"⏱️  {error}")
+
+    def _span(self, stage):
+        """Time a stage into the shared telemetry and the current turn's spans."""
+        return telemetry.span(stage, self._spans)
+
+    def get_session_history(self, session_id=None):
+        """Return the chat history for a session (the current one by default)."""
+        return self.history_store.get(session_id or self.session_id)
+
+    def _new_history(self, session_id):
+        if HISTORY_STRATEGY == "full":
+            from langchain_community.chat_message_histories import ChatMessageHistory
+
+            return ChatMessageHistory()
+        return SummarizingHistory(
+            summarizer=self._summarize,
+            on_summary=lambda summary, covered: self._save_summary(session_id, summary, covered),
+            max_tokens=HISTORY_MAX_TOKENS,
+            keep_turns=HISTORY_KEEP_TURNS,
         )
-        
-        # Load existing conversation and persona
-        self.load_conversation()
-    
-    def save_message(self, role, content, persona=None):
-        """Save a message to Milvus."""
-        # Compute embedding vector for semantic search
+
+    def _summarize(self, summary, messages):
+        """Fold messages into the running summary with the LLM."""
+        with self._span("summarize"):
+            return summarize_messages(self.llm, summary, messages)
+
+    def _save_summary(self, session_id, summary, covered):
+        """Persist the session summary, replacing the previous one."""
         try:
-            vector = embeddings.embed_query(content)
+            with self._span("embed"):
+                vector = self.runtime.embeddings.embed_query(summary)
         except Exception:
-            vector = [0.0] * EMBEDDING_DIM
+            vector = [0.0] * self.runtime.embedding_dim
+
+        # Summary rows are never added to self.lexical, so this delete leaves it nothing to remove
+        try:
+            with self._span("milvus.delete"):
+                self.milvus.delete(
+                    collection_name=self.collection_name,
+                    filter=f'session_id == {json.dumps(session_id)} and role == "summary"',
+                )
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Error replacing summary: {e}")
 
-        data = {
-            "timestamp": datetime.now().isoformat(),
+        self._insert({
+            "timestamp": int(time.time() * 1000),
+            "session_id": session_id,
+            "role": "summary",
+            "content": clip_text(summary),
+            "persona": self.persona,
+            "covered_messages": covered,
+            "vector": vector,
+        })
+
+    def _new_record(self, role, content, persona=None):
+        return {
+            "timestamp": int(time.time() * 1000),
             "session_id": self.session_id,
             "role": role,
-            "content": content,
-            "persona": persona or self.persona,
-            "vector": vector
+            "content": clip_text(content),
+            "persona": clip_persona(persona or self.persona),
         }
-        
+
+    def _insert(self, data):
         try:
-            self.milvus.insert(
-                collection_name=self.collection_name,
-                data=[data]
-            )
+            with self._span("milvus.insert"):
+                self.milvus.insert(
+                    collection_name=self.collection_name,
+                    data=[data]
+                )
             if DEBUG:
-                print(f"💾 Saved {role} message with persona '{persona or self.persona}'")
+                print(f"💾 Saved {data['role']} message with persona '{data['persona']}'")
         except Exception as e:
             if DEBUG:
                 print(f"⚠️  Error saving message: {e}")
-    
+
+    def save_message(self, role, content, persona=None, vector=None):
+        """Save a message to Milvus; pass vector if the content's embedding is already known."""
+        record = self._new_record(role, content, persona)
+        self.lexical.add(record)
+        if self.writer is not None:
+            self.writer.submit(record if vector is None else dict(record, vector=vector))
+            return
+
+        # Compute embedding vector for semantic search
+        if vector is None:
+            try:
+                with self._span("embed"):
+                    vector = self.runtime.embeddings.embed_query(content)
+            except Exception:
+                vector = [0.0] * self.runtime.embedding_dim
+
+        self._insert(dict(record, vector=vector))
+
+    async def asave_message(self, role, content, persona=None, vector=None):
+        """Async variant of save_message; the Milvus insert runs in a worker thread."""
+        record = self._new_record(role, content, persona)
+        self.lexical.add(record)
+        if self.writer is not None:
+            self.writer.submit(record if vector is None else dict(record, vector=vector))
+            return
+
+        if vector is None:
+            try:
+                with self._span("embed"):
+                    vector = await self.runtime.embeddings.aembed_query(content)
+            except Exception:
+                vector = [0.0] * self.runtime.embedding_dim
+
+        await asyncio.to_thread(self._insert, dict(record, vector=vector))
+
     def save_persona(self, persona):
         """Save persona change to Milvus."""
         # Also embed persona change note so it can be surfaced in search
-        note = f"Persona changed to: {persona}"
+        self.save_message("system", f"Persona changed to: {persona}", persona=persona)
+
+    def _scan_session(self, session_id):
+        """Yield (id, role) for a session's rows in insertion order, one page at a time."""
+        iterator = self.milvus.query_iterator(
+            collection_name=self.collection_name,
+            batch_size=PAGE_SIZE,
+            filter=f'session_id == {json.dumps(session_id)}',
+            output_fields=["role"],
+        )
         try:
-            vector = embeddings.embed_query(note)
-        except Exception:
-            vector = [0.0] * EMBEDDING_DIM
+            while True:
+                page = iterator.next()
+                if not page:
+                    break
+                for row in page:
+                    yield row["id"], row["role"]
+        finally:
+            iterator.close()
 
-        data = {
-            "timestamp": datetime.now().isoformat(),
-            "session_id": self.session_id,
-            "role": "system",
-            "content": note,
-            "persona": persona,
-            "vector": vector
-        }
-        
+    def _fetch_rows(self, ids, output_fields):
+        """Fetch specific rows by primary key, oldest first."""
+        if not ids:
+            return []
+        rows = self.milvus.query(
+            collection_name=self.collection_name,
+            filter=f"id in {list(ids)}",
+            output_fields=output_fields,
+        )
+        rows.sort(key=lambda x: x["id"])
+        return rows
+
+    def _restore_history(self, session_id, history):
+        """Fill history with a session's recent window from Milvus.
+
+        Returns (persona, loaded_count, total_count, older_ids); persona is None if never set.
+        """
+        # Scan only ids and roles; contents are fetched for the rows we actually need
+        chat_ids = []
+        summary_id = None
+        persona_id = None
+        for row_id, role in self._scan_session(session_id):
+            if role in ("user", "assistant"):
+                chat_ids.append(row_id)
+            elif role == "summary":
+                summary_id = row_id
+            elif role == "system":
+                persona_id = row_id
+
+        persona = None
+        skip = 0
+        special = [i for i in (summary_id, persona_id) if i is not None]
+        for msg in self._fetch_rows(special, ["role", "content", "persona", "covered_messages"]):
+            if msg["role"] == "system" and "Persona changed to:" in msg["content"]:
+                persona = msg.get("persona", "neutral")
+            # Messages already folded into the stored summary are not replayed
+            elif msg["role"] == "summary" and isinstance(history, SummarizingHistory):
+                skip = msg.get("covered_messages") or 0
+                history.load_summary(msg["content"], skip)
+
+        uncovered = chat_ids[skip:]
+        window = uncovered[-RESUME_WINDOW:] if RESUME_WINDOW > 0 else uncovered
+        older_ids = chat_ids[:len(chat_ids) - len(window)]
+
+        messages = []
+        for msg in self._fetch_rows(window, ["role", "content"]):
+            content = msg["content"]
+            messages.append(HumanMessage(content=content) if msg["role"] == "user" else AIMessage(content=content))
+        if isinstance(history, SummarizingHistory):
+            # Resuming never folds; messages between the summary and the window stay out of
+            # context (reachable with /older) and count as covered, so later folds don't redo them
+            history.load_messages(messages, covered=len(older_ids))
+        else:
+            history.add_messages(messages)
+
+        return persona, len(messages), len(chat_ids), older_ids
+
+    def _rehydrate_history(self, session_id, history):
+        """Loader for the history store: rebuild an evicted (or new) session from Milvus."""
+        # Queued messages must be in Milvus before they can be read back
+        self.flush()
         try:
-            self.milvus.insert(
-                collection_name=self.collection_name,
-                data=[data]
-            )
-            if DEBUG:
-                print(f"💾 Saved persona change: {persona}")
+            with self._span("resume"):
+                self._restore_history(session_id, history)
         except Exception as e:
             if DEBUG:
-                print(f"⚠️  Error saving persona: {e}")
-    
+                print(f"⚠️  Error rehydrating session {session_id}: {e}")
+
     def load_conversation(self):
-        """Load conversation history and persona from Milvus."""
+        """Load the most recent window of the conversation and the persona from Milvus."""
+        self._older_ids = []
         try:
-            # Query for messages in this session
-            results = self.milvus.query(
-                collection_name=self.collection_name,
-                filter=f'session_id == "{self.session_id}"',
-                output_fields=["timestamp", "role", "content", "persona"]
-            )
-            
-            # Sort by timestamp
-            results.sort(key=lambda x: x.get("timestamp", ""))
-            
-            message_count = 0
-            history = self.get_session_history()
-            for msg in results:
-                role = msg["role"]
-                content = msg["content"]
-                persona = msg.get("persona", "neutral")
-                
-                # Update persona if this is a system message about persona change
-                if role == "system" and "Persona changed to:" in content:
-                    self.persona = persona
-                    if DEBUG:
-                        print(f"📝 Restored persona: {persona}")
-                
-                # Add user/assistant messages to history
-                elif role == "user":
-                    history.add_user_message(content)
-                    message_count += 1
-                elif role == "assistant":
-                    history.add_ai_message(content)
-                    message_count += 1
-            
-            if message_count > 0:
-                print(f"✓ Loaded {message_count} messages from session (persona: {self.persona})\n")
-            
+            history = self._new_history(self.session_id)
+            with self._span("resume"):
+                persona, loaded, total, self._older_ids = self._restore_history(self.session_id, history)
+            self.history_store.put(self.session_id, history)
+
+            # Update persona from the last persona change
+            if persona:
+                self.persona = persona
+                if DEBUG:
+                    print(f"📝 Restored persona: {persona}")
+
+            if total:
+                print(f"✓ Loaded {loaded} of {total} messages from session (persona: {self.persona})\n")
+
         except Exception as e:
             if DEBUG:
                 print(f"⚠️  Error loading conversation: {e}")
-    
+
+    def load_older_messages(self, limit=None):
+        """Fetch the page of messages just before those already loaded, oldest first."""
+        limit = limit or RESUME_WINDOW
+        if not self._older_ids:
+            return []
+        page = self._older_ids[-limit:]
+        self._older_ids = self._older_ids[:-limit]
+        return self._fetch_rows(page, ["timestamp", "role", "content", "persona"])
+
     def set_persona(self, persona):
-        """Change the persona and save to Milvus."""
-        self.persona = persona
-        self.save_persona(persona)
+        """Change the persona and save to Milvus (names longer than the persona field are trimmed)."""
+        self.persona = clip_persona(persona)
+        self.save_persona(self.persona)
+
+    async def aset_persona(self, persona):
+        """Async variant of set_persona."""
+        self.persona = clip_persona(persona)
+        await self.asave_message("system", f"Persona changed to: {self.persona}", persona=self.persona)
     
+    def _search_memories(self, vector):
+        """Most similar user/assistant messages from other sessions, as display-ready rows."""
+        with self._span("milvus.search"):
+            results = self.milvus.search(
+                collection_name=self.collection_name,
+                data=[vector],
+                limit=MEMORY_TOP_K,
+                filter=f'session_id != {json.dumps(self.session_id)} and role in ["user", "assistant"]',
+                output_fields=["timestamp", "role", "content"],
+                search_params={"metric_type": METRIC_TYPE},
+            )
+        hits = results[0] if results else []
+        return [hit.get("entity", {}) for hit in hits if hit.get("distance", 0.0) >= MEMORY_MIN_SCORE]
+
+    def _format_memories(self, rows):
+        if not rows:
+            return ""
+        lines = ["Possibly relevant excerpts from earlier conversations (may be outdated):"]
+        for row in rows:
+            content = " ".join((row.get("content") or "").split())
+            if len(content) > MEMORY_SNIPPET_CHARS:
+                content = content[:MEMORY_SNIPPET_CHARS] + "…"
+            day = format_timestamp(row.get("timestamp"))[:10]
+            lines.append(f"- [{day}] {row.get('role')}: {content}")
+        return "\n".join(lines)
+
+    def _recall(self, user_input):
+        """Return (user_vector, memory_context) within MEMORY_BUDGET_MS.
+
+        The vector is reused when the user message is saved. Whatever misses the budget is
+        dropped: a late embedding gives (None, ""), a late search gives (vector, "").
+        """
+        if not LONG_TERM_MEMORY:
+            return None, ""
+        started = time.monotonic()
+        deadline = started + MEMORY_BUDGET_MS / 1000
+        vector = None
+        try:
+            with self._span("memory.recall"):
+                vector = memory_executor.submit(self.runtime.embeddings.embed_query, user_input).result(
+                    timeout=max(0.0, deadline - time.monotonic()))
+                rows = memory_executor.submit(self._search_memories, vector).result(
+                    timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Memory recall skipped: {type(e).__name__} {e}")
+            return vector, ""
+        if DEBUG:
+            print(f"🧠 Recalled {len(rows)} memories in {(time.monotonic() - started) * 1000:.0f} ms")
+        return vector, self._format_memories(rows)
+
+    async def _arecall(self, user_input):
+        """Async variant of _recall; the budget is enforced with asyncio.wait_for."""
+        if not LONG_TERM_MEMORY:
+            return None, ""
+        deadline = time.monotonic() + MEMORY_BUDGET_MS / 1000
+        vector = None
+        try:
+            with self._span("memory.recall"):
+                vector = await asyncio.wait_for(self.runtime.embeddings.aembed_query(user_input),
+                                                timeout=max(0.0, deadline - time.monotonic()))
+                rows = await asyncio.wait_for(asyncio.to_thread(self._search_memories, vector),
+                                              timeout=max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Memory recall skipped: {type(e).__name__} {e}")
+            return vector, ""
+        return vector, self._format_memories(rows)
+
+    def _embed_for_cache(self, user_input, vector):
+        """The user message embedding for a cache lookup, unless the recall already computed it."""
+        if vector is not None or self.runtime.response_cache is None:
+            return vector
+        try:
+            with self._span("embed"):
+                return self.runtime.embeddings.embed_query(user_input)
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Response cache skipped: {type(e).__name__} {e}")
+            return None
+
+    async def _aembed_for_cache(self, user_input, vector):
+        if vector is not None or self.runtime.response_cache is None:
+            return vector
+        try:
+            with self._span("embed"):
+                return await self.runtime.embeddings.aembed_query(user_input)
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Response cache skipped: {type(e).__name__} {e}")
+            return None
+
+    def _cache_key(self):
+        """Response cache key for this turn: the persona plus a digest of the history sent with it.
+
+        Computed before the turn touches the history. Context-free first turns share one key
+        across sessions, while a follow-up only matches an earlier turn with the same history.
+        """
+        if self.runtime.response_cache is None:
+            return None
+        digest = hashlib.sha256()
+        for message in self.get_session_history().messages:
+            digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+        return f"{self.persona}\0{digest.hexdigest()}"
+
+    def _cached_response(self, vector, key):
+        """Cached answer to a near-duplicate message under this cache key, or None.
+
+        Lookups are timed as "response_cache.hit" or "response_cache.miss".
+        """
+        cache = self.runtime.response_cache
+        if cache is None or vector is None or key is None:
+            return None
+        started = time.perf_counter()
+        response, similarity = cache.get(key, vector)
+        stage = "response_cache.hit" if response is not None else "response_cache.miss"
+        telemetry.record(stage, (time.perf_counter() - started) * 1000, spans=self._spans)
+        if DEBUG and response is not None:
+            print(f"♻️  Cached response (similarity {similarity:.3f})")
+        return response
+
+    def _replay_cached(self, user_input, response):
+        """Record a cached exchange in the chat history, as if the agent had run."""
+        history = self.get_session_history()
+        history.add_user_message(user_input)
+        history.add_ai_message(response)
+
+    def _cache_response(self, vector, key, response):
+        """Cache this turn's answer under its key; shorter-lived if a tool call went into it."""
+        cache = self.runtime.response_cache
+        if cache is None or vector is None or key is None or not response:
+            return
+        # An answer missing a timed-out tool's result isn't worth repeating
+        if any(span["stage"].startswith("tool_timeout:") for span in self._spans):
+            return
+        used_tools = any(span["stage"].startswith("tool:") for span in self._spans)
+        cache.put(key, vector, response, ttl=RESPONSE_CACHE_TOOL_TTL if used_tools else None)
+
+    def _agent_input(self, user_input, memory=""):
+        system_prompt = persona_prompt(self.persona)
+        if memory:
+            system_prompt = f"{system_prompt}\n\n{memory}"
+        return {"input": user_input, "system_prompt": system_prompt}
+
+    def _agent_config(self):
+        return {
+            "configurable": {"session_id": self.session_id},
+            "callbacks": [TelemetryCallbackHandler(telemetry, self._spans)],
+        }
+
+    def _begin_turn(self):
+        self._spans = []
+
+    def _end_turn(self):
+        self.last_turn = self._spans
+        dump_telemetry(self.last_turn)
+
     def chat(self, user_input):
         """Process user input with current persona and return response."""
+        self._begin_turn()
         try:
-            # Save user message
-            self.save_message("user", user_input)
-            
-            # Invoke tools-enabled agent with session-scoped history
-            result = self.agent_with_history.invoke(
-                {"input": user_input, "system_prompt": persona_prompt(self.persona)},
-                config={"configurable": {"session_id": self.session_id}},
-            )
-            # AgentExecutor returns dict with "output"
-            if isinstance(result, dict) and "output" in result:
-                response_text = result["output"]
-            else:
-                response_text = getattr(result, "content", str(result))
-            
-            # Save assistant response
-            self.save_message("assistant", response_text)
-            
-            return response_text
-            
+            with self._span("turn"):
+                # Recall related messages from earlier sessions (if enabled) and save the user message
+                vector, memory = self._recall(user_input)
+                vector = self._embed_for_cache(user_input, vector)
+                self.save_message("user", user_input, vector=vector)
+
+                # A near-duplicate of an earlier question is answered from the response cache
+                cache_key = self._cache_key()
+                cached = self._cached_response(vector, cache_key)
+                if cached is not None:
+                    self._replay_cached(user_input, cached)
+                    self.save_message("assistant", cached)
+                    return cached
+
+                # Invoke tools-enabled agent with session-scoped history
+                result = self.agent_with_history.invoke(
+                    self._agent_input(user_input, memory),
+                    config=self._agent_config(),
+                )
+                # AgentExecutor returns dict with "output"
+                if isinstance(result, dict) and "output" in result:
+                    response_text = result["output"]
+                else:
+                    response_text = getattr(result, "content", str(result))
+
+                # Save assistant response
+                self.save_message("assistant", response_text)
+                self._cache_response(vector, cache_key, response_text)
+
+                return response_text
+
         except Exception as e:
             error_msg = f"Error: {str(e)}"
             print(f"\n⚠️  {error_msg}\n")
@@ -372,40 +1165,218 @@ class PersonaAgent:
                 import traceback
                 traceback.print_exc()
             return None
+        finally:
+            self._end_turn()
     
+    async def achat(self, user_input):
+        """Async variant of chat; safe to run many sessions concurrently on one event loop."""
+        self._begin_turn()
+        try:
+            with self._span("turn"):
+                vector, memory = await self._arecall(user_input)
+                vector = await self._aembed_for_cache(user_input, vector)
+                await self.asave_message("user", user_input, vector=vector)
+
+                cache_key = self._cache_key()
+                cached = self._cached_response(vector, cache_key)
+                if cached is not None:
+                    self._replay_cached(user_input, cached)
+                    await self.asave_message("assistant", cached)
+                    return cached
+
+                result = await self.agent_with_history.ainvoke(
+                    self._agent_input(user_input, memory),
+                    config=self._agent_config(),
+                )
+                if isinstance(result, dict) and "output" in result:
+                    response_text = result["output"]
+                else:
+                    response_text = getattr(result, "content", str(result))
+
+                await self.asave_message("assistant", response_text)
+                self._cache_response(vector, cache_key, response_text)
+
+                return response_text
+
+        except Exception as e:
+            print(f"\n⚠️  Error: {str(e)}\n")
+            if DEBUG:
+                import traceback
+                traceback.print_exc()
+            return None
+        finally:
+            self._end_turn()
+
+    async def astream_chat(self, user_input):
+        """Stream a reply as events: token, tool_start, tool_end, then done (or error).
+
+        The assistant message is persisted once the stream completes.
+        """
+        self._begin_turn()
+        try:
+            with self._span("turn"):
+                vector, memory = await self._arecall(user_input)
+                vector = await self._aembed_for_cache(user_input, vector)
+                await self.asave_message("user", user_input, vector=vector)
+
+                tokens = []
+                # A near-duplicate of an earlier question is answered from the response cache
+                cache_key = self._cache_key()
+                response_text = self._cached_response(vector, cache_key)
+                cached = response_text is not None
+                if cached:
+                    self._replay_cached(user_input, response_text)
+                    yield {"type": "token", "content": response_text}
+                else:
+                    history_runnable = self.agent_with_history
+                    executor_name = self.agent.get_name()
+                    # Only the agent's own model runs are streamed: not summarizer folds, not tools' LLM calls
+                    executor_run, tool_runs = None, set()
+                    async for event in history_runnable.astream_events(
+                        self._agent_input(user_input, memory),
+                        config=self._agent_config(),
+                        version="v2",
+                    ):
+                        kind = event["event"]
+                        parents = event.get("parent_ids") or ()
+                        if kind == "on_chain_start" and executor_run is None and event["name"] == executor_name:
+                            executor_run = event["run_id"]
+                        elif kind == "on_chat_model_stream":
+                            if (executor_run not in parents or tool_runs.intersection(parents)
+                                    or SUMMARIZER_TAG in (event.get("tags") or ())):
+                                continue
+                            content = event["data"]["chunk"].content
+                            if content:
+                                tokens.append(content)
+                                yield {"type": "token", "content": content}
+                        elif kind == "on_tool_start":
+                            tool_runs.add(event["run_id"])
+                            yield {"type": "tool_start", "name": event["name"], "input": event["data"].get("input")}
+                        elif kind == "on_tool_end":
+                            tool_runs.discard(event["run_id"])
+                            yield {"type": "tool_end", "name": event["name"],
+                                   "output": str(event["data"].get("output"))}
+                        elif kind == "on_chain_end" and event["run_id"] == executor_run:
+                            output = event["data"].get("output")
+                            if isinstance(output, dict) and "output" in output:
+                                response_text = output["output"]
+
+                if response_text is None:
+                    response_text = "".join(tokens)
+
+                await self.asave_message("assistant", response_text)
+                if not cached:
+                    self._cache_response(vector, cache_key, response_text)
+
+        except Exception as e:
+            error_msg = f"Error: {str(e)}"
+            if DEBUG:
+                import traceback
+                traceback.print_exc()
+            self._end_turn()
+            yield {"type": "error", "content": error_msg}
+            return
+
+        self._end_turn()
+        yield {"type": "done", "content": response_text}
+
+    def stream_chat(self, user_input):
+        """Synchronous generator over astream_chat events, for the CLI loop."""
+        loop = asyncio.new_event_loop()
+        events = self.astream_chat(user_input)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(events.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(events.aclose())
+            loop.close()
+
+    def flush(self):
+        """Write out any queued messages."""
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """Flush queued messages and stop background workers (a shared write-behind queue is only flushed)."""
+        if self.writer is not None:
+            if self._owns_writer:
+                self.writer.close()
+            else:
+                self.writer.flush()
+        dump_telemetry(self.last_turn, force=True)
+
     def clear_conversation(self):
         """Start a new conversation session."""
+        self.flush()
         self.session_id = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.persona = "neutral"
-        # New session uses a fresh history; keep old session history in memory
+        self._older_ids = []
+        # New session uses a fresh history; old histories stay in the bounded store
         print(f"✓ Started new session: {self.session_id}\n")
 
-    def semantic_search(self, query: str, top_k: int = 5, current_session_only: bool = True):
-        """Search stored messages semantically using Milvus."""
+    def _scan_messages(self):
+        """Yield every stored message (all sessions, except summaries) for the lexical index backfill."""
+        iterator = self.milvus.query_iterator(
+            collection_name=self.collection_name,
+            batch_size=PAGE_SIZE,
+            filter='role != "summary"',
+            output_fields=["timestamp", "role", "content", "persona", "session_id"],
+        )
         try:
-            query_vec = embeddings.embed_query(query)
+            while True:
+                page = iterator.next()
+                if not page:
+                    break
+                yield from page
+        finally:
+            iterator.close()
+
+    def _vector_search(self, query, limit, session_id=None):
+        try:
+            with self._span("embed"):
+                query_vec = self.runtime.embeddings.embed_query(query)
         except Exception as e:
             print(f"⚠️  Failed to embed query: {e}")
             return []
+        return self._search_vectors([query_vec], limit, session_id)[0]
 
-        milvus_filter = None
-        if current_session_only:
-            milvus_filter = f'session_id == "{self.session_id}"'
+    def _vector_search_many(self, queries, limit, session_id=None):
+        """Vector rankings for many queries: one embed_documents call and one multi-vector search."""
+        try:
+            with self._span("embed"):
+                query_vecs = self.runtime.embeddings.embed_documents(list(queries))
+        except Exception as e:
+            print(f"⚠️  Failed to embed queries: {e}")
+            return [[] for _ in queries]
+        return self._search_vectors(query_vecs, limit, session_id)
 
+    def _search_vectors(self, query_vecs, limit, session_id=None):
+        """Search Milvus with a batch of query vectors; returns one list of hit rows per vector."""
+        milvus_filter = f'session_id == {json.dumps(session_id)}' if session_id else None
         try:
-            results = client_milvus.search(
-                collection_name=self.collection_name,
-                data=[query_vec],
-                limit=top_k,
-                filter=milvus_filter,
-                output_fields=["timestamp", "role", "content", "persona", "session_id"],
-                search_params={"metric_type": METRIC_TYPE}
-            )
-            # MilvusClient returns a list of hits per query
-            hits = results[0] if results else []
-            return [
+            with self._span("milvus.search"):
+                results = self.milvus.search(
+                    collection_name=self.collection_name,
+                    data=query_vecs,
+                    limit=limit,
+                    filter=milvus_filter,
+                    output_fields=["timestamp", "role", "content", "persona", "session_id"],
+                    search_params={"metric_type": METRIC_TYPE}
+                )
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Search error: {e}")
+            return [[] for _ in query_vecs]
+        # MilvusClient returns a list of hits per query
+        results = list(results or [])
+        results += [[]] * (len(query_vecs) - len(results))
+        return [
+            [
                 {
-                    "score": hit.get("distance") or hit.get("score"),
+                    "score": hit.get("distance", hit.get("score")),
                     "timestamp": hit.get("entity", {}).get("timestamp"),
                     "role": hit.get("entity", {}).get("role"),
                     "content": hit.get("entity", {}).get("content"),
@@ -414,10 +1385,66 @@ class PersonaAgent:
                 }
                 for hit in hits
             ]
+            for hits in results
+        ]
+
+    def _lexical_search(self, query, limit, session_id=None):
+        try:
+            if not self.lexical.loaded:
+                with self._span("lexical.backfill"):
+                    self.lexical.ensure_loaded(self._scan_messages)
         except Exception as e:
+            # Still searchable: messages saved by this process are indexed
             if DEBUG:
-                print(f"⚠️  Search error: {e}")
+                print(f"⚠️  Lexical index backfill failed: {e}")
+        with self._span("lexical.search"):
+            return [dict(row, score=score) for row, score in self.lexical.search(query, limit, session_id)]
+
+    def semantic_search(self, query: str, top_k: int = 5, current_session_only: bool = True, mode: str = None):
+        """Search stored messages.
+
+        mode is "hybrid" (BM25 and vector rankings fused with reciprocal rank fusion), "vector",
+        or "lexical" (BM25 only, no embedding call); defaults to SEARCH_MODE.
+        """
+        return self.semantic_search_many([query], top_k, current_session_only, mode)[0]
+
+    def semantic_search_many(self, queries, top_k: int = 5, current_session_only: bool = True, mode: str = None):
+        """Search stored messages for each of many queries; returns one result list per query.
+
+        All queries are embedded with one embed_documents call and sent as one multi-vector
+        search (a single query uses embed_query, sharing its cache entry with chat turns).
+        Lexical rankings come from the in-process BM25 index. Modes are as in semantic_search.
+        """
+        mode = (mode or SEARCH_MODE).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{mode}' (expected one of {', '.join(SEARCH_MODES)})")
+        queries = list(queries)
+        if not queries:
             return []
+        # Make queued messages visible to the search
+        self.flush()
+        session_id = self.session_id if current_session_only else None
+
+        def vector_rankings(limit):
+            if len(queries) == 1:
+                return [self._vector_search(queries[0], limit, session_id)]
+            return self._vector_search_many(queries, limit, session_id)
+
+        if mode == "lexical":
+            return [self._lexical_search(query, top_k, session_id) for query in queries]
+        if mode == "vector":
+            return vector_rankings(top_k)
+
+        candidates = max(top_k * HYBRID_CANDIDATES, top_k)
+        results = []
+        for query, vector in zip(queries, vector_rankings(candidates)):
+            lexical = self._lexical_search(query, candidates, session_id)
+            rows = {}
+            for row in vector + lexical:
+                rows.setdefault(doc_key(row), row)
+            fused = reciprocal_rank_fusion([[doc_key(r) for r in vector], [doc_key(r) for r in lexical]], k=RRF_K)
+            results.append([dict(rows[key], score=score) for key, score in fused[:top_k]])
+        return results
 
 
 # Main conversation loop
@@ -428,22 +1455,39 @@ def main():
     print("Commands:")
     print("  /persona <name> - Change persona (pirate, clown, surfer, frenchman, jimmy)")
     print("  /clear          - Start a new conversation")
-    print("  /search <query> - Semantic search in memory")
+    print("  /stats          - Latency and errors per stage (embedding, Milvus, LLM, tools)")
+    print("  /search <query> - Search memory (add --lexical or --vector to pick one ranking)")
+    print("  /older          - Show the messages before those loaded when the session resumed")
     print("  /exit           - Exit the program")
     print("=" * 60)
     print()
     
     # Initialize agent
-    agent = PersonaAgent(client_milvus, collection_name)
+    agent = PersonaAgent(runtime.milvus, runtime.collection_name)
+
+    # Cold start: module import to the first prompt
+    startup_ms = (time.perf_counter() - _IMPORT_STARTED) * 1000
+    telemetry.record("startup", startup_ms)
+    if DEBUG:
+        print(f"⏱️  Ready in {startup_ms:.0f} ms")
+        if startup_ms > STARTUP_BUDGET_MS:
+            print(f"⚠️  Startup took {startup_ms:.0f} ms, over the {STARTUP_BUDGET_MS:.0f} ms budget")
+
+    # LLM, embeddings, tools and the agent executor are built while the user types
+    if WARM_UP:
+        threading.Thread(target=agent.warm_up, name="warm-up", daemon=True).start()
     
     while True:
         try:
-            user_input = input(f"You: ").strip()
+            user_input = input("You: ").strip()
             
             if not user_input:
                 continue
             
             if user_input == "/exit":
+                if DEBUG:
+                    print(f"🧮 Embedding cache: {runtime.embeddings.stats()}")
+                agent.close()
                 print("\n👋 Goodbye!")
                 break
             
@@ -452,7 +1496,7 @@ def main():
                 if len(parts) > 1:
                     persona = parts[1]
                     agent.set_persona(persona)
-                    print(f"✓ Persona set to '{persona}'\n")
+                    print(f"✓ Persona set to '{agent.persona}'\n")
                 else:
                     print("⚠️  Please specify a persona: /persona <name>\n")
                 continue
@@ -461,29 +1505,60 @@ def main():
                 agent.clear_conversation()
                 continue
 
+            if user_input == "/stats":
+                print()
+                print(format_stats(telemetry.summary(), agent.last_turn))
+                if runtime.response_cache is not None:
+                    print(f"\nResponse cache: {runtime.response_cache.stats()}")
+                print()
+                continue
+
+            if user_input == "/older":
+                rows = agent.load_older_messages()
+                if not rows:
+                    print("\n(no earlier messages)\n")
+                else:
+                    print()
+                    for r in rows:
+                        print(f"{format_timestamp(r['timestamp'])} [{r['role']}] ({r['persona']}) {r['content'][:200]}")
+                    print()
+                continue
+
             if user_input.startswith("/search "):
                 query = user_input.split(" ", 1)[1].strip()
-                results = agent.semantic_search(query)
+                mode = None
+                for flag in ("--lexical", "--vector", "--hybrid"):
+                    if query.startswith(flag + " "):
+                        mode, query = flag[2:], query[len(flag):].strip()
+                results = agent.semantic_search(query, mode=mode)
                 if not results:
                     print("\n(no results)\n")
                 else:
                     print("\nTop matches:\n")
                     for i, r in enumerate(results, 1):
                         score = r.get("score")
-                        print(f"{i}. [{r['role']}] ({r['persona']}) {r['timestamp']}  score={score}")
+                        score = f"{score:.4f}" if isinstance(score, (int, float)) else score
+                        print(f"{i}. [{r['role']}] ({r['persona']}) {format_timestamp(r['timestamp'])}  score={score}")
                         print(f"   {r['content'][:200]}\n")
                 continue
             
-            # Get response
-            response = agent.chat(user_input)
-            
-            if response:
-                print(f"\nAssistant ({agent.persona}): {response}\n")
+            # Stream response as it is generated
+            print(f"\nAssistant ({agent.persona}): ", end="", flush=True)
+            for event in agent.stream_chat(user_input):
+                if event["type"] == "token":
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "tool_start":
+                    print(f"[🔧 {event['name']}] ", end="", flush=True)
+                elif event["type"] == "error":
+                    print(f"\n⚠️  {event['content']}", end="")
+            print("\n")
         
         except KeyboardInterrupt:
+            agent.close()
             print("\n\n👋 Goodbye!")
             break
         except EOFError:
+            agent.close()
             print("\n\n👋 Goodbye!")
             break
 
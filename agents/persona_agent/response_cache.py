@@ -0,0 +1,128 @@
+"""
+Semantic response cache: answers to earlier user messages, reused for near-duplicates.
+
+A lookup compares the new message's embedding with cached ones under the same key and
+returns the stored answer when the cosine similarity reaches the threshold. The caller's
+key says what else the answer depended on: the agent uses the persona plus a digest of the
+conversation so far, so a follow-up is only answered from a turn with the same context. Entries carry
+their own TTL (callers give answers that depended on tools a shorter one), and past
+max_entries the least recently used entry makes room.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResponseCache:
+    """Thread-safe, size-bounded cache of responses keyed by (key string, message embedding)."""
+
+    def __init__(self, threshold=0.95, ttl=3600, max_entries=1000, clock=time.monotonic):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._vectors = None              # slot -> normalized embedding, allocated on first put
+        self._keys = np.full(max_entries, None, dtype=object)
+        self._expires = np.full(max_entries, -np.inf)
+        self._responses = [None] * max_entries
+        self._lru = OrderedDict()         # occupied slots, least recently used first
+        self._free = list(range(max_entries - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, key, vector):
+        """Return (response, similarity) of the closest live entry at or above the threshold,
+        or (None, best similarity seen)."""
+        vector = self._normalize(vector)
+        with self._lock:
+            if self._vectors is None or not self._lru or self._vectors.shape[1] != len(vector):
+                self.misses += 1
+                return None, 0.0
+            live = (self._keys == key) & (self._expires > self._clock())
+            if not live.any():
+                self.misses += 1
+                return None, 0.0
+            scores = np.where(live, self._vectors @ vector, -np.inf)
+            slot = int(np.argmax(scores))
+            similarity = float(scores[slot])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+            self._lru.move_to_end(slot)
+            self.hits += 1
+            return self._responses[slot], similarity
+
+    def put(self, key, vector, response, ttl=None):
+        """Cache response for this key and message embedding for ttl seconds (default self.ttl)."""
+        vector = self._normalize(vector)
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                # First entry, or the embedding model changed: start over at the new dimension
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self._reset_slots()
+            if not self._free:
+                self._reclaim()
+            slot = self._free.pop()
+            self._vectors[slot] = vector
+            self._keys[slot] = key
+            self._expires[slot] = self._clock() + ttl
+            self._responses[slot] = response
+            self._lru[slot] = None
+
+    def _release(self, slot):
+        del self._lru[slot]
+        self._keys[slot] = None
+        self._expires[slot] = -np.inf
+        self._responses[slot] = None
+        self._free.append(slot)
+
+    def _reclaim(self):
+        """Free expired slots, or else the least recently used one."""
+        expired = np.flatnonzero((self._expires <= self._clock()) & (self._keys != None))  # noqa: E711
+        for slot in expired.tolist():
+            self._release(slot)
+        self.expirations += len(expired)
+        if not self._free:
+            self._release(next(iter(self._lru)))
+            self.evictions += 1
+
+    def _reset_slots(self):
+        self._keys[:] = None
+        self._expires[:] = -np.inf
+        self._responses = [None] * self.max_entries
+        self._lru.clear()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+    def clear(self):
+        with self._lock:
+            self._reset_slots()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._lru),
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
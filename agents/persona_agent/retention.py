@@ -0,0 +1,251 @@
+"""
+Retention: condense old sessions into one summary row each and reclaim their storage.
+
+    python3 retention.py [--older-than-days 90] [--collection persona_conversations] [--dry-run]
+
+A session whose newest message is older than the cutoff (RETENTION_DAYS by default) is
+condensed: its messages are folded into the session's rolling summary with the LLM (a
+chunk of messages at a time, starting from the summary already stored), the result is
+embedded and inserted as a "summary" row, and then every earlier row of the session is
+deleted in batches. The summary keeps the session's last timestamp and stays searchable
+with semantic_search. Once all sessions are done the collection is compacted.
+
+The new summary is written before anything is deleted, so an interrupted run loses nothing;
+running again picks the session up from that summary. Run it while the agent is stopped:
+an agent's lexical index would keep serving deleted rows until it restarts. In-process
+callers can pass the agent's index (lexical_index=agent.lexical) to drop them as they go.
+
+The report gives rows deleted and bytes reclaimed: an estimate from the deleted rows
+(vector bytes for the collection's layout plus field contents) and the change in size on
+disk. Milvus Lite compacts segments without shrinking its file right away, so on-disk
+savings there can lag the estimate; the NumPy store rewrites its files.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from history import fallback_summary
+from lexical_index import doc_key
+from project import (
+    COLLECTION_NAME,
+    DEBUG,
+    MILVUS_URI,
+    NUMPY_STORE_PATH,
+    RETENTION_DAYS,
+    VECTOR_STORE,
+    clip_text,
+    collection_layout,
+    runtime,
+    summarize_messages,
+)
+
+DAY_MS = 24 * 60 * 60 * 1000
+# Fixed per-row bytes outside the vector and text fields: id and timestamp (INT64)
+_ROW_OVERHEAD = 16
+
+
+def disk_usage(path):
+    """Bytes used by a file or directory tree (0 if it doesn't exist)."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def store_path(collection_name):
+    """Where the configured store keeps a collection on disk."""
+    if VECTOR_STORE == "numpy":
+        return os.path.join(NUMPY_STORE_PATH, collection_name)
+    return MILVUS_URI
+
+
+def _scan(client, collection_name, batch_size, filter, output_fields):
+    iterator = client.query_iterator(collection_name=collection_name, batch_size=batch_size,
+                                     filter=filter, output_fields=output_fields)
+    try:
+        while True:
+            page = iterator.next()
+            if not page:
+                break
+            yield from page
+    finally:
+        iterator.close()
+
+
+def find_old_sessions(client, collection_name, cutoff_ms, batch_size=1000):
+    """Sessions whose newest row is older than cutoff_ms and that still have rows other than a summary.
+
+    Returns [(session_id, newest timestamp)], oldest first. One scan of scalar fields.
+    """
+    newest = {}
+    raw = set()
+    for row in _scan(client, collection_name, batch_size, "", ["session_id", "timestamp", "role"]):
+        session_id, timestamp = row["session_id"], row.get("timestamp") or 0
+        newest[session_id] = max(newest.get(session_id, 0), timestamp)
+        if row["role"] != "summary":
+            raw.add(session_id)
+    old = [(session_id, ts) for session_id, ts in newest.items() if ts < cutoff_ms and session_id in raw]
+    return sorted(old, key=lambda item: item[1])
+
+
+def row_bytes(row, vector_bytes):
+    """Approximate storage of one row: its vector(s), text fields and fixed-width fields."""
+    text = sum(len(str(row.get(field) or "").encode("utf-8")) for field in ("session_id", "role", "persona", "content"))
+    return vector_bytes + text + _ROW_OVERHEAD
+
+
+def condense_session(client, collection_name, session_id, summarize, embed, batch_size=1000,
+                     fold_messages=40, vector_bytes=0, lexical_index=None):
+    """Replace a session's rows with one summary row.
+
+    Returns {"rows": rows deleted, "bytes": their estimated size, "summary": whether one was written}.
+    """
+    session_filter = f"session_id == {json.dumps(session_id)}"
+
+    # First pass, scalar fields only: what to delete, and the summary to continue from
+    ids, summary_row = [], None
+    for row in _scan(client, collection_name, batch_size, session_filter,
+                     ["id", "role", "covered_messages", "archived_messages"]):
+        ids.append(row["id"])
+        if row["role"] == "summary" and (summary_row is None or row["id"] > summary_row["id"]):
+            summary_row = row
+    summary, covered = "", 0
+    if summary_row is not None:
+        summary = client.query(collection_name=collection_name, filter=f"id in [{summary_row['id']}]",
+                               output_fields=["content"])[0]["content"]
+        # A summary left by an interrupted retention run covers every message it archived
+        covered = summary_row.get("archived_messages") or summary_row.get("covered_messages") or 0
+
+    # Second pass: fold the messages the summary doesn't cover yet, a chunk at a time
+    chat_seen, reclaimed = 0, 0
+    newest, persona = 0, "neutral"
+    chunk, keys = [], []
+    for row in _scan(client, collection_name, batch_size, session_filter,
+                     ["id", "role", "content", "persona", "timestamp"]):
+        reclaimed += row_bytes(dict(row, session_id=session_id), vector_bytes)
+        keys.append(doc_key(dict(row, session_id=session_id)))
+        newest = max(newest, row.get("timestamp") or 0)
+        if row["role"] not in ("user", "assistant"):
+            continue
+        persona = row.get("persona") or persona
+        chat_seen += 1
+        if chat_seen <= covered:
+            continue
+        message_type = HumanMessage if row["role"] == "user" else AIMessage
+        chunk.append(message_type(content=row["content"]))
+        if len(chunk) >= fold_messages:
+            summary = summarize(summary, chunk)
+            chunk = []
+    if chunk:
+        summary = summarize(summary, chunk)
+
+    # A session with nothing but persona changes leaves no summary behind
+    if summary.strip():
+        client.insert(collection_name=collection_name, data=[{
+            "timestamp": newest,
+            "session_id": session_id,
+            "role": "summary",
+            "content": clip_text(summary),
+            "persona": persona,
+            # No message rows remain, so a resumed session replays none
+            "covered_messages": 0,
+            "archived_messages": chat_seen,
+            "vector": embed(summary),
+        }])
+    for start in range(0, len(ids), batch_size):
+        client.delete(collection_name=collection_name, filter=f"id in {ids[start:start + batch_size]}")
+    if lexical_index is not None:
+        lexical_index.remove(keys)
+    return {"rows": len(ids), "bytes": reclaimed, "summary": bool(summary.strip())}
+
+
+def compact(client, collection_name, timeout=300):
+    """Compact the collection (waits for a Milvus compaction job to finish, up to timeout seconds)."""
+    job = client.compact(collection_name)
+    if isinstance(job, int) and hasattr(client, "get_compaction_state"):
+        deadline = time.monotonic() + timeout
+        while client.get_compaction_state(job) != "Completed" and time.monotonic() < deadline:
+            time.sleep(0.5)
+
+
+def run_retention(client, collection_name, older_than_days=RETENTION_DAYS, summarize=None, embed=None,
+                  batch_size=1000, fold_messages=40, dry_run=False, path=None, now_ms=None, lexical_index=None):
+    """Condense every session idle for more than older_than_days, then compact. Returns a report dict."""
+    now_ms = now_ms if now_ms is not None else int(time.time() * 1000)
+    cutoff_ms = now_ms - int(older_than_days * DAY_MS)
+    path = path or store_path(collection_name)
+    report = {"sessions": 0, "rows_deleted": 0, "summaries_written": 0, "bytes_reclaimed_estimate": 0,
+              "disk_bytes_before": disk_usage(path), "disk_bytes_after": None, "disk_bytes_reclaimed": None}
+    if not client.has_collection(collection_name):
+        print(f"Collection '{collection_name}' does not exist; nothing to do.")
+        return report
+
+    client.load_collection(collection_name)
+    sessions = find_old_sessions(client, collection_name, cutoff_ms, batch_size)
+    report["sessions"] = len(sessions)
+    if dry_run:
+        print(f"{len(sessions)} sessions are older than {older_than_days:g} days (dry run; nothing changed)")
+        return report
+
+    vector_bytes = collection_layout(client, collection_name).bytes_per_vector()
+    for session_id, _ in sessions:
+        result = condense_session(client, collection_name, session_id, summarize, embed, batch_size,
+                                  fold_messages, vector_bytes, lexical_index)
+        report["rows_deleted"] += result["rows"]
+        report["bytes_reclaimed_estimate"] += result["bytes"]
+        report["summaries_written"] += result["summary"]
+        if DEBUG:
+            print(f"  condensed session {session_id}: {result['rows']} rows")
+    if sessions:
+        compact(client, collection_name)
+    report["disk_bytes_after"] = disk_usage(path)
+    report["disk_bytes_reclaimed"] = report["disk_bytes_before"] - report["disk_bytes_after"]
+    return report
+
+
+def llm_summarizer(llm, max_chars=4000):
+    """summarize(summary, messages) backed by the LLM, clipping the transcript if the call fails."""
+    def summarize(summary, messages):
+        try:
+            return summarize_messages(llm, summary, messages)
+        except Exception as e:
+            if DEBUG:
+                print(f"⚠️  Summarizer unavailable ({type(e).__name__}); keeping clipped lines")
+            return fallback_summary(summary, messages, max_chars)
+    return summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Condense old sessions into summaries and reclaim storage")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    parser.add_argument("--older-than-days", type=float, default=RETENTION_DAYS)
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per scan page and per delete")
+    parser.add_argument("--fold-messages", type=int, default=40, help="messages folded into the summary per LLM call")
+    parser.add_argument("--dry-run", action="store_true", help="only count the sessions that would be condensed")
+    args = parser.parse_args()
+
+    report = run_retention(
+        runtime.milvus, args.collection, older_than_days=args.older_than_days,
+        summarize=llm_summarizer(runtime.llm), embed=runtime.embeddings.embed_query,
+        batch_size=args.batch_size, fold_messages=args.fold_messages, dry_run=args.dry_run,
+    )
+    if not args.dry_run:
+        print(f"✓ Condensed {report['sessions']} sessions: {report['rows_deleted']} rows deleted, "
+              f"{report['summaries_written']} summaries written")
+        print(f"  Reclaimed ~{report['bytes_reclaimed_estimate'] / 2**20:.1f} MB of row data; "
+              f"on disk {report['disk_bytes_reclaimed'] / 2**20:+.1f} MB")
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
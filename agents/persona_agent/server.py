@@ -0,0 +1,293 @@
+"""
+Async multi-session server for the Persona Agent.
+
+Serves many concurrent session_ids from one event loop over HTTP and WebSocket:
+
+    POST /chat     {"session_id": "...", "message": "..."}  -> {"session_id", "persona", "response"}
+    POST /persona  {"session_id": "...", "persona": "..."}  -> {"session_id", "persona"}
+    GET  /ws?session_id=...  WebSocket; send {"message": "..."} and receive streamed chat events
+    GET  /health
+    GET  /metrics  per-stage latency and error counts (Prometheus text format)
+
+Turns within one session run strictly in order; at most MAX_CONCURRENCY turns run at once, and
+at most MAX_SESSIONS sessions are kept in memory. session_id must be up to 64 letters, digits,
+'_', '-', '.' or ':'; other ids and malformed JSON bodies get a 400.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+from aiohttp import web
+
+from project import (
+    DEBUG,
+    HISTORY_MAX_SESSIONS,
+    WRITE_BEHIND,
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_FLUSH_SECONDS,
+    PersonaAgent,
+    check_session_id,
+    runtime,
+    telemetry,
+)
+from lexical_index import LexicalIndex
+from write_behind import WriteBehindQueue
+
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "32"))
+# Sessions kept in memory; the least recently used idle one is closed beyond this and resumed when touched again
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", str(HISTORY_MAX_SESSIONS)))
+
+
+class _Session:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+        self.agent = None
+
+
+class SessionPool:
+    """One PersonaAgent per session_id, with per-session ordering and a global concurrency limit.
+
+    At most max_sessions agents are kept; beyond that the least recently used session nobody
+    is using or waiting for is closed, and resumed from Milvus if it comes back.
+    """
+
+    def __init__(self, milvus_client, collection_name, max_concurrency=MAX_CONCURRENCY, write_behind=None,
+                 max_sessions=MAX_SESSIONS):
+        self.milvus = milvus_client
+        self.collection_name = collection_name
+        self.max_sessions = max_sessions
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        if write_behind is None:
+            write_behind = WRITE_BEHIND
+        # Sessions share one write-behind queue instead of one worker thread each
+        self.writer = None
+        if write_behind:
+            self.writer = WriteBehindQueue(
+                milvus_client,
+                collection_name,
+                runtime.embeddings,
+                runtime.embedding_dim,
+                batch_size=WRITE_BEHIND_BATCH_SIZE,
+                flush_interval=WRITE_BEHIND_FLUSH_SECONDS,
+                debug=DEBUG,
+            )
+        # ...and one BM25 index, backfilled from Milvus once rather than per session
+        self.lexical = LexicalIndex()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @contextlib.asynccontextmanager
+    async def session(self, session_id):
+        """Hold a session's turn lock; a session is never evicted while in use or waited for."""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = _Session()
+        self._sessions.move_to_end(session_id)
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield entry
+        finally:
+            entry.users -= 1
+        await self._evict()
+
+    async def get_agent(self, entry, session_id):
+        """Return the session's agent, resuming it from Milvus on first use (callers hold the session)."""
+        if entry.agent is None:
+            entry.agent = await asyncio.to_thread(
+                PersonaAgent,
+                self.milvus,
+                self.collection_name,
+                session_id=session_id,
+                write_behind=self.writer or False,
+                lexical_index=self.lexical,
+            )
+        return entry.agent
+
+    async def _evict(self):
+        idle = [sid for sid, entry in self._sessions.items() if entry.users == 0]
+        for session_id in idle[:max(0, len(self._sessions) - self.max_sessions)]:
+            entry = self._sessions.pop(session_id)
+            self.evictions += 1
+            if entry.agent is not None:
+                await asyncio.to_thread(entry.agent.close)
+
+    async def chat(self, session_id, message):
+        async with self.session(session_id) as entry:
+            agent = await self.get_agent(entry, session_id)
+            async with self._semaphore:
+                response = await agent.achat(message)
+        return agent, response
+
+    async def stream_chat(self, session_id, message):
+        """Yield chat events for one turn, holding the session for the whole stream."""
+        async with self.session(session_id) as entry:
+            agent = await self.get_agent(entry, session_id)
+            async with self._semaphore:
+                async for event in agent.astream_chat(message):
+                    yield event
+
+    async def set_persona(self, session_id, persona):
+        async with self.session(session_id) as entry:
+            agent = await self.get_agent(entry, session_id)
+            await agent.aset_persona(persona)
+        return agent
+
+    def close(self):
+        for entry in self._sessions.values():
+            if entry.agent is not None:
+                entry.agent.close()
+        self._sessions.clear()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def _new_session_id():
+    return datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+
+
+def _bad_request(error):
+    return web.json_response({"error": error}, status=400)
+
+
+async def _read_json(request):
+    """The request's JSON object body, or None if it is malformed or not an object."""
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _text(body, key):
+    """body[key] stripped ("" if missing), or None if it isn't a string."""
+    value = body.get(key)
+    if value is None:
+        return ""
+    return value.strip() if isinstance(value, str) else None
+
+
+def _valid_session_id(session_id):
+    try:
+        check_session_id(session_id)
+    except ValueError:
+        return False
+    return True
+
+
+async def handle_chat(request):
+    pool = request.app["pool"]
+    body = await _read_json(request)
+    if body is None:
+        return _bad_request("body must be a JSON object")
+    message = _text(body, "message")
+    if message is None:
+        return _bad_request("message must be a string")
+    if not message:
+        return _bad_request("message is required")
+    session_id = body.get("session_id") or _new_session_id()
+    if not _valid_session_id(session_id):
+        return _bad_request("invalid session_id")
+    agent, response = await pool.chat(session_id, message)
+    if response is None:
+        return web.json_response({"session_id": session_id, "error": "Unable to get response"}, status=502)
+    return web.json_response({"session_id": session_id, "persona": agent.persona, "response": response})
+
+
+async def handle_persona(request):
+    pool = request.app["pool"]
+    body = await _read_json(request)
+    if body is None:
+        return _bad_request("body must be a JSON object")
+    persona = _text(body, "persona")
+    if persona is None:
+        return _bad_request("persona must be a string")
+    session_id = body.get("session_id")
+    if not persona or not session_id:
+        return _bad_request("session_id and persona are required")
+    if not _valid_session_id(session_id):
+        return _bad_request("invalid session_id")
+    agent = await pool.set_persona(session_id, persona)
+    return web.json_response({"session_id": session_id, "persona": agent.persona})
+
+
+async def handle_ws(request):
+    pool = request.app["pool"]
+    session_id = request.query.get("session_id") or _new_session_id()
+    if not _valid_session_id(session_id):
+        return _bad_request("invalid session_id")
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    await ws.send_json({"type": "session", "session_id": session_id})
+
+    async for msg in ws:
+        if msg.type != web.WSMsgType.TEXT:
+            continue
+        try:
+            payload = msg.json()
+        except ValueError:
+            payload = None
+        if isinstance(payload, dict):
+            message = _text(payload, "message")
+        elif isinstance(payload, list):
+            message = None
+        else:
+            # Plain text (or a bare JSON scalar) is the message itself
+            message = msg.data.strip()
+        if message is None:
+            await ws.send_json({"type": "error", "content": 'send plain text or {"message": "<text>"}'})
+            continue
+        if not message:
+            continue
+        async for event in pool.stream_chat(session_id, message):
+            await ws.send_json(event)
+    return ws
+
+
+async def handle_health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def handle_metrics(request):
+    return web.Response(text=telemetry.to_prometheus(), content_type="text/plain")
+
+
+def create_app(pool):
+    app = web.Application()
+    app["pool"] = pool
+    app.router.add_post("/chat", handle_chat)
+    app.router.add_post("/persona", handle_persona)
+    app.router.add_get("/ws", handle_ws)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+
+    async def _on_cleanup(app):
+        await asyncio.to_thread(app["pool"].close)
+
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the Persona Agent over HTTP/WebSocket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY)
+    args = parser.parse_args()
+
+    async def _make_app():
+        return create_app(SessionPool(runtime.milvus, runtime.collection_name, max_concurrency=args.max_concurrency))
+
+    web.run_app(_make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
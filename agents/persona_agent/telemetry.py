@@ -0,0 +1,186 @@
+"""
+Per-stage latency and error tracking for chat turns.
+
+Telemetry keeps, per stage (embed, milvus.insert, llm, tool:get_weather, ...), a rolling
+window of latencies plus cumulative counts and errors. Callers may also pass a list to
+collect the spans of one turn, so the breakdown of the most recent turn can be shown.
+TelemetryCallbackHandler feeds LLM and tool timings from LangChain callbacks into the same store.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+class _Stage:
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.last_error = None
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+class Telemetry:
+    """Thread-safe rolling latency histograms and error counts per stage."""
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, elapsed_ms, error=None, spans=None):
+        """Add one sample for stage; spans, if given, also gets a {stage, ms, error} entry."""
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage(self.window)
+            entry.samples.append(elapsed_ms)
+            entry.count += 1
+            entry.total_ms += elapsed_ms
+            if error is not None:
+                entry.errors += 1
+                entry.last_error = f"{type(error).__name__}: {error}"
+        if spans is not None:
+            spans.append({"stage": stage, "ms": round(elapsed_ms, 2), "error": error is not None})
+
+    @contextmanager
+    def span(self, stage, spans=None):
+        """Time the block as one call of stage; an exception is counted as an error and re-raised."""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(stage, (time.perf_counter() - started) * 1000, error=e, spans=spans)
+            raise
+        self.record(stage, (time.perf_counter() - started) * 1000, spans=spans)
+
+    def summary(self):
+        """{stage: {count, errors, p50_ms, p95_ms, p99_ms, mean_ms, last_error}} over the rolling window."""
+        with self._lock:
+            stages = {name: (sorted(s.samples), s) for name, s in self._stages.items()}
+        out = {}
+        for name, (values, stage) in sorted(stages.items()):
+            row = {"count": stage.count, "errors": stage.errors}
+            for q in self.QUANTILES:
+                value = _quantile(values, q)
+                row[f"p{int(q * 100)}_ms"] = round(value, 2) if value is not None else None
+            row["mean_ms"] = round(sum(values) / len(values), 2) if values else None
+            row["last_error"] = stage.last_error
+            out[name] = row
+        return out
+
+    def to_prometheus(self, prefix="persona_agent"):
+        """Render the stages in the Prometheus text exposition format (as summaries)."""
+        with self._lock:
+            stages = {name: (sorted(s.samples), s.count, s.total_ms, s.errors) for name, s in self._stages.items()}
+        lines = [
+            f"# HELP {prefix}_stage_latency_ms Latency of each chat turn stage in milliseconds.",
+            f"# TYPE {prefix}_stage_latency_ms summary",
+        ]
+        for name, (values, count, total, _) in sorted(stages.items()):
+            for q in self.QUANTILES:
+                value = _quantile(values, q)
+                if value is not None:
+                    lines.append(f'{prefix}_stage_latency_ms{{stage="{name}",quantile="{q}"}} {value:.3f}')
+            lines.append(f'{prefix}_stage_latency_ms_sum{{stage="{name}"}} {total:.3f}')
+            lines.append(f'{prefix}_stage_latency_ms_count{{stage="{name}"}} {count}')
+        lines += [
+            f"# HELP {prefix}_stage_errors_total Errors raised by each stage.",
+            f"# TYPE {prefix}_stage_errors_total counter",
+        ]
+        for name, (_, _, _, errors) in sorted(stages.items()):
+            lines.append(f'{prefix}_stage_errors_total{{stage="{name}"}} {errors}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path, last_turn=None):
+        """Write the stats to path atomically: JSON for *.json, Prometheus text otherwise."""
+        if path.endswith(".json"):
+            body = json.dumps({"stages": self.summary(), "last_turn": last_turn or []}, indent=2)
+        else:
+            body = self.to_prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+
+
+def format_stats(summary, last_turn=None):
+    """Human-readable table of a Telemetry.summary(), plus the last turn's breakdown."""
+    if not summary:
+        return "(no stats yet)"
+    lines = [f"{'stage':<22} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for stage, row in summary.items():
+        cells = [f"{row[k]:>9.1f}" if row[k] is not None else f"{'-':>9}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        lines.append(f"{stage:<22} {row['count']:>6} {row['errors']:>6} {' '.join(cells)}")
+    errors = [(stage, row["last_error"]) for stage, row in summary.items() if row["last_error"]]
+    if errors:
+        lines.append("")
+        lines.append("Last errors:")
+        lines.extend(f"  {stage}: {message}" for stage, message in errors)
+    if last_turn:
+        lines.append("")
+        lines.append("Last turn: " + ", ".join(
+            f"{s['stage']} {s['ms']:.0f}ms" + (" (error)" if s["error"] else "") for s in last_turn))
+    return "\n".join(lines)
+
+
+class TelemetryCallbackHandler(BaseCallbackHandler):
+    """Records LLM calls as "llm" and tool calls as "tool:<name>" spans."""
+
+    # Cheap enough to run on the calling thread instead of an executor
+    run_inline = True
+
+    def __init__(self, telemetry, spans=None):
+        self.telemetry = telemetry
+        self.spans = spans
+        self._runs = {}
+
+    def _start(self, run_id, stage):
+        self._runs[run_id] = (stage, time.perf_counter())
+
+    def _end(self, run_id, error=None):
+        started = self._runs.pop(run_id, None)
+        if started is not None:
+            stage, t0 = started
+            self.telemetry.record(stage, (time.perf_counter() - t0) * 1000, error=error, spans=self.spans)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, f"tool:{name}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
@@ -2,13 +2,122 @@
 Automated tests for the LangChain Persona Agent
 """
 
+import ast
+import asyncio
+import atexit
+import io
+import json
 import os
+import shutil
+import subprocess
 import sys
-from unittest.mock import Mock, MagicMock, patch
+import tempfile
+import threading
+import time
+import types
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle
+from unittest.mock import AsyncMock, Mock, patch
 
-# Import the agent
-from project import PersonaAgent, init_milvus, persona_prompt
+import numpy as np
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import StructuredTool
+from pymilvus import MilvusClient
+
+# Keep the databases the modules open by default out of the working tree
+TEST_DATA_DIR = tempfile.mkdtemp(prefix="persona-agent-tests-")
+atexit.register(shutil.rmtree, TEST_DATA_DIR, ignore_errors=True)
+os.environ.setdefault("EMBEDDING_CACHE_PATH", os.path.join(TEST_DATA_DIR, "embedding-cache.db"))
+os.environ.setdefault("MILVUS_LITE_PATH", os.path.join(TEST_DATA_DIR, "agent-conversations.db"))
+os.environ.setdefault("NUMPY_STORE_PATH", os.path.join(TEST_DATA_DIR, "agent-conversations.npstore"))
+
+# Import the agent and its modules (they read the environment above at import time)
+import project
+from batch_search import read_queries, search_batches
+from benchmark import percentiles, run_benchmark
+from embedding_backends import build_embeddings
+from embedding_cache import CachedEmbeddings
+from history import SessionHistoryStore, SummarizingHistory
+from lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+from loadtest import StubOpenAI, run_load
+from migrate import migrate
+from numpy_store import NumpyVectorStore
+from project import (
+    PersonaAgent,
+    create_conversation_collection,
+    init_milvus,
+    is_typed_collection,
+    persona_prompt,
+)
+from response_cache import ResponseCache
+from retention import condense_session, disk_usage, llm_summarizer, run_retention
+from server import SessionPool
+from telemetry import Telemetry, TelemetryCallbackHandler, format_stats
+from tool_execution import TIMEOUT_MARKER, ConcurrentAgentExecutor, parse_tool_timeouts
+from transfer import export_collection, import_collection
+from vector_layout import RerankingClient, VectorLayout
+from vector_report import evaluate, synthetic_vectors
+from web_search import DuckDuckGoProvider, StubSearchProvider, WebSearch
+from write_behind import WriteBehindQueue
+
+
+def mock_milvus_with_rows(rows):
+    """Mock Milvus client serving stored rows through query_iterator and id-filtered query"""
+    rows = [dict(row, id=i) for i, row in enumerate(rows, 1)]
+    mock_milvus = Mock()
+
+    def query_iterator(**kwargs):
+        iterator = Mock()
+        iterator.next.side_effect = [[{"id": r["id"], "role": r["role"]} for r in rows], []]
+        return iterator
+
+    def query(**kwargs):
+        ids = set(ast.literal_eval(kwargs["filter"].split(" in ", 1)[1]))
+        return [r for r in rows if r["id"] in ids]
+
+    mock_milvus.query_iterator.side_effect = query_iterator
+    mock_milvus.query.side_effect = query
+    return mock_milvus
+
+
+class StubWeatherServer:
+    """Local stand-in for the Open-Meteo geocoding and forecast APIs"""
+
+    def __init__(self, delay=0.0):
+        self.hits = {"/v1/search": 0, "/v1/forecast": 0}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split("?", 1)[0]
+                stub.hits[path] += 1
+                time.sleep(delay)
+                if path == "/v1/search":
+                    body = {"results": [{"name": "Austin", "admin1": "Texas", "country": "United States",
+                                         "latitude": 30.26715, "longitude": -97.74306}]}
+                else:
+                    body = {"daily": {"time": ["2024-01-01", "2024-01-02", "2024-01-03"],
+                                      "temperature_2m_min": [40, 41, 42],
+                                      "temperature_2m_max": [60, 61, 62]}}
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
 
 
 class TestPersonaAgent:
@@ -115,8 +224,7 @@ class TestPersonaAgent:
         print("Test 5: Conversation Loading...", end=" ")
         
         # Create mock Milvus client with existing conversation
-        mock_milvus = Mock()
-        mock_milvus.query.return_value = [
+        mock_milvus = mock_milvus_with_rows([
             {
                 "timestamp": "2024-01-01T10:00:00",
                 "role": "system",
@@ -135,7 +243,7 @@ class TestPersonaAgent:
                 "content": "Arrr! Hello matey!",
                 "persona": "pirate"
             }
-        ]
+        ])
         
         # Initialize agent (should load conversation)
         agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
@@ -190,6 +298,1535 @@ class TestPersonaAgent:
         print("✓ PASSED")
         return True
 
+    def test_embedding_cache(self):
+        """Test that repeated texts are served from the cache tiers"""
+        print("Test 8: Embedding Cache...", end=" ")
+
+        inner = Mock()
+        inner.embed_query.side_effect = lambda text: [float(len(text)), 1.0]
+        inner.embed_documents.side_effect = lambda texts: [[float(len(t)), 2.0] for t in texts]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            cache = CachedEmbeddings(inner, "fake-model", path=path, memory_size=2)
+
+            assert cache.embed_query("Persona changed to: pirate") == [26.0, 1.0]
+            assert cache.embed_query("Persona changed to: pirate") == [26.0, 1.0]
+            assert inner.embed_query.call_count == 1
+
+            # Only uncached texts reach the backend, once each
+            vectors = cache.embed_documents(["hi", "Persona changed to: pirate", "hi"])
+            assert vectors == [[2.0, 2.0], [26.0, 1.0], [2.0, 2.0]]
+            inner.embed_documents.assert_called_once_with(["hi"])
+
+            stats = cache.stats()
+            assert stats["hits"] == 2
+            assert stats["misses"] == 3
+            cache.close()
+
+            # A fresh cache on the same file is served from disk
+            reopened = CachedEmbeddings(inner, "fake-model", path=path)
+            assert reopened.embed_query("hi") == [2.0, 2.0]
+            assert reopened.stats()["disk_hits"] == 1
+            # A different model name does not share entries
+            other = CachedEmbeddings(inner, "other-model", path=path)
+            other.embed_query("hi")
+            assert other.stats()["misses"] == 1
+
+            # The async path keeps SQLite I/O off the event loop and shares the batch logic
+            inner.aembed_documents = AsyncMock(side_effect=lambda texts: [[float(len(t)), 3.0] for t in texts])
+            with patch("embedding_cache.asyncio.to_thread", wraps=asyncio.to_thread) as to_thread:
+                vectors = asyncio.run(reopened.aembed_documents(["hi", "hey", "hey"]))
+            assert vectors == [[2.0, 2.0], [3.0, 3.0], [3.0, 3.0]]
+            inner.aembed_documents.assert_awaited_once_with(["hey"])
+            assert to_thread.call_count == 2
+            reopened.close()
+            other.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_embedding_cache_disk_eviction(self):
+        """Test that the disk tier stays within its size budget"""
+        print("Test 9: Embedding Cache Eviction...", end=" ")
+
+        inner = Mock()
+        inner.embed_query.side_effect = lambda text: [0.0] * 16
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = CachedEmbeddings(inner, "fake-model", path=os.path.join(tmp, "cache.db"), max_disk_bytes=64 * 4)
+            for i in range(10):
+                cache.embed_query(f"message {i}")
+            stats = cache.stats()
+            assert stats["disk_bytes"] <= 64 * 4
+            assert stats["evictions"] > 0
+            cache.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_write_behind_batches_inserts(self):
+        """Test that queued messages are embedded and inserted as one batch"""
+        print("Test 10: Write-Behind Batching...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        mock_embeddings = Mock()
+        mock_embeddings.embed_documents.side_effect = lambda texts: [[0.5] * 4 for _ in texts]
+
+        writer = WriteBehindQueue(mock_milvus, "test_collection", mock_embeddings, 4,
+                                  batch_size=100, flush_interval=60)
+        for content in ["Hello!", "Arrr!", "Persona changed to: pirate"]:
+            writer.submit({"session_id": "s", "role": "user", "content": content, "persona": "pirate"})
+        writer.flush(timeout=5)
+
+        mock_embeddings.embed_documents.assert_called_once_with(["Hello!", "Arrr!", "Persona changed to: pirate"])
+        assert mock_milvus.insert.call_count == 1
+        rows = mock_milvus.insert.call_args[1]["data"]
+        assert len(rows) == 3
+        assert rows[0]["vector"] == [0.5] * 4
+        writer.close(timeout=5)
+
+        print("✓ PASSED")
+        return True
+
+    def test_write_behind_agent_flush(self):
+        """Test that the agent defers saves until flush when write-behind is on"""
+        print("Test 11: Write-Behind Agent Flush...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+
+        agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session", write_behind=True)
+        agent.writer.flush_interval = 60
+        agent.save_message("user", "Hello!")
+        agent.set_persona("pirate")
+        agent.clear_conversation()
+
+        # clear_conversation flushes everything queued under the old session
+        assert mock_milvus.insert.call_count == 1
+        rows = mock_milvus.insert.call_args[1]["data"]
+        assert [r["role"] for r in rows] == ["user", "system"]
+        assert all(r["session_id"] == "test_session" for r in rows)
+        agent.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_stream_chat(self):
+        """Test that streamed replies yield tokens and are persisted at the end"""
+        print("Test 12: Streaming Chat...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Arrr hello matey")]))
+
+        with patch.object(project.runtime, "llm", fake_llm):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+            events = list(agent.stream_chat("Hello!"))
+
+        tokens = [e["content"] for e in events if e["type"] == "token"]
+        assert len(tokens) > 1
+        assert "".join(tokens) == "Arrr hello matey"
+        assert events[-1] == {"type": "done", "content": "Arrr hello matey"}
+
+        # User message saved first, assistant message saved once the stream completed
+        saved = [c[1]["data"][0] for c in mock_milvus.insert.call_args_list]
+        assert [(m["role"], m["content"]) for m in saved] == [("user", "Hello!"), ("assistant", "Arrr hello matey")]
+
+        # The done event carries the executor's final output, not just the joined tokens
+        original_return = ConcurrentAgentExecutor._areturn
+
+        async def marked_return(executor, output, intermediate_steps, run_manager=None):
+            result = await original_return(executor, output, intermediate_steps, run_manager)
+            return dict(result, output=result["output"] + " (final)")
+
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Ahoy")]))
+        with patch.object(project.runtime, "llm", fake_llm), \
+                patch.object(ConcurrentAgentExecutor, "_areturn", marked_return):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="other_session")
+            events = list(agent.stream_chat("Hello again!"))
+        assert "".join(e["content"] for e in events if e["type"] == "token") == "Ahoy"
+        assert events[-1] == {"type": "done", "content": "Ahoy (final)"}
+
+        print("✓ PASSED")
+        return True
+
+    def test_stream_chat_with_fold(self):
+        """Test that a summarizer fold during a streamed turn stays out of the reply"""
+        print("Test 41: Streaming With Summary Fold...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.return_value = [0.1] * 4
+        fake_embeddings.aembed_query = AsyncMock(return_value=[0.1] * 4)
+        # Replies for two turns, then the summarizer's output for the fold after turn 2
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content=text) for text in
+                                                       ("reply1 words", "reply2 words", "summary words")]))
+
+        with patch.object(project.runtime, "llm", fake_llm), \
+                patch.object(project.runtime, "embeddings", fake_embeddings), \
+                patch.object(project, "HISTORY_MAX_TOKENS", 5):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+            list(agent.stream_chat("Hello!"))
+            events = list(agent.stream_chat("And then?"))
+            history = agent.get_session_history()
+
+        tokens = [e["content"] for e in events if e["type"] == "token"]
+        assert "".join(tokens) == "reply2 words"
+        assert events[-1] == {"type": "done", "content": "reply2 words"}
+        # The fold did run, and its text went to the summary row only
+        assert history.summary == "summary words"
+        saved = [c[1]["data"][0] for c in mock_milvus.insert.call_args_list]
+        assert [m["content"] for m in saved if m["role"] == "assistant"] == ["reply1 words", "reply2 words"]
+        assert [m["content"] for m in saved if m["role"] == "summary"] == ["summary words"]
+
+        print("✓ PASSED")
+        return True
+
+    def test_achat(self):
+        """Test the async chat path saves both sides of the turn"""
+        print("Test 13: Async Chat...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Ahoy!")]))
+
+        with patch.object(project.runtime, "llm", fake_llm):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+            response = asyncio.run(agent.achat("Hello!"))
+
+        assert response == "Ahoy!"
+        saved = [c[1]["data"][0] for c in mock_milvus.insert.call_args_list]
+        assert [(m["role"], m["content"]) for m in saved] == [("user", "Hello!"), ("assistant", "Ahoy!")]
+
+        print("✓ PASSED")
+        return True
+
+    def test_session_pool_ordering(self):
+        """Test that concurrent turns are serialized per session and isolated across sessions"""
+        print("Test 14: Session Pool Ordering...", end=" ")
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content=f"reply {i}") for i in range(6)]))
+
+        async def run():
+            pool = SessionPool(mock_milvus, "test_collection", max_concurrency=2, write_behind=False)
+            turns = [pool.chat(session, f"{session}-{i}") for i in range(3) for session in ("a", "b")]
+            results = await asyncio.gather(*turns)
+            pool.close()
+            return pool, results
+
+        with patch.object(project.runtime, "llm", fake_llm):
+            pool, results = asyncio.run(run())
+
+        assert all(response is not None for _, response in results)
+        saved = [c[1]["data"][0] for c in mock_milvus.insert.call_args_list]
+        for session in ("a", "b"):
+            rows = [m for m in saved if m["session_id"] == session]
+            user_turns = [m["content"] for m in rows if m["role"] == "user"]
+            assert user_turns == [f"{session}-0", f"{session}-1", f"{session}-2"]
+            # Each user message is followed by its own reply before the next turn starts
+            assert [m["role"] for m in rows] == ["user", "assistant"] * 3
+
+        print("✓ PASSED")
+        return True
+
+    def test_summarizing_history_budget(self):
+        """Test that old turns fold into a summary and the window stays bounded"""
+        print("Test 15: Summarizing History...", end=" ")
+
+        saved = []
+        history = SummarizingHistory(
+            summarizer=lambda summary, messages: f"{summary}+{len(messages)}",
+            on_summary=lambda summary, covered: saved.append((summary, covered)),
+            max_tokens=10_000,
+            keep_turns=2,
+        )
+        for i in range(10):
+            history.add_user_message(f"question {i}")
+            history.add_ai_message(f"answer {i}")
+
+        messages = history.messages
+        # Summary message + the last two turns verbatim
+        assert len(messages) == 5
+        assert "Summary" in messages[0].content
+        assert messages[-1].content == "answer 9"
+        assert saved[-1][1] == 16
+        assert history.covered == 16
+
+        # A tight token budget folds even recent turns, keeping at least one
+        tight = SummarizingHistory(summarizer=lambda summary, messages: "s", max_tokens=30, keep_turns=10)
+        for i in range(5):
+            tight.add_user_message("x" * 200)
+            tight.add_ai_message("y" * 200)
+        assert len(tight.recent) == 2
+
+        print("✓ PASSED")
+        return True
+
+    def test_resume_with_summary(self):
+        """Test that resuming skips messages already covered by the stored summary"""
+        print("Test 16: Resume With Summary...", end=" ")
+
+        mock_milvus = mock_milvus_with_rows([
+            {"timestamp": "2024-01-01T10:00:00", "role": "user", "content": "old q", "persona": "neutral"},
+            {"timestamp": "2024-01-01T10:00:01", "role": "assistant", "content": "old a", "persona": "neutral"},
+            {"timestamp": "2024-01-01T10:00:02", "role": "user", "content": "new q", "persona": "neutral"},
+            {"timestamp": "2024-01-01T10:00:03", "role": "assistant", "content": "new a", "persona": "neutral"},
+            {"timestamp": "2024-01-01T10:00:04", "role": "summary", "content": "They talked about old things.",
+             "persona": "neutral", "covered_messages": 2},
+        ])
+
+        with patch("project.HISTORY_STRATEGY", "summary"):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+        contents = [m.content for m in agent.get_session_history().messages]
+        assert "old q" not in contents
+        assert contents[-2:] == ["new q", "new a"]
+        assert "They talked about old things." in contents[0]
+
+        # A long session: resuming (twice) never folds, and counts the skipped gap as covered
+        rows = []
+        for i in range(100):
+            rows.append({"role": "user", "content": f"q{i}", "persona": "neutral"})
+            rows.append({"role": "assistant", "content": f"a{i}", "persona": "neutral"})
+        rows.append({"role": "summary", "content": "Early turns.", "persona": "neutral", "covered_messages": 38})
+        long_milvus = mock_milvus_with_rows(rows)
+        with patch("project.HISTORY_STRATEGY", "summary"), patch("project.RESUME_WINDOW", 50), \
+                patch("project.summarize_messages", side_effect=lambda llm, summary, messages:
+                      f"{summary} +{messages[0].content}..{messages[-1].content}") as summarize:
+            for _ in range(2):
+                agent = PersonaAgent(long_milvus, "test_collection", session_id="long")
+                history = agent.get_session_history()
+                assert history.covered == 150 and history.summary == "Early turns."
+                assert [m.content for m in history.recent[:2]] == ["q75", "a75"] and len(history.recent) == 50
+                assert not summarize.called and not long_milvus.insert.called
+
+            # The next fold starts at the window, counting on from the gap
+            history.add_message(HumanMessage(content="q100"))
+            assert summarize.call_count == 1 and history.summary == "Early turns. +q75..q94"
+            assert history.covered == 150 + 39
+            assert long_milvus.insert.call_args.kwargs["data"][0]["covered_messages"] == 189
+
+        print("✓ PASSED")
+        return True
+
+    def test_resume_window_and_older_pages(self):
+        """Test that resume fetches only the recent window and pages older messages lazily"""
+        print("Test 17: Paged Resume...", end=" ")
+
+        rows = []
+        for i in range(5):
+            rows.append({"role": "user", "content": f"q{i}", "persona": "neutral"})
+            rows.append({"role": "assistant", "content": f"a{i}", "persona": "neutral"})
+        mock_milvus = mock_milvus_with_rows(rows)
+
+        with patch("project.RESUME_WINDOW", 4), patch("project.HISTORY_STRATEGY", "full"):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+
+            contents = [m.content for m in agent.get_session_history().messages]
+            assert contents == ["q3", "a3", "q4", "a4"]
+            # Only the window's rows were fetched with content
+            fetched = mock_milvus.query.call_args_list[-1][1]
+            assert ast.literal_eval(fetched["filter"].split(" in ", 1)[1]) == [7, 8, 9, 10]
+
+            older = agent.load_older_messages(4)
+            assert [r["content"] for r in older] == ["q1", "a1", "q2", "a2"]
+            assert [r["content"] for r in agent.load_older_messages()] == ["q0", "a0"]
+            assert agent.load_older_messages() == []
+
+        print("✓ PASSED")
+        return True
+
+    def test_history_store_eviction(self):
+        """Test that the history store evicts LRU sessions and rehydrates them on access"""
+        print("Test 18: History Store Eviction...", end=" ")
+
+        loaded = []
+
+        def loader(session_id, history):
+            loaded.append(session_id)
+            history.add_user_message(f"hello from {session_id}")
+
+        store = SessionHistoryStore(factory=lambda session_id: SummarizingHistory(), loader=loader,
+                                    max_sessions=2, max_messages=100)
+        store.get("a")
+        store.get("b")
+        store.get("a")  # "a" is now most recently used
+        store.get("c")  # evicts "b"
+        assert "b" not in store and "a" in store and "c" in store
+        assert store.evictions == 1
+
+        # Touching "b" again rebuilds it through the loader
+        assert store.get("b").messages[0].content == "hello from b"
+        assert loaded == ["a", "b", "c", "b"]
+
+        # The message cap evicts too, but never the session in use
+        small = SessionHistoryStore(factory=lambda session_id: SummarizingHistory(), max_sessions=10, max_messages=3)
+        for session_id in ("x", "y"):
+            for i in range(2):
+                small.get(session_id).add_user_message(f"{session_id}{i}")
+            small.get(session_id)
+        assert "x" not in small and "y" in small
+
+        print("✓ PASSED")
+        return True
+
+    def test_agent_rehydrates_evicted_session(self):
+        """Test that an agent reloads an evicted session from Milvus when it is touched again"""
+        print("Test 19: Session Rehydration...", end=" ")
+
+        mock_milvus = mock_milvus_with_rows([
+            {"role": "user", "content": "Hello!", "persona": "neutral"},
+            {"role": "assistant", "content": "Hi there!", "persona": "neutral"},
+        ])
+
+        with patch("project.HISTORY_MAX_SESSIONS", 1):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="old_session")
+            old_session_id = agent.session_id
+            agent.clear_conversation()
+            agent.get_session_history()
+
+            assert old_session_id not in agent.history_store
+            messages = agent.get_session_history(old_session_id).messages
+            assert [m.content for m in messages] == ["Hello!", "Hi there!"]
+
+        print("✓ PASSED")
+        return True
+
+    def test_typed_collection_migration(self):
+        """Test that a legacy dynamic-field collection migrates to the typed layout in order"""
+        print("Test 20: Typed Collection Migration...", end=" ")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            client = MilvusClient(uri=os.path.join(tmp, "migrate.db"))
+            client.create_collection(collection_name="legacy", dimension=4, auto_id=True, enable_dynamic_field=True)
+            client.insert(collection_name="legacy", data=[
+                {"vector": [0.1] * 4, "timestamp": "2024-01-01T10:00:00", "session_id": "s", "role": "user",
+                 "content": "Hello!", "persona": "pirate"},
+                {"vector": [0.2] * 4, "timestamp": "2024-01-01T10:00:01", "session_id": "s", "role": "assistant",
+                 "content": "Arrr!", "persona": "pirate"},
+                {"vector": [0.3] * 4, "timestamp": "2024-01-01T10:00:02", "session_id": "s", "role": "summary",
+                 "content": "Greetings.", "persona": "pirate", "covered_messages": 2},
+            ])
+            assert not is_typed_collection(client, "legacy")
+
+            copied = migrate(client, "legacy", batch_size=2, dim=4)
+            assert copied == 3
+            assert is_typed_collection(client, "legacy")
+            assert client.has_collection("legacy_legacy")
+
+            rows = client.query(collection_name="legacy", filter='session_id == "s"', output_fields=["*"])
+            rows = sorted(rows, key=lambda r: r["id"])
+            assert [r["content"] for r in rows] == ["Hello!", "Arrr!", "Greetings."]
+            assert rows[0]["timestamp"] == int(datetime(2024, 1, 1, 10, 0, 0).timestamp() * 1000)
+            assert rows[2]["covered_messages"] == 2
+
+            # A freshly created collection is already typed
+            create_conversation_collection(client, "fresh", dim=4)
+            assert is_typed_collection(client, "fresh")
+            assert migrate(client, "fresh", dim=4) == 0
+            client.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_weather_caching(self):
+        """Test that geocode and forecast lookups are cached and coalesced"""
+        print("Test 21: Weather Caching...", end=" ")
+
+        stub = StubWeatherServer(delay=0.2)
+        project.geocode_cache.clear()
+        project.forecast_cache.clear()
+        try:
+            with patch("project.WEATHER_GEOCODE_URL", stub.url + "/v1/search"), \
+                 patch("project.WEATHER_FORECAST_URL", stub.url + "/v1/forecast"):
+                # Concurrent requests for the same city share one call per API
+                results = []
+                threads = [threading.Thread(target=lambda: results.append(project.get_weather("Austin")))
+                           for _ in range(5)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                assert len(results) == 5
+                assert all("Austin, Texas, United States" in r and "40°F - 60°F" in r for r in results)
+                assert stub.hits == {"/v1/search": 1, "/v1/forecast": 1}
+
+                # Later lookups with a differently formatted name are served from cache
+                project.get_weather("  AUSTIN ")
+                assert stub.hits == {"/v1/search": 1, "/v1/forecast": 1}
+        finally:
+            stub.close()
+            project.geocode_cache.clear()
+            project.forecast_cache.clear()
+
+        print("✓ PASSED")
+        return True
+
+    def test_web_search_cache_and_retries(self):
+        """Test search caching by normalized query, retries and the overall deadline"""
+        print("Test 22: Web Search Cache and Retries...", end=" ")
+
+        provider = StubSearchProvider()
+        search = WebSearch(provider, base_delay=0.01)
+        first = search.search("Austin  weather")
+        assert first.startswith("- Result 1 for Austin  weather")
+        assert search.search("austin weather") == first
+        assert provider.calls == 1
+
+        # Transient failures are retried with backoff
+        flaky = WebSearch(StubSearchProvider(failures=2), base_delay=0.01)
+        assert flaky.search("python").startswith("- Result 1")
+        assert flaky.provider.calls == 3
+
+        # A persistent outage gives up at the deadline instead of stalling the turn
+        down = WebSearch(StubSearchProvider(failures=100, latency=0.05), attempts=10, base_delay=1.0, deadline=0.3)
+        started = time.monotonic()
+        assert down.search("python").startswith("(search unavailable")
+        assert time.monotonic() - started < 1.0
+        # Failures are not cached
+        assert down.cache.stats()["entries"] == 0
+
+        # The DuckDuckGo provider honours each call's timeout, rounded down to a 0.5s step
+        class FakeDDGS:
+            made = []
+
+            def __init__(self, timeout):
+                self.timeout = timeout
+                self.failed = False
+                FakeDDGS.made.append(timeout)
+
+            def text(self, query, max_results):
+                if self.failed or query == "boom":
+                    self.failed = True
+                    raise RuntimeError("Exception occurred in previous call.")
+                return [{"title": query, "href": str(self.timeout)}]
+
+        ddg = DuckDuckGoProvider(ddgs_class=FakeDDGS)
+        assert ddg.search("a", timeout=0.7)[0]["href"] == "0.5"
+        assert ddg.search("b", timeout=0.9)[0]["href"] == "0.5"       # same step: client reused
+        assert ddg.search("c", timeout=0.2)[0]["href"] == "0.5"       # never below one step
+        assert ddg.search("d", timeout=7.99)[0]["href"] == "7.5" and ddg.search("e")[0]["href"] == "10.0"
+        assert FakeDDGS.made == [0.5, 7.5, 10]
+        # A client that failed is replaced rather than reused
+        try:
+            ddg.search("boom", timeout=0.6)
+        except RuntimeError:
+            pass
+        assert ddg.search("f", timeout=0.6)[0]["title"] == "f" and FakeDDGS.made == [0.5, 7.5, 10, 0.5]
+
+        print("✓ PASSED")
+        return True
+
+    def test_web_search_single_flight(self):
+        """Test that identical in-flight queries share one provider call"""
+        print("Test 23: Web Search Single-Flight...", end=" ")
+
+        provider = StubSearchProvider(latency=0.1)
+        search = WebSearch(provider)
+
+        async def run():
+            return await asyncio.gather(*[search.asearch("Tell me a joke") for _ in range(5)])
+
+        results = asyncio.run(run())
+        assert len(set(results)) == 1
+        assert provider.calls == 1
+
+        # Threads calling the sync path coalesce as well
+        provider = StubSearchProvider(latency=0.1)
+        search = WebSearch(provider)
+        threads = [threading.Thread(target=search.search, args=("weather austin",)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert provider.calls == 1
+
+        print("✓ PASSED")
+        return True
+
+    def test_local_embedding_backend(self):
+        """Test the local SentenceTransformer backend with a stand-in model"""
+        print("Test 24: Local Embedding Backend...", end=" ")
+
+        encode_calls = []
+
+        class FakeSentenceTransformer:
+            def __init__(self, model_name, device=None):
+                self.model_name = model_name
+                self.device = device
+
+            def get_sentence_embedding_dimension(self):
+                return 3
+
+            def encode(self, texts, batch_size=32, **kwargs):
+                encode_calls.append((list(texts), batch_size))
+                return np.array([[float(len(t)), 0.0, 1.0] for t in texts])
+
+        fake_module = types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer)
+        with patch.dict(sys.modules, {"sentence_transformers": fake_module}):
+            backend, model_name, dim = build_embeddings("local", model="tiny-model", batch_size=8)
+
+        assert model_name == "local:tiny-model"
+        assert dim == 3
+        assert backend.model.device == "cpu"
+        # Warmed up once at construction
+        assert len(encode_calls) == 1
+
+        vectors = backend.embed_documents(["a", "bb", "ccc"])
+        assert vectors == [[1.0, 0.0, 1.0], [2.0, 0.0, 1.0], [3.0, 0.0, 1.0]]
+        assert encode_calls[-1] == (["a", "bb", "ccc"], 8)
+        assert backend.embed_query("dddd") == [4.0, 0.0, 1.0]
+
+        _, openai_model, openai_dim = build_embeddings("openai")
+        assert (openai_model, openai_dim) == ("text-embedding-3-small", 1536)
+
+        print("✓ PASSED")
+        return True
+
+    def test_numpy_vector_store(self):
+        """Test the in-process NumPy store as a drop-in for Milvus"""
+        print("Test 25: NumPy Vector Store...", end=" ")
+
+        topics = {"ships": [1.0, 0.0, 0.0, 0.0], "weather": [0.0, 1.0, 0.0, 0.0], "food": [0.0, 0.0, 1.0, 0.0]}
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.side_effect = lambda text: next(
+            (v for k, v in topics.items() if k in text), [0.0, 0.0, 0.0, 1.0])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "conv", dim=4)
+            assert is_typed_collection(store, "conv")
+
+            with patch.object(project.runtime, "embeddings", fake_embeddings):
+                agent = PersonaAgent(store, "conv", session_id="s1")
+                agent.save_message("user", "Tell me about ships")
+                agent.save_message("assistant", "Those ships float on water", persona="pirate")
+                agent.save_message("user", "What about the weather?")
+                other = PersonaAgent(store, "conv", session_id="s2")
+                other.save_message("user", "I like ships too")
+
+                hits = agent.semantic_search("ships", top_k=2, mode="vector")
+                assert {h["content"] for h in hits} == {"Tell me about ships", "Those ships float on water"}
+                assert all(h["score"] > 0.99 for h in hits)
+                assert agent.semantic_search("weather", top_k=1, mode="vector")[0]["content"] == "What about the weather?"
+                assert len(agent.semantic_search("ships", top_k=10, mode="vector")) == 3
+                assert len(agent.semantic_search("ships", top_k=10, current_session_only=False, mode="vector")) == 4
+
+            # Growth past the initial capacity, persistence across reopen, deletes by filter
+            store.insert("conv", [{"vector": [0.5, 0.5, 0.0, 0.0], "session_id": "bulk", "role": "user",
+                                   "content": f"bulk {i}", "timestamp": i, "persona": ""} for i in range(1500)])
+            store.close()
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            resumed = PersonaAgent(store, "conv", session_id="s1")
+            resumed.load_conversation()
+            assert [m.content for m in resumed.get_session_history().messages] == [
+                "Tell me about ships", "Those ships float on water", "What about the weather?"]
+            assert store.delete("conv", filter='session_id == "bulk" and timestamp >= 1000') == 500
+            assert len(store.query("conv", filter='session_id == "bulk"', output_fields=["id"])) == 1000
+            store.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_hybrid_search(self):
+        """Test BM25 lexical search, its backfill from storage, and hybrid fusion"""
+        print("Test 26: Hybrid Search...", end=" ")
+
+        assert tokenize("Error ERR_CONN_42 at foo.bar()") == ["error", "err_conn_42", "at", "foo.bar", "foo", "bar"]
+        assert reciprocal_rank_fusion([["a", "b"], ["b", "c"]])[0][0] == "b"
+
+        # Every message embeds to the same vector, so only the lexical ranking can tell them apart
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.return_value = [1.0, 0.0, 0.0, 0.0]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "conv", dim=4)
+            # Rows written by an earlier run are picked up by the first search
+            store.insert("conv", [
+                {"vector": [1.0, 0.0, 0.0, 0.0], "session_id": "old", "timestamp": 1, "role": "user",
+                 "content": "The build fails with ERR_CONN_42 on deploy", "persona": "neutral"},
+                {"vector": [1.0, 0.0, 0.0, 0.0], "session_id": "old", "timestamp": 2, "role": "summary",
+                 "content": "User hit ERR_CONN_42", "persona": "neutral"},
+            ])
+
+            with patch.object(project.runtime, "embeddings", fake_embeddings):
+                agent = PersonaAgent(store, "conv", session_id="new", lexical_index=LexicalIndex())
+                agent.save_message("user", "What's the weather in Reykjavik?")
+                agent.save_message("assistant", "Cold and windy in Reykjavik today.")
+                agent.save_message("user", "Tell me a joke")
+                fake_embeddings.embed_query.reset_mock()
+
+                # Lexical fast path: exact identifiers match, and no embedding call is made
+                hits = agent.semantic_search("err_conn_42", current_session_only=False, mode="lexical")
+                assert [h["content"] for h in hits] == ["The build fails with ERR_CONN_42 on deploy"]
+                assert agent.semantic_search("err_conn_42", mode="lexical") == []
+                fake_embeddings.embed_query.assert_not_called()
+                assert agent.lexical.stats()["documents"] == 4
+
+                # Hybrid: lexical matches are lifted above vector-only ties
+                hits = agent.semantic_search("reykjavik weather", top_k=3, mode="hybrid")
+                assert hits[0]["content"] == "What's the weather in Reykjavik?"
+                assert hits[1]["content"] == "Cold and windy in Reykjavik today."
+                assert hits[2]["content"] == "Tell me a joke"
+                assert hits[0]["score"] > hits[2]["score"]
+                assert fake_embeddings.embed_query.call_count == 1
+
+                # Rows deleted by retention leave the index as well
+                terms = agent.lexical.stats()["terms"]
+                condense_session(store, "conv", "old", lambda summary, messages: "Build issue on deploy",
+                                 fake_embeddings.embed_query, lexical_index=agent.lexical)
+                assert agent.semantic_search("err_conn_42", current_session_only=False, mode="lexical") == []
+                assert agent.lexical.stats()["documents"] == 3
+                assert agent.lexical.stats()["terms"] < terms
+                assert agent.lexical.remove([("old", 1, "user", "never indexed")]) == 0
+            store.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_long_term_memory(self):
+        """Test that chat recalls other sessions within the budget and reuses the user embedding"""
+        print("Test 27: Long-Term Memory...", end=" ")
+
+        topics = {"sailboat": [1.0, 0.0, 0.0, 0.0], "pasta": [0.0, 1.0, 0.0, 0.0]}
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.side_effect = lambda text: next(
+            (v for k, v in topics.items() if k in text.lower()), [0.0, 0.0, 1.0, 0.0])
+        fake_embeddings.aembed_query = AsyncMock(side_effect=fake_embeddings.embed_query.side_effect)
+
+        captured = []
+        original_input = PersonaAgent._agent_input
+
+        def spy_input(agent, user_input, memory=""):
+            captured.append(original_input(agent, user_input, memory))
+            return captured[-1]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "conv", dim=4)
+            store.insert("conv", [
+                {"vector": topics["sailboat"], "session_id": "last_week", "timestamp": 1704103200000,
+                 "role": "user", "content": "My sailboat is called Wanderer", "persona": "neutral"},
+                {"vector": topics["pasta"], "session_id": "last_week", "timestamp": 1704103201000,
+                 "role": "user", "content": "I love pasta", "persona": "neutral"},
+                {"vector": topics["sailboat"], "session_id": "last_week", "timestamp": 1704103202000,
+                 "role": "summary", "content": "Talked about the sailboat", "persona": "neutral"},
+            ])
+
+            fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Wanderer!"), AIMessage(content="Hi")]))
+            with patch.object(project.runtime, "embeddings", fake_embeddings), patch.object(project.runtime, "llm", fake_llm), \
+                 patch("project.LONG_TERM_MEMORY", True), patch.object(PersonaAgent, "_agent_input", spy_input):
+                agent = PersonaAgent(store, "conv", session_id="today")
+                assert agent.chat("What was my sailboat called?") == "Wanderer!"
+
+                memory = captured[-1]["system_prompt"]
+                assert "earlier conversations" in memory
+                assert "[2024-01-01] user: My sailboat is called Wanderer" in memory
+                # Unrelated and summary rows are left out
+                assert "pasta" not in memory and "Talked about" not in memory
+                # One embedding for the user message (shared by recall and save), one for the reply
+                assert [c[0][0] for c in fake_embeddings.embed_query.call_args_list] == [
+                    "What was my sailboat called?", "Wanderer!"]
+
+                # The current session is never recalled into itself
+                assert agent._recall("sailboat")[1].count("Wanderer") == 1
+
+                # A slow embedding is abandoned at the budget and the turn goes ahead without memory
+                fake_embeddings.embed_query.side_effect = lambda text: time.sleep(0.5) or topics["sailboat"]
+                with patch("project.MEMORY_BUDGET_MS", 50):
+                    started = time.monotonic()
+                    vector, memory = agent._recall("sailboat again")
+                    assert (vector, memory) == (None, "")
+                    assert time.monotonic() - started < 0.3
+            store.close()
+
+        print("✓ PASSED")
+        return True
+
+    def test_benchmark_harness(self):
+        """Test that the offline benchmark runs end to end and reports every stage"""
+        print("Test 28: Benchmark Harness...", end=" ")
+
+        stats = percentiles([1.0, 2.0, 3.0, 4.0])
+        assert stats["count"] == 4 and stats["p50_ms"] == 2.5 and stats["throughput_per_s"] == 400.0
+
+        original_embeddings = project.runtime.__dict__.get("embeddings")
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "bench"))
+            results = run_benchmark(store, "bench", sizes=[300, 150], sessions=10, dim=8, samples=4)
+            store.close()
+
+        assert [r["size"] for r in results if r["stage"] == "seed"] == [150, 300]
+        stages = {r["stage"] for r in results if r["size"] == 300} - {"summarize"}
+        assert stages == {"seed", "resume", "save", "lexical_backfill", "search_vector_session",
+                          "search_vector_all", "search_lexical_session", "search_hybrid_session", "chat"}
+        # Resume restores the recent window without folding older history into the summary
+        assert all(r["folds"] == 0 for r in results if r["stage"] == "resume")
+        assert all(r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"] for r in results)
+        assert json.loads(json.dumps(results)) == results
+        # The fakes are swapped back out afterwards
+        assert project.runtime.__dict__.get("embeddings") is original_embeddings
+
+        print("✓ PASSED")
+        return True
+
+    def test_stage_telemetry(self):
+        """Test per-stage spans for a turn, error counting, tool callbacks and the dump formats"""
+        print("Test 29: Stage Telemetry...", end=" ")
+
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.return_value = [0.1] * 4
+        mock_milvus = mock_milvus_with_rows([])
+        # The assistant message insert fails; the turn still completes but the error is counted
+        mock_milvus.insert.side_effect = [None, ConnectionError("milvus down")]
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Ahoy!")]))
+
+        project.telemetry.reset()
+        with patch.object(project.runtime, "embeddings", fake_embeddings), patch.object(project.runtime, "llm", fake_llm):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="test_session")
+            assert agent.chat("Hello!") == "Ahoy!"
+
+        stages = [span["stage"] for span in agent.last_turn]
+        assert stages == ["embed", "milvus.insert", "llm", "embed", "milvus.insert", "turn"]
+        assert agent.last_turn[4]["error"] and not agent.last_turn[5]["error"]
+        summary = project.telemetry.summary()
+        assert summary["milvus.insert"]["count"] == 2 and summary["milvus.insert"]["errors"] == 1
+        assert summary["milvus.insert"]["last_error"] == "ConnectionError: milvus down"
+        assert summary["turn"]["p50_ms"] >= summary["llm"]["p50_ms"]
+        assert "Last turn: embed" in format_stats(summary, agent.last_turn)
+
+        # Tool calls are timed through the callback handler
+        stats = Telemetry(window=2)
+        spans = []
+        tool = StructuredTool.from_function(func=lambda city: f"Sunny in {city}", name="get_weather",
+                                            description="weather")
+        for _ in range(3):
+            tool.invoke({"city": "Austin"}, config={"callbacks": [TelemetryCallbackHandler(stats, spans)]})
+        failing = StructuredTool.from_function(func=lambda q: 1 / 0, name="web_search", description="search")
+        try:
+            failing.invoke({"q": "x"}, config={"callbacks": [TelemetryCallbackHandler(stats, spans)]})
+        except ZeroDivisionError:
+            pass
+        summary = stats.summary()
+        assert summary["tool:get_weather"]["count"] == 3
+        assert len(stats._stages["tool:get_weather"].samples) == 2  # rolling window
+        assert summary["tool:web_search"]["errors"] == 1
+        assert [s["stage"] for s in spans] == ["tool:get_weather"] * 3 + ["tool:web_search"]
+
+        prom = stats.to_prometheus()
+        assert '# TYPE persona_agent_stage_latency_ms summary' in prom
+        assert 'persona_agent_stage_latency_ms_count{stage="tool:get_weather"} 3' in prom
+        assert 'persona_agent_stage_errors_total{stage="tool:web_search"} 1' in prom
+
+        with tempfile.TemporaryDirectory() as tmp:
+            stats.dump(os.path.join(tmp, "stats.json"), spans)
+            with open(os.path.join(tmp, "stats.json")) as f:
+                dumped = json.load(f)
+            assert dumped["stages"]["tool:web_search"]["errors"] == 1 and len(dumped["last_turn"]) == 4
+            stats.dump(os.path.join(tmp, "stats.prom"))
+            with open(os.path.join(tmp, "stats.prom")) as f:
+                assert f.read() == prom
+
+        print("✓ PASSED")
+        return True
+
+    def test_lazy_import(self):
+        """Test that importing project is cheap and the shared clients are built once, on first use"""
+        print("Test 30: Lazy Import...", end=" ")
+
+        heavy = ["pymilvus", "langchain_openai", "langchain.agents", "langchain_community", "duckduckgo_search", "openai"]
+        code = (
+            "import json, os, sys, time\n"
+            "started = time.perf_counter()\n"
+            "import project\n"
+            "elapsed = (time.perf_counter() - started) * 1000\n"
+            "assert project.persona_prompt('pirate').startswith('Talk like a pirate')\n"
+            f"loaded = [m for m in {heavy!r} if m in sys.modules]\n"
+            "print(json.dumps({'ms': elapsed, 'loaded': loaded, 'files': os.listdir('.')}))\n"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(project.__file__)))
+            result = subprocess.run([sys.executable, "-c", code], cwd=tmp, env=env,
+                                    capture_output=True, text=True, timeout=120)
+        assert result.returncode == 0, result.stderr
+        cold = json.loads(result.stdout.strip().splitlines()[-1])
+        # Nothing heavy is imported and no database or cache file is opened
+        assert cold["loaded"] == [] and cold["files"] == []
+
+        # Built once even when first used from several threads; assignment replaces the value
+        runtime = project.Runtime()
+        sessions = []
+        threads = [threading.Thread(target=lambda: sessions.append(runtime.http_session)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len({id(s) for s in sessions}) == 1 and runtime.built("http_session")
+        assert not runtime.built("llm")
+        runtime.llm = "fake"
+        assert runtime.llm == "fake"
+
+        project.telemetry.reset()
+        runtime.warm_up(("http_session", "web_search"))
+        assert list(project.telemetry.summary()) == ["startup.web_search"]
+        # Old module-level names still resolve through the shared runtime
+        assert project.EMBEDDING_DIM == project.runtime.embedding_dim
+        print(f"({cold['ms']:.0f} ms)", end=" ")
+
+        print("✓ PASSED")
+        return True
+
+    def test_compact_vector_layouts(self):
+        """Test reduced/int8/binary layouts with full-precision re-rank, per collection, and the recall report"""
+        print("Test 31: Compact Vector Layouts...", end=" ")
+
+        rng = np.random.default_rng(0)
+        vectors = synthetic_vectors(400, 32, clusters=8)
+        queries = vectors[:10] + 0.05 * rng.standard_normal((10, 32)).astype(np.float32)
+        rows = [{"vector": v.tolist(), "session_id": "s1", "timestamp": i, "role": "user",
+                 "persona": "neutral", "content": f"message {i}"} for i, v in enumerate(vectors)]
+
+        layout = VectorLayout.parse("reduced:8", 32, rerank=True)
+        assert layout.rerank and layout.to_properties()["vector_layout"] == "reduced:8"
+        assert VectorLayout.from_properties(layout.to_properties(), 8).rerank
+        assert VectorLayout.from_properties(layout.to_properties(), 8).full_dim == 32
+        assert VectorLayout.from_properties({}, 32).kind == "full"
+        # Re-rank is opt-in: it stores the full vector as well, more than the full layout alone
+        assert not VectorLayout.parse("reduced:8", 32).rerank
+        assert VectorLayout.parse("binary", 32, rerank=True).bytes_per_vector() == 4 + 32 * 4
+        assert VectorLayout.parse("int8", 32).bytes_per_vector() == 32
+        for spec in ("reduced", "reduced:64", "pq"):
+            try:
+                VectorLayout.parse(spec, 32)
+                assert False, spec
+            except ValueError:
+                pass
+
+        def top_contents(client, name):
+            hits = client.search(collection_name=name, data=queries.tolist(), limit=3,
+                                 filter='session_id == "s1"', output_fields=["content"])
+            return [[h["entity"]["content"] for h in q_hits] for q_hits in hits], hits
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"), rerank_candidates=8)
+            create_conversation_collection(store, "exact", dim=32, layout="full")
+            store.insert("exact", rows)
+            expected, exact_hits = top_contents(store, "exact")
+            for spec in ("reduced:8", "int8", "binary"):
+                name = spec.replace(":", "_")
+                create_conversation_collection(store, name, dim=32, layout=project.vector_layout(32, spec, rerank=True))
+                store.insert(name, rows)
+                found, hits = top_contents(store, name)
+                # Re-ranked candidates come back with exact scores
+                assert [f[0] for f in found] == [e[0] for e in expected], spec
+                assert abs(hits[0][0]["distance"] - exact_hits[0][0]["distance"]) < 1e-5
+            # Codes are stored compactly next to the full vectors; the layout survives a reopen
+            store.close()
+            assert np.load(os.path.join(tmp, "store", "binary", "vectors.npy"), mmap_mode="r").shape[1] == 4
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            assert project.collection_layout(store, "int8").spec == "int8"
+            assert project.collection_dim(store, "reduced_8") == 32
+            assert len(store.query("int8", filter="timestamp == 5", output_fields=["vector"])[0]["vector"]) == 32
+            # Without re-rank only the codes are stored
+            create_conversation_collection(store, "int8_only", dim=32, layout="int8")
+            store.insert("int8_only", rows)
+            assert not os.path.exists(os.path.join(tmp, "store", "int8_only", "full.npy"))
+            assert top_contents(store, "int8_only")[0][0]
+            store.close()
+
+            # Milvus Lite keeps the reduced vector indexed and the full one for re-rank
+            client = RerankingClient(MilvusClient(os.path.join(tmp, "milvus.db")), rerank_candidates=8)
+            create_conversation_collection(client, "reduced", dim=32,
+                                           layout=project.vector_layout(32, "reduced:8", rerank=True))
+            client.insert(collection_name="reduced", data=rows)
+            fields = {f["name"]: f["params"].get("dim") for f in client.describe_collection("reduced")["fields"]}
+            assert fields["vector"] == 8 and fields["full_vector"] == 32
+            assert [f[0] for f in top_contents(client, "reduced")[0]] == [e[0] for e in expected]
+            row = client.query(collection_name="reduced", filter="timestamp == 5", output_fields=["vector"])[0]
+            assert len(row["vector"]) == 32 and "full_vector" not in row
+            create_conversation_collection(client, "reduced_only", dim=32, layout="reduced:8")
+            assert "full_vector" not in [f["name"] for f in client.describe_collection("reduced_only")["fields"]]
+            try:
+                create_conversation_collection(client, "int8", dim=32, layout="int8")
+                assert False, "Milvus Lite can't store int8 codes"
+            except ValueError:
+                pass
+            client.close()
+
+        # The report: exact layout is perfect, re-ranking recovers recall lost to compression
+        results = evaluate(vectors[10:], vectors[:10], ["full", "reduced:8", "binary"], k=5, candidates=(8,))
+        by_key = {(r["layout"], r["rerank_candidates"]): r for r in results}
+        assert by_key[("full", None)]["recall@5"] == 1.0
+        assert by_key[("reduced:8", 8)]["recall@5"] >= by_key[("reduced:8", None)]["recall@5"]
+        assert by_key[("binary", None)]["bytes_per_vector"] == 4
+
+        print("✓ PASSED")
+        return True
+
+    def test_response_cache(self):
+        """Test the semantic response cache: threshold, persona and context keys, TTLs, eviction, skipping the LLM"""
+        print("Test 32: Response Cache...", end=" ")
+
+        now = [0.0]
+        cache = ResponseCache(threshold=0.9, ttl=60, max_entries=2, clock=lambda: now[0])
+        cache.put("pirate", [1.0, 0.0], "Arrr, sunny!")
+        assert cache.get("pirate", [0.99, 0.05])[0] == "Arrr, sunny!"
+        assert cache.get("pirate", [0.0, 1.0])[0] is None           # not similar enough
+        assert cache.get("neutral", [1.0, 0.0])[0] is None          # other persona
+        cache.put("pirate", [0.0, 1.0], "A joke", ttl=10)
+        now[0] = 11
+        assert cache.get("pirate", [0.0, 1.0])[0] is None           # expired
+        # Full: the expired entry makes room first, then the least recently used one goes
+        cache.put("pirate", [0.6, 0.8], "Third")
+        assert cache.stats()["expirations"] == 1 and len(cache) == 2
+        cache.get("pirate", [1.0, 0.0])
+        cache.put("pirate", [0.8, -0.6], "Fourth")
+        assert cache.get("pirate", [0.6, 0.8])[0] is None and cache.get("pirate", [1.0, 0.0])[0] == "Arrr, sunny!"
+        stats = cache.stats()
+        assert stats["evictions"] == 1 and stats["hits"] == 3 and stats["misses"] == 4 and stats["hit_rate"] == round(3 / 7, 4)
+
+        topics = {"weather": [1.0, 0.0, 0.0, 0.0], "joke": [0.0, 1.0, 0.0, 0.0]}
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.side_effect = lambda text: next(
+            (v for k, v in topics.items() if k in text.lower()), [0.0, 0.0, 1.0, 0.0])
+        fake_embeddings.aembed_query = AsyncMock(side_effect=fake_embeddings.embed_query.side_effect)
+        # One scripted reply per model call; an unexpected call would fail the turn
+        fake_llm = GenericFakeChatModel(messages=iter([AIMessage(content="Sunny, 75°F"),
+                                                       AIMessage(content="Why did the chicken..."),
+                                                       AIMessage(content="Knock knock."),
+                                                       AIMessage(content="Sunny, clownishly")]))
+        shared = ResponseCache(threshold=0.95, ttl=3600)
+        mock_milvus = mock_milvus_with_rows([])
+
+        project.telemetry.reset()
+        with patch.object(project.runtime, "embeddings", fake_embeddings), \
+             patch.object(project.runtime, "llm", fake_llm), \
+             patch.object(project.runtime, "response_cache", shared), \
+             patch("project.RESPONSE_CACHE_TOOL_TTL", 5):
+            agent = PersonaAgent(mock_milvus, "test_collection", session_id="session_a")
+            assert agent.chat("What's the weather in Austin?") == "Sunny, 75°F"
+            # A context-free first turn in another session can reuse the answer
+            other = PersonaAgent(mock_milvus, "test_collection", session_id="session_b")
+            assert other.chat("what's the WEATHER in austin") == "Sunny, 75°F"
+            # The hit skipped the model but was saved and added to the history like any turn
+            assert [m.content for m in other.get_session_history().messages][-2:] == [
+                "what's the WEATHER in austin", "Sunny, 75°F"]
+            assert [s["stage"] for s in other.last_turn] == ["embed", "milvus.insert", "response_cache.hit",
+                                                             "embed", "milvus.insert", "turn"]
+            # The message embedding is computed once and reused for the save
+            assert [c[0][0] for c in fake_embeddings.embed_query.call_args_list].count(
+                "what's the WEATHER in austin") == 1
+
+            streamer = PersonaAgent(mock_milvus, "test_collection", session_id="session_c")
+            events = list(streamer.stream_chat("Weather in Austin please"))
+            assert [e["type"] for e in events] == ["token", "done"] and events[-1]["content"] == "Sunny, 75°F"
+
+            # The same follow-up in two sessions with different histories never shares an answer
+            assert agent.chat("Tell me a joke about it") == "Why did the chicken..."
+            assert other.chat("Tell me a joke about it") == "Knock knock."
+
+            # Another persona is a miss and reaches the model
+            clown = PersonaAgent(mock_milvus, "test_collection", session_id="session_d")
+            clown.set_persona("clown")
+            assert clown.chat("What's the weather in Austin?") == "Sunny, clownishly"
+
+            # Answers that used a tool get the shorter TTL
+            agent._spans = [{"stage": "tool:get_weather", "ms": 1.0, "error": False}]
+            agent._cache_response([0.0, 0.0, 0.0, 1.0], agent._cache_key(), "Rainy")
+            assert shared._expires.max() - shared._expires[shared._expires > -np.inf].min() > 3000
+            assert sorted(shared._expires[shared._expires > -np.inf])[0] < time.monotonic() + 6
+
+        summary = project.telemetry.summary()
+        assert summary["response_cache.hit"]["count"] == 2 and summary["response_cache.miss"]["count"] == 4
+        assert shared.stats()["hit_rate"] == round(2 / 6, 4)
+
+        print("✓ PASSED")
+        return True
+
+    def test_export_import(self):
+        """Test streaming export/import: JSONL and Parquet, filters, vectors, re-embedding and resume"""
+        print("Test 33: Export / Import...", end=" ")
+
+        rng = np.random.default_rng(0)
+        rows = [{"vector": rng.standard_normal(8).tolist(), "session_id": f"s{i % 3}", "timestamp": 1000 * i,
+                 "role": "user", "persona": "neutral", "content": f"message {i}"} for i in range(25)]
+        rows.append({"vector": rng.standard_normal(8).tolist(), "session_id": "s0", "timestamp": 30000,
+                     "role": "summary", "persona": "neutral", "content": "summary", "covered_messages": 9})
+        fake_embeddings = Mock()
+        fake_embeddings.embed_documents.side_effect = lambda texts: [[1.0] + [0.0] * 7 for _ in texts]
+
+        def contents(client, name):
+            return sorted(r["content"] for r in client.query(collection_name=name, filter="", output_fields=["*"]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "source", dim=8, layout="full")
+            store.insert("source", rows)
+
+            # JSONL with vectors; an interrupted export resumes after the last complete line
+            path = os.path.join(tmp, "backup.jsonl")
+            assert export_collection(store, "source", path, include_vectors=True, batch_size=4) == 26
+            with open(path, encoding="utf-8") as f:
+                full = f.read()
+            exported = [json.loads(line) for line in full.splitlines()]
+            assert exported[-1]["covered_messages"] == 9 and len(exported[0]["vector"]) == 8
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(full.splitlines()[:10]) + "\n" + full.splitlines()[10][:20])
+            assert export_collection(store, "source", path, include_vectors=True, batch_size=4, resume=True) == 16
+            with open(path, encoding="utf-8") as f:
+                assert f.read() == full
+
+            # Import keeps stored vectors; a resumed import skips rows already checkpointed
+            assert import_collection(store, "copy", path, batch_size=10, embeddings=fake_embeddings) == 26
+            assert contents(store, "copy") == contents(store, "source")
+            assert not fake_embeddings.embed_documents.called
+            copied = store.query(collection_name="copy", filter='role == "summary"', output_fields=["*"])[0]
+            assert copied["covered_messages"] == 9 and np.allclose(copied["vector"], exported[-1]["vector"], atol=1e-6)
+            with open(path + ".import.json", "w", encoding="utf-8") as f:
+                json.dump({"source": os.path.abspath(path), "collection": "resumed", "rows_read": 20,
+                           "inserted": 20}, f)
+            assert import_collection(store, "resumed", path, batch_size=4, resume=True,
+                                     embeddings=fake_embeddings) == 6
+
+            # Filters by session and time range, without vectors; import re-embeds
+            filtered = os.path.join(tmp, "filtered.jsonl")
+            assert export_collection(store, "source", filtered, sessions=["s1"], since=3000, until=20000) == 6
+            with open(filtered, encoding="utf-8") as f:
+                assert all("vector" not in json.loads(line) for line in f)
+            assert import_collection(store, "embedded", filtered, embeddings=fake_embeddings) == 6
+            assert fake_embeddings.embed_documents.call_count == 1
+            assert import_collection(store, "reembedded", path, re_embed=True, sessions=["s2"],
+                                     embeddings=fake_embeddings) == 8
+            assert all(r["vector"][0] == 1.0 for r in store.query(collection_name="reembedded", filter="",
+                                                                  output_fields=["vector"]))
+            small = os.path.join(tmp, "small.jsonl")
+            with open(small, "w", encoding="utf-8") as f:
+                f.write(json.dumps(dict(rows[0], vector=[1.0, 0.0])) + "\n")
+            try:
+                import_collection(store, "embedded", small)
+                assert False, "dimension mismatch should raise"
+            except ValueError as e:
+                assert "--re-embed" in str(e)
+
+            # Parquet: part files, dynamic fields kept, resume after the last finished part
+            parts = os.path.join(tmp, "backup.parquet")
+            assert export_collection(store, "source", parts, include_vectors=True, batch_size=4, rows_per_file=10) == 26
+            assert sorted(os.listdir(parts)) == ["part-00000.parquet", "part-00001.parquet", "part-00002.parquet"]
+            os.remove(os.path.join(parts, "part-00002.parquet"))
+            assert export_collection(store, "source", parts, include_vectors=True, batch_size=4,
+                                     rows_per_file=10, resume=True) == 6
+            assert import_collection(store, "from_parquet", parts, embeddings=fake_embeddings) == 26
+            assert contents(store, "from_parquet") == contents(store, "source")
+            summary = store.query(collection_name="from_parquet", filter='role == "summary"', output_fields=["*"])[0]
+            assert summary["covered_messages"] == 9 and summary["timestamp"] == 30000
+
+        print("✓ PASSED")
+        return True
+
+    def test_retention(self):
+        """Test condensing old sessions into summary rows, batched deletes, compaction and the report"""
+        print("Test 34: Retention...", end=" ")
+
+        day = 24 * 60 * 60 * 1000
+        now = 1_000 * day
+        topics = {"sailing": [1.0, 0.0, 0.0, 0.0], "baking": [0.0, 1.0, 0.0, 0.0]}
+
+        def embed(text):
+            return next((v for k, v in topics.items() if k in text.lower()), [0.0, 0.0, 1.0, 0.0])
+
+        def row(session_id, role, content, timestamp, **extra):
+            return dict({"vector": embed(content), "session_id": session_id, "role": role, "persona": "pirate",
+                         "content": content, "timestamp": timestamp}, **extra)
+
+        rows = [row("old", "system", "Persona changed to: pirate", now - 120 * day)]
+        rows += [row("old", "user" if i % 2 == 0 else "assistant", f"sailing lesson {i} " + "x" * 200,
+                     now - 120 * day + i) for i in range(10)]
+        rows.append(row("old", "summary", "Talked about sailing lessons 0-3", now - 120 * day + 5,
+                        covered_messages=4))
+        rows.append(row("personas_only", "system", "Persona changed to: clown", now - 200 * day))
+        rows += [row("recent", "user", f"baking question {i}", now - day + i) for i in range(4)]
+
+        calls = []
+
+        def summarize(summary, messages):
+            calls.append((summary, [m.content.split(" x")[0] for m in messages]))
+            return f"{summary} + {len(messages)} more"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "c", dim=4, layout="full")
+            store.insert("c", rows)
+            path = os.path.join(tmp, "store", "c")
+
+            dry = run_retention(store, "c", older_than_days=90, summarize=summarize, embed=embed,
+                                dry_run=True, path=path, now_ms=now)
+            assert dry["sessions"] == 2 and dry["rows_deleted"] == 0 and len(store.query("c", filter="")) == 17
+
+            report = run_retention(store, "c", older_than_days=90, summarize=summarize, embed=embed,
+                                   batch_size=3, fold_messages=4, path=path, now_ms=now)
+            assert report["sessions"] == 2 and report["rows_deleted"] == 13 and report["summaries_written"] == 1
+            assert report["bytes_reclaimed_estimate"] > 13 * 4 * 4 + 10 * 200
+            assert report["disk_bytes_reclaimed"] > 0 and report["disk_bytes_after"] == disk_usage(path)
+
+            # Continued from the stored summary: only the 6 messages it didn't cover, 4 per call
+            assert calls == [("Talked about sailing lessons 0-3", [f"sailing lesson {i}" for i in range(4, 8)]),
+                             ("Talked about sailing lessons 0-3 + 4 more", ["sailing lesson 8", "sailing lesson 9"])]
+            remaining = store.query("c", filter="", output_fields=["*"])
+            assert sorted(r["session_id"] for r in remaining) == ["old"] + ["recent"] * 4
+            condensed = next(r for r in remaining if r["session_id"] == "old")
+            assert condensed["role"] == "summary" and condensed["archived_messages"] == 10
+            assert condensed["timestamp"] == now - 120 * day + 9 and condensed["persona"] == "pirate"
+
+            # Compaction dropped the deleted rows from the log but never reuses their ids
+            with open(os.path.join(path, "rows.jsonl"), encoding="utf-8") as f:
+                assert sum(1 for _ in f) == 5
+            last = store.insert("c", [row("recent", "user", "one more", now)])["ids"][0]
+            store.delete("c", ids=[last])
+            assert store.compact("c") == {"rows": 5, "removed": 1}
+            assert store.insert("c", [row("recent", "user", "and another", now)])["ids"][0] == last + 1
+
+            # Nothing is left to condense on a second run
+            assert run_retention(store, "c", older_than_days=90, summarize=summarize, embed=embed,
+                                 path=path, now_ms=now)["sessions"] == 0
+
+            # The summary stays searchable through semantic_search
+            fake_embeddings = Mock()
+            fake_embeddings.embed_query.side_effect = embed
+            with patch.object(project.runtime, "embeddings", fake_embeddings):
+                agent = PersonaAgent(store, "c", session_id="new_session")
+                hits = agent.semantic_search("sailing", top_k=1, current_session_only=False, mode="vector")
+            assert hits[0]["role"] == "summary" and hits[0]["session_id"] == "old"
+
+        # Without a working LLM the summary falls back to clipped transcript lines
+        broken = Mock()
+        broken.invoke.side_effect = RuntimeError("offline")
+        fallback = llm_summarizer(broken)("Earlier", [project.HumanMessage(content="sailing tomorrow")])
+        assert fallback == "Earlier\nUser: sailing tomorrow"
+
+        print("✓ PASSED")
+        return True
+
+    def test_semantic_search_many(self):
+        """Test batched multi-query search: one embedding call, one multi-vector search, batch-file mode"""
+        print("Test 35: Batched Semantic Search...", end=" ")
+
+        topics = {"ship": [1.0, 0.0, 0.0, 0.0], "weather": [0.0, 1.0, 0.0, 0.0], "cake": [0.0, 0.0, 1.0, 0.0]}
+
+        def embed(text):
+            return next((v for k, v in topics.items() if k in text.lower()), [0.0, 0.0, 0.0, 1.0])
+
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.side_effect = embed
+        fake_embeddings.embed_documents.side_effect = lambda texts: [embed(t) for t in texts]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = NumpyVectorStore(os.path.join(tmp, "store"))
+            create_conversation_collection(store, "c", dim=4, layout="full")
+            store.insert("c", [
+                {"vector": embed(text), "session_id": session, "role": "user", "persona": "neutral",
+                 "content": text, "timestamp": i}
+                for i, (session, text) in enumerate([("a", "Tell me about ships"), ("a", "What about the weather?"),
+                                                     ("b", "A cake recipe"), ("b", "Ship ahoy")])
+            ])
+            store.search = Mock(side_effect=store.search)
+
+            with patch.object(project.runtime, "embeddings", fake_embeddings):
+                agent = PersonaAgent(store, "c", session_id="a")
+                results = agent.semantic_search_many(["ships", "weather", "cake"], top_k=1,
+                                                     current_session_only=False, mode="vector")
+                assert [r[0]["content"] for r in results] == ["Tell me about ships", "What about the weather?",
+                                                              "A cake recipe"]
+                fake_embeddings.embed_documents.assert_called_once_with(["ships", "weather", "cake"])
+                assert not fake_embeddings.embed_query.called
+                assert store.search.call_count == 1 and len(store.search.call_args.kwargs["data"]) == 3
+
+                # Session scoping, hybrid fusion and lexical mode per query; empty input costs nothing
+                scoped = agent.semantic_search_many(["ship", "cake"], top_k=5, mode="vector")
+                assert {r["session_id"] for hits in scoped for r in hits} == {"a"}
+                hybrid = agent.semantic_search_many(["ship ahoy", "cake recipe"], top_k=1,
+                                                    current_session_only=False, mode="hybrid")
+                assert [r[0]["content"] for r in hybrid] == ["Ship ahoy", "A cake recipe"]
+                lexical = agent.semantic_search_many(["recipe", "zzz"], current_session_only=False, mode="lexical")
+                assert lexical[0][0]["content"] == "A cake recipe" and lexical[1] == []
+                assert agent.semantic_search_many([]) == []
+
+                # A single query still goes through embed_query (and its cache entry)
+                assert agent.semantic_search("weather", top_k=1, mode="vector")[0]["content"] == "What about the weather?"
+                assert fake_embeddings.embed_query.call_count == 1
+
+                # Batch-file mode: queries streamed in batches, one JSON line per query in input order
+                out = io.StringIO()
+                searches = store.search.call_count
+                count = search_batches(agent, read_queries(["ships\n", "\n", "weather\n", "cake\n"]), out,
+                                       top_k=1, mode="vector", batch_size=2)
+                lines = [json.loads(line) for line in out.getvalue().splitlines()]
+                assert count == 3 and [line["query"] for line in lines] == ["ships", "weather", "cake"]
+                assert lines[2]["results"][0]["content"] == "A cake recipe"
+                assert store.search.call_count - searches == 2
+
+        print("✓ PASSED")
+        return True
+
+
+    def test_concurrent_tools(self):
+        """Test one step's tool calls running concurrently, with per-tool timeouts answered by a marker"""
+        print("Test 36: Concurrent Tool Execution...", end=" ")
+
+        from concurrent.futures import ThreadPoolExecutor
+        from langchain.agents import create_openai_tools_agent
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+        assert parse_tool_timeouts("get_weather=5, web_search = 2.5,bad,x=y,") == {"get_weather": 5.0,
+                                                                                 "web_search": 2.5}
+        assert parse_tool_timeouts("") == {}
+
+        release = threading.Event()
+
+        def slow(name, seconds):
+            def run(city: str) -> str:
+                time.sleep(seconds)
+                return f"{name}:{city}"
+
+            async def arun(city: str) -> str:
+                await asyncio.sleep(seconds)
+                return f"{name}:{city}"
+            return StructuredTool.from_function(func=run, coroutine=arun, name=name, description=name)
+
+        def hang(city: str) -> str:
+            release.wait(5)
+            return "late"
+
+        async def ahang(city: str) -> str:
+            await asyncio.sleep(5)
+            return "late"
+
+        tools = [slow("weather", 0.3), slow("news", 0.3), slow("traffic", 0.3),
+                 StructuredTool.from_function(func=hang, coroutine=ahang, name="stuck", description="stuck")]
+        prompt = ChatPromptTemplate.from_messages([("human", "{input}"), MessagesPlaceholder("agent_scratchpad")])
+
+        def calls(*names):
+            return AIMessage(content="", additional_kwargs={"tool_calls": [
+                {"id": f"call_{name}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps({"city": "Oslo"})}} for name in names]})
+
+        def executor(names, **kwargs):
+            llm = GenericFakeChatModel(messages=iter([calls(*names), AIMessage(content="done")]))
+            return ConcurrentAgentExecutor(agent=create_openai_tools_agent(llm, tools, prompt), tools=tools,
+                                           return_intermediate_steps=True, pool=pool, **kwargs)
+
+        timeouts = []
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            # Three 0.3s calls in one step overlap instead of taking 0.9s, on both paths
+            for run in (lambda ex: ex.invoke({"input": "hi"}),
+                        lambda ex: asyncio.run(ex.ainvoke({"input": "hi"}))):
+                started = time.monotonic()
+                result = run(executor(["weather", "news", "traffic"], tool_timeout=5))
+                assert time.monotonic() - started < 0.75
+                assert result["output"] == "done"
+                assert [obs for _, obs in result["intermediate_steps"]] == ["weather:Oslo", "news:Oslo",
+                                                                            "traffic:Oslo"]
+
+            # A stuck tool is cut off at its own timeout; the others' results still reach the model
+            for run in (lambda ex: ex.invoke({"input": "hi"}),
+                        lambda ex: asyncio.run(ex.ainvoke({"input": "hi"}))):
+                started = time.monotonic()
+                result = run(executor(["weather", "stuck"], tool_timeout=5, tool_timeouts={"stuck": 0.5},
+                                      on_timeout=lambda name, waited: timeouts.append(name)))
+                assert time.monotonic() - started < 2
+                observations = [obs for _, obs in result["intermediate_steps"]]
+                assert observations[0] == "weather:Oslo" and observations[1].startswith(TIMEOUT_MARKER)
+
+            # The step deadline bounds the calls together
+            result = executor(["stuck"], step_timeout=0.3).invoke({"input": "hi"})
+            assert result["intermediate_steps"][0][1].startswith(TIMEOUT_MARKER)
+            release.set()
+        assert timeouts == ["stuck", "stuck"]
+
+        print("✓ PASSED")
+        return True
+
+    def test_load_generator(self):
+        """Test the load generator: simulated users chatting through the real clients against the local stub"""
+        print("Test 37: Load Generator...", end=" ")
+
+        from langchain_openai import ChatOpenAI
+
+        with StubOpenAI(latency=0.01, token_rate=0, reply_tokens=5, tool_call_rate=0.5) as stub:
+            # The stub speaks enough of the API for ChatOpenAI, tool calls included
+            llm = ChatOpenAI(model="gpt-4o-mini", base_url=stub.base_url, api_key="sk-stub")
+            reply = llm.invoke("hello")
+            assert len(reply.content.split()) == 5
+            forced = StubOpenAI(tool_call_rate=1.0)
+            message, finish_reason, _ = forced.chat_completion({
+                "messages": [{"role": "user", "content": "weather?"}],
+                "tools": [{"type": "function", "function": {"name": "get_weather"}}]})
+            forced.stop()
+            assert finish_reason == "tool_calls" and message["tool_calls"][0]["function"]["name"] == "get_weather"
+
+            with tempfile.TemporaryDirectory() as tmp:
+                store = NumpyVectorStore(os.path.join(tmp, "store"))
+                report = run_load(store, "load", stub, users=4, turns=3, think=0, ramp=0, sample_interval=0.2)
+                session_rows = store.query("load", filter='session_id == "load_0_0002"', output_fields=["id"])
+
+            assert report["turns"] == 12 and report["errors"] == {}
+            assert report["latency"]["count"] == 12 and report["turns_per_s"] > 0
+            assert len(session_rows) == 6
+            assert stub.requests["chat"] >= 12 and stub.requests["embeddings"] > 0
+            # Tool-call turns ran get_weather against the stub's weather endpoints
+            assert stub.requests["tool_calls"] > 0 and stub.requests["geocode"] > 0
+            timeline = report["memory"]["timeline"]
+            assert len(timeline) >= 2 and timeline[-1]["turns"] == 12
+            assert report["memory"]["peak_mb"] >= report["memory"]["start_mb"] > 0
+
+        # Failed turns are errors: out of the latencies and the throughput
+        with StubOpenAI(latency=0, token_rate=0, reply_tokens=5, tool_call_rate=0, error_rate=1.0) as stub:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = NumpyVectorStore(os.path.join(tmp, "store"))
+                report = run_load(store, "load", stub, users=2, turns=2, think=0, ramp=0, sample_interval=0.2)
+            assert report["turns"] == 0 and report["errors"] == {"llm": 4}
+            assert report["latency"] == {"count": 0} and report["turns_per_s"] == 0
+            assert stub.requests["chat_errors"] == stub.requests["chat"] >= 4
+
+        print("✓ PASSED")
+        return True
+
+    def test_field_limits(self):
+        """Test that personas are clipped to the persona field and bad session ids are rejected"""
+        print("Test 38: Field Limits...", end=" ")
+
+        fake_embeddings = Mock()
+        fake_embeddings.embed_query.return_value = [0.1] * 8
+        fake_embeddings.embed_documents.side_effect = lambda texts: [[0.1] * 8 for _ in texts]
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(project.runtime, "embeddings", fake_embeddings):
+            client = MilvusClient(uri=os.path.join(tmp, "limits.db"))
+            create_conversation_collection(client, "c", dim=8)
+
+            # An over-long persona used to fail the insert, and with write-behind the whole batch
+            agent = PersonaAgent(client, "c", session_id="limits", write_behind=True)
+            agent.save_message("user", "before")
+            agent.set_persona("p" * 100)
+            agent.save_message("user", "after")
+            agent.flush()
+            assert agent.persona == "p" * project.PERSONA_MAX_LENGTH
+            assert agent.writer.written == 3 and agent.writer.failed == 0
+            rows = client.query(collection_name="c", filter='session_id == "limits"', output_fields=["persona"])
+            assert len(rows) == 3 and {len(r["persona"]) for r in rows} == {7, project.PERSONA_MAX_LENGTH}
+            agent.close()
+            client.close()
+
+            for session_id in ['x" or session_id != "', "s" * 65, "a b"]:
+                try:
+                    PersonaAgent(Mock(), "c", session_id=session_id)
+                except ValueError:
+                    continue
+                raise AssertionError(f"accepted session id {session_id!r}")
+            assert project.check_session_id("user-1:web.2024_01") == "user-1:web.2024_01"
+
+        print("✓ PASSED")
+        return True
+
+    def test_session_pool_limits(self):
+        """Test that the server pool evicts idle sessions and rejects bad session ids and bodies"""
+        print("Test 39: Session Pool Limits...", end=" ")
+
+        from aiohttp.test_utils import TestClient, TestServer
+        from server import create_app
+
+        mock_milvus = Mock()
+        mock_milvus.query.return_value = []
+        fake_llm = GenericFakeChatModel(messages=cycle([AIMessage(content="reply")]))
+
+        async def run():
+            pool = SessionPool(mock_milvus, "test_collection", write_behind=False, max_sessions=2)
+            for session in ("a", "b", "c"):
+                await pool.chat(session, f"hi from {session}")
+            assert len(pool) == 2 and pool.evictions == 1 and "a" not in pool._sessions
+            # An evicted session comes back (resumed from storage) and pushes out the next idle one
+            agent, response = await pool.chat("a", "back again")
+            assert response == "reply" and agent.session_id == "a" and list(pool._sessions) == ["c", "a"]
+
+            async with TestClient(TestServer(create_app(pool))) as client:
+                bad = [
+                    await client.post("/chat", data="{not json", headers={"Content-Type": "application/json"}),
+                    await client.post("/chat", json=["a list"]),
+                    await client.post("/chat", json={"session_id": 'x" or session_id != "', "message": "hi"}),
+                    await client.post("/persona", json={"session_id": "s" * 65, "persona": "pirate"}),
+                    await client.get("/ws", params={"session_id": "a b"}),
+                    await client.post("/chat", json={"message": 123}),
+                    await client.post("/persona", json={"session_id": "a", "persona": ["pirate"]}),
+                ]
+                assert [r.status for r in bad] == [400] * 7
+                # A WebSocket frame that isn't a message object gets an error event; the socket stays open
+                async with client.ws_connect("/ws", params={"session_id": "ws-1"}) as ws:
+                    assert (await ws.receive_json())["type"] == "session"
+                    await ws.send_str("[]")
+                    assert (await ws.receive_json())["type"] == "error"
+                    await ws.send_json({"message": "still there?"})
+                    events = [await ws.receive_json()]
+                    while events[-1]["type"] not in ("done", "error"):
+                        events.append(await ws.receive_json())
+                    assert events[-1] == {"type": "done", "content": "reply"}
+                ok = await client.post("/chat", json={"session_id": "user-1:web", "message": "hi"})
+                assert ok.status == 200 and (await ok.json())["session_id"] == "user-1:web"
+
+        with patch.object(project.runtime, "llm", fake_llm):
+            asyncio.run(run())
+
+        print("✓ PASSED")
+        return True
+
+    def test_write_behind_failures(self):
+        """Test that failed batches are retried row by row and a dead worker fails loudly"""
+        print("Test 40: Write-Behind Failures...", end=" ")
+
+        def insert(collection_name, data):
+            if any(row["content"] == "bad" for row in data):
+                raise ValueError("row rejected")
+
+        mock_milvus = Mock()
+        mock_milvus.insert.side_effect = insert
+        mock_embeddings = Mock()
+        mock_embeddings.embed_documents.side_effect = lambda texts: [[0.5] * 4 for _ in texts]
+
+        writer = WriteBehindQueue(mock_milvus, "test_collection", mock_embeddings, 4,
+                                  batch_size=100, flush_interval=60, retry_delay=0)
+        for content in ["Hello!", "bad", "Arrr!"]:
+            writer.submit({"session_id": "s", "role": "user", "content": content, "persona": "pirate"})
+        assert writer.flush(timeout=5)
+        # Only the bad row is lost
+        assert writer.written == 2
+        assert writer.failed == 1
+
+        # A transient failure is retried before anything is dropped
+        mock_milvus.insert.side_effect = [ConnectionError("busy"), None]
+        writer.submit({"session_id": "s", "role": "user", "content": "Ahoy!", "persona": "pirate"})
+        assert writer.flush(timeout=5)
+        assert writer.written == 3
+        assert writer.failed == 1
+
+        # If the worker dies, flush and close raise instead of waiting forever
+        mock_embeddings.embed_documents.side_effect = SystemExit
+        writer.submit({"session_id": "s", "role": "user", "content": "Yo ho!", "persona": "pirate"})
+        try:
+            writer.flush(timeout=5)
+            raise AssertionError("flush should fail when the worker is dead")
+        except RuntimeError:
+            pass
+        try:
+            writer.close(timeout=5)
+            raise AssertionError("close should fail when the worker is dead")
+        except RuntimeError:
+            pass
+
+        print("✓ PASSED")
+        return True
+
 
 def run_all_tests():
     """Run all tests"""
@@ -207,6 +1844,40 @@ def run_all_tests():
         test_suite.test_conversation_loading,
         test_suite.test_clear_conversation,
         test_suite.test_milvus_initialization,
+        test_suite.test_embedding_cache,
+        test_suite.test_embedding_cache_disk_eviction,
+        test_suite.test_write_behind_batches_inserts,
+        test_suite.test_write_behind_agent_flush,
+        test_suite.test_stream_chat,
+        test_suite.test_achat,
+        test_suite.test_session_pool_ordering,
+        test_suite.test_summarizing_history_budget,
+        test_suite.test_resume_with_summary,
+        test_suite.test_resume_window_and_older_pages,
+        test_suite.test_history_store_eviction,
+        test_suite.test_agent_rehydrates_evicted_session,
+        test_suite.test_typed_collection_migration,
+        test_suite.test_weather_caching,
+        test_suite.test_web_search_cache_and_retries,
+        test_suite.test_web_search_single_flight,
+        test_suite.test_local_embedding_backend,
+        test_suite.test_numpy_vector_store,
+        test_suite.test_hybrid_search,
+        test_suite.test_long_term_memory,
+        test_suite.test_benchmark_harness,
+        test_suite.test_stage_telemetry,
+        test_suite.test_lazy_import,
+        test_suite.test_compact_vector_layouts,
+        test_suite.test_response_cache,
+        test_suite.test_export_import,
+        test_suite.test_retention,
+        test_suite.test_semantic_search_many,
+        test_suite.test_concurrent_tools,
+        test_suite.test_load_generator,
+        test_suite.test_field_limits,
+        test_suite.test_session_pool_limits,
+        test_suite.test_write_behind_failures,
+        test_suite.test_stream_chat_with_fold,
     ]
     
     passed = 0
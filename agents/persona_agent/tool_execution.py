@@ -0,0 +1,109 @@
+"""
+Concurrent tool execution with deadlines for the agent loop.
+
+When the model asks for several tools in one step, AgentExecutor runs them one after another
+on the sync path (the async path gathers them, but without any time limit). ConcurrentAgentExecutor
+runs a step's tool calls together, on a bounded thread pool for sync calls and with
+asyncio for async ones, and bounds each call by its tool's timeout and by a deadline for the
+whole step. A call that misses its deadline is answered with an observation starting with
+TIMEOUT_MARKER, so the model still gets the other results and can say what is missing;
+the abandoned call finishes (or hits its own network timeout) in the background.
+"""
+
+import asyncio
+import contextvars
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional
+
+from langchain.agents import AgentExecutor
+from langchain_core.agents import AgentStep
+
+TIMEOUT_MARKER = "[tool timed out]"
+
+
+def parse_tool_timeouts(spec):
+    """{"get_weather": 5.0, ...} from "get_weather=5,web_search=8" (empty or malformed items are skipped)."""
+    timeouts = {}
+    for item in (spec or "").split(","):
+        name, _, seconds = item.partition("=")
+        try:
+            timeouts[name.strip()] = float(seconds)
+        except ValueError:
+            continue
+    return timeouts
+
+
+class _PendingStep:
+    def __init__(self, action, future):
+        self.action = action
+        self.future = future
+        self.started = time.monotonic()
+
+
+class ConcurrentAgentExecutor(AgentExecutor):
+    """AgentExecutor that runs one step's tool calls concurrently, each under a deadline.
+
+    tool_timeout (seconds, None for no limit) applies to every call unless tool_timeouts
+    names the tool; step_timeout bounds all calls of one step together. pool runs sync
+    tool calls; on_timeout(tool_name, waited_seconds) is called for each call given up on.
+    """
+
+    pool: Any
+    tool_timeout: Optional[float] = None
+    tool_timeouts: Dict[str, float] = {}
+    step_timeout: Optional[float] = None
+    on_timeout: Optional[Callable[[str, float], None]] = None
+
+    def _limit(self, tool_name):
+        return self.tool_timeouts.get(tool_name, self.tool_timeout)
+
+    def _deadline(self, step):
+        limit = self._limit(step.action.tool)
+        return step.started + limit if limit is not None else None
+
+    def _timed_out(self, action, waited):
+        if self.on_timeout is not None:
+            self.on_timeout(action.tool, waited)
+        observation = (f"{TIMEOUT_MARKER} {action.tool} did not finish within {waited:.1f}s, so there is no "
+                       f"result for it. Answer with the other results and say what is missing.")
+        return AgentStep(action=action, observation=observation)
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        # Submitted here and collected by _iter_next_step, so a step's calls overlap
+        context = contextvars.copy_context()
+        future = self.pool.submit(context.run, super()._perform_agent_action, name_to_tool_map, color_mapping,
+                                  agent_action, run_manager)
+        return _PendingStep(agent_action, future)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        pending = []
+        for item in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps,
+                                            run_manager):
+            if isinstance(item, _PendingStep):
+                pending.append(item)
+            else:
+                yield item
+        if not pending:
+            return
+        step_deadline = pending[0].started + self.step_timeout if self.step_timeout is not None else None
+        for step in pending:
+            deadlines = [d for d in (step_deadline, self._deadline(step)) if d is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                yield step.future.result(timeout=timeout)
+            except FutureTimeoutError:
+                step.future.cancel()
+                yield self._timed_out(step.action, time.monotonic() - step.started)
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+        # The step's calls are already gathered, so they share a start time and the step deadline
+        limits = [t for t in (self._limit(agent_action.tool), self.step_timeout) if t is not None]
+        call = super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        if not limits:
+            return await call
+        started = time.monotonic()
+        try:
+            return await asyncio.wait_for(call, timeout=min(limits))
+        except asyncio.TimeoutError:
+            return self._timed_out(agent_action, time.monotonic() - started)
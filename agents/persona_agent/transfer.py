@@ -0,0 +1,371 @@
+"""
+Streaming export and import of conversation data, for backups, moves and re-seeding.
+
+    python3 transfer.py export backup.jsonl [--vectors] [--session ID ...] [--since 2024-01-01] [--until ...]
+    python3 transfer.py export backup.parquet --format parquet [--rows-per-file 100000]
+    python3 transfer.py import backup.jsonl [--collection NAME] [--re-embed] [--batch-size 1000]
+
+Export reads the collection through a query iterator one batch at a time, in primary-key
+order, so memory stays flat however large the store is. JSONL is one message per line;
+Parquet is a directory of part files (dynamic fields such as covered_messages go in a JSON
+"extra" column). Vectors are only written with --vectors.
+
+Import inserts in batches, creating the collection if needed. Rows without vectors, or all
+rows with --re-embed, are embedded with the configured model (one embed_documents call per
+batch). Both directions take the same session and time-range filters.
+
+Both are resumable with --resume: export continues after the last id already written
+(dropping a partially written line or part file), and import skips the input rows recorded
+in its checkpoint file (<input>.import.json) after each committed batch, so at most the
+batch in flight when a run stopped is inserted twice.
+"""
+
+import argparse
+import glob
+import json
+import os
+from datetime import datetime
+
+from migrate import _to_epoch_ms, convert_row
+from project import COLLECTION_NAME, create_conversation_collection, runtime
+from vector_layout import FULL_VECTOR_FIELD
+
+FORMATS = ("jsonl", "parquet")
+
+# Typed columns of a Parquet export; any other field goes in EXTRA_COLUMN as JSON
+PARQUET_COLUMNS = ("id", "session_id", "timestamp", "role", "persona", "content")
+EXTRA_COLUMN = "extra"
+
+
+def parse_time(value):
+    """Epoch milliseconds from an ISO date/datetime or a number of epoch ms (None passes through)."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if value.isdigit():
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except ValueError:
+        raise ValueError(f"Expected an ISO date/time or epoch milliseconds, got '{value}'") from None
+
+
+def build_filter(sessions=None, since=None, until=None, after_id=None):
+    """Milvus filter for the given sessions, [since, until) time range and ids after after_id."""
+    conditions = []
+    if sessions:
+        conditions.append(f"session_id in {json.dumps(list(sessions))}")
+    if since is not None:
+        conditions.append(f"timestamp >= {parse_time(since)}")
+    if until is not None:
+        conditions.append(f"timestamp < {parse_time(until)}")
+    if after_id is not None:
+        conditions.append(f"id > {int(after_id)}")
+    return " and ".join(conditions)
+
+
+def row_matches(row, sessions=None, since=None, until=None):
+    """Client-side version of build_filter, for rows read from a file."""
+    if sessions and row.get("session_id") not in sessions:
+        return False
+    timestamp = _to_epoch_ms(row.get("timestamp"))
+    if since is not None and timestamp < parse_time(since):
+        return False
+    return until is None or timestamp < parse_time(until)
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format '{fmt}' (expected one of {', '.join(FORMATS)})")
+        return fmt
+    return "parquet" if path.endswith(".parquet") or os.path.isdir(path) else "jsonl"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+# --- Export -------------------------------------------------------------------------------
+
+class _JsonlWriter:
+    def __init__(self, path, resume):
+        self.last_id = self._recover(path) if resume and os.path.exists(path) else None
+        self._file = open(path, "a" if self.last_id is not None else "w", encoding="utf-8")
+
+    @staticmethod
+    def _recover(path):
+        """Cut off a partially written last line; return the id of the last complete row."""
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos, tail = end, b""
+            # Read backwards until the last two newlines (or the start of the file) are in view
+            while pos > 0 and tail.count(b"\n") < 2:
+                step = min(pos, 64 * 1024)
+                pos -= step
+                f.seek(pos)
+                tail = f.read(step) + tail
+            complete = tail[:tail.rfind(b"\n") + 1]
+            f.truncate(pos + len(complete))
+        lines = complete.splitlines()
+        return json.loads(lines[-1])["id"] if lines else None
+
+    def write(self, rows):
+        self._file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Part files of at most rows_per_file rows; each is written as .tmp and renamed when full."""
+
+    def __init__(self, path, resume, include_vectors, rows_per_file):
+        self.pa = _import_pyarrow()
+        self.path = path
+        self.rows_per_file = rows_per_file
+        os.makedirs(path, exist_ok=True)
+        for leftover in glob.glob(os.path.join(path, "*.tmp")):
+            os.remove(leftover)
+        parts = self._parts(path)
+        if parts and not resume:
+            for part in parts:
+                os.remove(part)
+            parts = []
+        self.last_id = None
+        if parts:
+            ids = self.pa.parquet.read_table(parts[-1], columns=["id"]).column("id")
+            self.last_id = self.pa.compute.max(ids).as_py()
+        self._index = len(parts)
+        fields = [("id", self.pa.int64()), ("session_id", self.pa.string()), ("timestamp", self.pa.int64()),
+                  ("role", self.pa.string()), ("persona", self.pa.string()), ("content", self.pa.string()),
+                  (EXTRA_COLUMN, self.pa.string())]
+        if include_vectors:
+            fields.append(("vector", self.pa.list_(self.pa.float32())))
+        self.schema = self.pa.schema(fields)
+        self._writer = None
+        self._rows = 0
+
+    @staticmethod
+    def _parts(path):
+        return sorted(glob.glob(os.path.join(path, "part-*.parquet")))
+
+    def _part_path(self):
+        return os.path.join(self.path, f"part-{self._index:05d}.parquet")
+
+    def _to_record(self, row):
+        record = {name: row.get(name) for name in PARQUET_COLUMNS}
+        record["timestamp"] = _to_epoch_ms(record["timestamp"])
+        extra = {k: v for k, v in row.items() if k not in PARQUET_COLUMNS and k != "vector"}
+        record[EXTRA_COLUMN] = json.dumps(extra, ensure_ascii=False) if extra else None
+        if "vector" in self.schema.names:
+            record["vector"] = row.get("vector")
+        return record
+
+    def write(self, rows):
+        while rows:
+            if self._writer is None:
+                self._writer = self.pa.parquet.ParquetWriter(self._part_path() + ".tmp", self.schema)
+            take = rows[:self.rows_per_file - self._rows]
+            rows = rows[len(take):]
+            self._writer.write_table(self.pa.Table.from_pylist([self._to_record(r) for r in take], self.schema))
+            self._rows += len(take)
+            if self._rows >= self.rows_per_file:
+                self._finish_part()
+
+    def _finish_part(self):
+        self._writer.close()
+        os.replace(self._part_path() + ".tmp", self._part_path())
+        self._writer = None
+        self._rows = 0
+        self._index += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._finish_part()
+
+
+def export_collection(client, collection_name, path, fmt=None, include_vectors=False, sessions=None,
+                      since=None, until=None, batch_size=1000, rows_per_file=100_000, resume=False):
+    """Stream a collection to JSONL or Parquet. Returns the number of rows written by this run."""
+    fmt = detect_format(path, fmt)
+    if not client.has_collection(collection_name):
+        raise ValueError(f"Collection '{collection_name}' does not exist")
+    if fmt == "parquet":
+        writer = _ParquetWriter(path, resume, include_vectors, rows_per_file)
+    else:
+        writer = _JsonlWriter(path, resume)
+    if writer.last_id is not None:
+        print(f"  resuming after id {writer.last_id}")
+
+    client.load_collection(collection_name)
+    # "*" keeps dynamic fields (such as covered_messages) on every store
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter=build_filter(sessions, since, until, after_id=writer.last_id),
+        output_fields=["*"],
+    )
+    written = 0
+    try:
+        while True:
+            page = iterator.next()
+            if not page:
+                break
+            rows = []
+            for row in page:
+                row = dict(row)
+                row.pop(FULL_VECTOR_FIELD, None)
+                if include_vectors:
+                    row["vector"] = [float(x) for x in row["vector"]]
+                else:
+                    row.pop("vector", None)
+                rows.append(row)
+            writer.write(rows)
+            written += len(rows)
+            print(f"  exported {written} rows")
+    finally:
+        iterator.close()
+        writer.close()
+    print(f"✓ Exported {written} rows from '{collection_name}' to {path}")
+    return written
+
+
+# --- Import -------------------------------------------------------------------------------
+
+def read_rows(path, fmt=None, batch_size=1000):
+    """Yield the rows of an export one at a time."""
+    if detect_format(path, fmt) == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    pa = _import_pyarrow()
+    parts = _ParquetWriter._parts(path) if os.path.isdir(path) else [path]
+    for part in parts:
+        for batch in pa.parquet.ParquetFile(part).iter_batches(batch_size=batch_size):
+            for record in batch.to_pylist():
+                extra = record.pop(EXTRA_COLUMN, None)
+                if record.get("vector") is None:
+                    record.pop("vector", None)
+                yield {**record, **json.loads(extra)} if extra else record
+
+
+def _load_checkpoint(checkpoint, resume, path, collection_name):
+    """(input rows read, rows inserted) recorded by an earlier run, or (0, 0)."""
+    if not resume or not os.path.exists(checkpoint):
+        return 0, 0
+    with open(checkpoint, encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("source") != os.path.abspath(path) or state.get("collection") != collection_name:
+        raise ValueError(f"Checkpoint {checkpoint} belongs to another import; remove it or drop --resume")
+    return state["rows_read"], state["inserted"]
+
+
+def _save_checkpoint(checkpoint, path, collection_name, rows_read, inserted):
+    tmp = f"{checkpoint}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"source": os.path.abspath(path), "collection": collection_name,
+                   "rows_read": rows_read, "inserted": inserted}, f)
+    os.replace(tmp, checkpoint)
+
+
+def import_collection(client, collection_name, path, fmt=None, re_embed=False, embeddings=None,
+                      sessions=None, since=None, until=None, batch_size=1000, resume=False, checkpoint=None):
+    """Insert an export into a collection in batches. Returns the number of rows inserted by this run."""
+    checkpoint = checkpoint or f"{path.rstrip(os.sep)}.import.json"
+    skip, total = _load_checkpoint(checkpoint, resume, path, collection_name)
+    if skip:
+        print(f"  resuming after {skip} input rows")
+    rows_read, inserted = skip, 0
+    dim = None
+    if client.has_collection(collection_name):
+        from project import collection_dim
+
+        dim = collection_dim(client, collection_name)
+
+    def flush(batch):
+        nonlocal dim, inserted
+        if not batch:
+            return
+        missing = [row for row in batch if re_embed or not row.get("vector")]
+        if missing:
+            vectors = (embeddings or runtime.embeddings).embed_documents([row["content"] for row in missing])
+            for row, vector in zip(missing, vectors):
+                row["vector"] = vector
+        if dim is None:
+            dim = len(batch[0]["vector"])
+            create_conversation_collection(client, collection_name, dim)
+        wrong = next((len(row["vector"]) for row in batch if len(row["vector"]) != dim), None)
+        if wrong is not None:
+            raise ValueError(f"Exported vectors have {wrong} dimensions but '{collection_name}' stores {dim}; "
+                             f"import with --re-embed")
+        client.insert(collection_name=collection_name, data=batch)
+        inserted += len(batch)
+        _save_checkpoint(checkpoint, path, collection_name, rows_read, total + inserted)
+        print(f"  imported {inserted} rows")
+
+    batch = []
+    for index, row in enumerate(read_rows(path, fmt, batch_size)):
+        if index < skip:
+            continue
+        rows_read = index + 1
+        if not row_matches(row, sessions, since, until):
+            continue
+        data = convert_row(row)
+        data.pop(FULL_VECTOR_FIELD, None)
+        batch.append(data)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    flush(batch)
+    # Rows filtered out after the last insert still count as read
+    _save_checkpoint(checkpoint, path, collection_name, rows_read, total + inserted)
+    print(f"✓ Imported {inserted} rows into '{collection_name}' from {path}")
+    return inserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export or import conversation data")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(command):
+        command.add_argument("path", help="JSONL file, or Parquet file/directory")
+        command.add_argument("--format", choices=FORMATS, help="default: from the path (.parquet or a directory)")
+        command.add_argument("--collection", default=COLLECTION_NAME)
+        command.add_argument("--session", nargs="+", dest="sessions", help="only these session ids")
+        command.add_argument("--since", help="only messages at or after this ISO time (or epoch ms)")
+        command.add_argument("--until", help="only messages before this ISO time (or epoch ms)")
+        command.add_argument("--batch-size", type=int, default=1000)
+        command.add_argument("--resume", action="store_true", help="continue an interrupted run")
+
+    export = commands.add_parser("export", help="stream a collection to a file")
+    add_common(export)
+    export.add_argument("--vectors", action="store_true", help="include embedding vectors")
+    export.add_argument("--rows-per-file", type=int, default=100_000, help="rows per Parquet part file")
+
+    load = commands.add_parser("import", help="insert an export into a collection")
+    add_common(load)
+    load.add_argument("--re-embed", action="store_true", help="embed content again instead of using stored vectors")
+    load.add_argument("--checkpoint", help="progress file for --resume (default: <path>.import.json)")
+    args = parser.parse_args()
+
+    filters = {"sessions": args.sessions, "since": parse_time(args.since), "until": parse_time(args.until)}
+    if args.command == "export":
+        export_collection(runtime.milvus, args.collection, args.path, fmt=args.format,
+                          include_vectors=args.vectors, batch_size=args.batch_size,
+                          rows_per_file=args.rows_per_file, resume=args.resume, **filters)
+    else:
+        import_collection(runtime.milvus, args.collection, args.path, fmt=args.format, re_embed=args.re_embed,
+                          batch_size=args.batch_size, resume=args.resume, checkpoint=args.checkpoint, **filters)
+
+
+if __name__ == "__main__":
+    main()
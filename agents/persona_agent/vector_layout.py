@@ -0,0 +1,272 @@
+"""
+Compact vector layouts with an optional full-precision re-rank.
+
+A collection searches either the full embedding or a smaller stand-in for it:
+
+    full          float vectors as produced by the embedding model (the default)
+    reduced:<d>   the first d dimensions, renormalized; text-embedding-3 models are trained so
+                  that this matches asking the API for `dimensions=d`
+    int8          one signed byte per dimension, scaled per vector
+    binary        one sign bit per dimension, compared by Hamming distance
+
+Re-rank is opt-in. With it on, the full-precision vector is kept next to the compact one and
+only read for the top candidates of a search, which are re-scored exactly; the collection
+then stores more per message than the full layout alone. The layout is chosen when a
+collection is created and recorded in its properties, so collections can differ.
+
+Milvus Lite only stores float vectors, so int8 and binary are served by NumpyVectorStore;
+RerankingClient adds the reduced layout to a MilvusClient.
+"""
+
+import numpy as np
+
+LAYOUTS = ("full", "reduced", "int8", "binary")
+
+# Collection properties recording the layout (Milvus property values are strings)
+LAYOUT_PROPERTY = "vector_layout"
+FULL_DIM_PROPERTY = "vector_full_dim"
+RERANK_PROPERTY = "vector_rerank"
+
+# Field holding the full-precision vector of a compact Milvus collection
+FULL_VECTOR_FIELD = "full_vector"
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class VectorLayout:
+    """How one collection stores and scores vectors of full_dim dimensions."""
+
+    def __init__(self, kind="full", full_dim=None, dim=None, rerank=False):
+        if kind not in LAYOUTS:
+            raise ValueError(f"Unknown vector layout '{kind}' (expected one of {', '.join(LAYOUTS)})")
+        if kind == "reduced" and not (dim and 0 < dim < full_dim):
+            raise ValueError(f"reduced layout needs 0 < dim < {full_dim}, got {dim}")
+        self.kind = kind
+        self.full_dim = full_dim
+        self.dim = dim if kind == "reduced" else full_dim
+        self.rerank = rerank and kind != "full"
+
+    @classmethod
+    def parse(cls, spec, full_dim, rerank=False):
+        """Layout from a spec such as "full", "reduced:256", "int8" or "binary"."""
+        kind, _, dim = (spec or "full").strip().lower().partition(":")
+        if kind == "reduced" and not dim.isdigit():
+            raise ValueError(f"reduced layout needs a dimension, e.g. 'reduced:256' (got '{spec}')")
+        return cls(kind, full_dim, int(dim) if dim else None, rerank=rerank)
+
+    @classmethod
+    def from_properties(cls, properties, dim):
+        """Layout recorded in collection properties; collections without one are "full" at dim."""
+        properties = properties or {}
+        spec = properties.get(LAYOUT_PROPERTY)
+        if not spec:
+            return cls("full", dim)
+        full_dim = int(properties.get(FULL_DIM_PROPERTY) or dim)
+        return cls.parse(spec, full_dim, rerank=str(properties.get(RERANK_PROPERTY, "false")).lower() == "true")
+
+    def to_properties(self):
+        return {
+            LAYOUT_PROPERTY: self.spec,
+            FULL_DIM_PROPERTY: str(self.full_dim),
+            RERANK_PROPERTY: "true" if self.rerank else "false",
+        }
+
+    @property
+    def spec(self):
+        return f"reduced:{self.dim}" if self.kind == "reduced" else self.kind
+
+    @property
+    def compact(self):
+        return self.kind != "full"
+
+    @property
+    def code_dtype(self):
+        return {"int8": np.int8, "binary": np.uint8}.get(self.kind, np.float32)
+
+    @property
+    def code_width(self):
+        """Entries per stored code (bytes for binary, dimensions otherwise)."""
+        return (self.full_dim + 7) // 8 if self.kind == "binary" else self.dim
+
+    def bytes_per_vector(self, float_bytes=4):
+        """Storage per message: the searched code plus the full vector if it is kept for re-rank."""
+        code = {"int8": self.full_dim, "binary": self.code_width}.get(self.kind, self.dim * float_bytes)
+        return code + (self.full_dim * float_bytes if self.rerank else 0)
+
+    def prepare(self, queries):
+        """Normalized full-dimension queries -> the form scores() compares against codes."""
+        if self.kind == "reduced":
+            return normalize(queries[:, :self.dim])
+        if self.kind == "binary":
+            return np.packbits(queries > 0, axis=1)
+        return queries
+
+    def encode(self, vectors):
+        """Normalized full-dimension vectors -> stored codes."""
+        if self.kind == "reduced":
+            return normalize(vectors[:, :self.dim])
+        if self.kind == "int8":
+            peak = np.abs(vectors).max(axis=1, keepdims=True)
+            return np.round(vectors * (127 / np.where(peak == 0, 1, peak))).astype(np.int8)
+        if self.kind == "binary":
+            return np.packbits(vectors > 0, axis=1)
+        return vectors
+
+    def decode(self, codes):
+        """Approximate normalized vectors back from codes (code_dim wide for "reduced")."""
+        if self.kind == "binary":
+            signs = np.unpackbits(codes, axis=-1)[..., :self.full_dim].astype(np.float32) * 2 - 1
+            return signs / np.sqrt(self.full_dim)
+        return normalize(codes)
+
+    def scores(self, prepared, codes):
+        """Approximate cosine similarity of each prepared query to each code: (queries, codes)."""
+        if self.kind == "binary":
+            out = np.empty((len(prepared), len(codes)), dtype=np.float32)
+            for i, query in enumerate(prepared):
+                distance = _POPCOUNT[np.bitwise_xor(codes, query)].sum(axis=1, dtype=np.int32)
+                out[i] = 1 - 2 * distance / self.full_dim
+            return out
+        codes = np.asarray(codes, dtype=np.float32)
+        if self.kind == "int8":
+            norms = np.linalg.norm(codes, axis=1)
+            return (prepared @ codes.T) / np.where(norms == 0, 1, norms)
+        return prepared @ codes.T
+
+
+def rerank(query, hits, vectors, limit):
+    """Re-score hits exactly against their full-precision vectors; returns the best `limit`."""
+    if not hits:
+        return hits
+    exact = normalize(vectors) @ query
+    for hit, score in zip(hits, exact):
+        hit["distance"] = float(score)
+    return sorted(hits, key=lambda hit: hit["distance"], reverse=True)[:limit]
+
+
+class _RenamingIterator:
+    def __init__(self, iterator, rename):
+        self._iterator = iterator
+        self._rename = rename
+
+    def next(self):
+        return [self._rename(row) for row in self._iterator.next()]
+
+    def close(self):
+        self._iterator.close()
+
+
+class RerankingClient:
+    """MilvusClient wrapper that serves collections created with the reduced layout.
+
+    Callers keep reading and writing full-dimension "vector" values: inserts store the reduced
+    vector for search plus the full one in FULL_VECTOR_FIELD, and searches over-fetch
+    rerank_candidates times the limit and re-rank them exactly. Other collections, and every
+    other method, go straight to the wrapped client.
+    """
+
+    VECTOR_LAYOUTS = ("full", "reduced")
+
+    def __init__(self, client, rerank_candidates=4):
+        self.client = client
+        self.rerank_candidates = rerank_candidates
+        self._layouts = {}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def layout(self, collection_name):
+        """The collection's VectorLayout, or None for an ordinary full-precision collection."""
+        if collection_name not in self._layouts:
+            description = self.client.describe_collection(collection_name)
+            dim = next((f["params"].get("dim") for f in description["fields"] if f["name"] == "vector"), None)
+            layout = VectorLayout.from_properties(description.get("properties"), dim)
+            self._layouts[collection_name] = layout if layout.compact else None
+        return self._layouts[collection_name]
+
+    def create_collection(self, collection_name, *args, **kwargs):
+        self._layouts.pop(collection_name, None)
+        return self.client.create_collection(collection_name, *args, **kwargs)
+
+    def drop_collection(self, collection_name, *args, **kwargs):
+        self._layouts.pop(collection_name, None)
+        return self.client.drop_collection(collection_name, *args, **kwargs)
+
+    def _encode_rows(self, layout, data):
+        vectors = normalize([row["vector"] for row in data])
+        codes = layout.encode(vectors)
+        rows = []
+        for row, vector, code in zip(data, vectors, codes):
+            row = dict(row, vector=code.tolist())
+            if layout.rerank:
+                row[FULL_VECTOR_FIELD] = vector.tolist()
+            rows.append(row)
+        return rows
+
+    def insert(self, collection_name, data, **kwargs):
+        layout = self.layout(collection_name)
+        if layout is not None:
+            data = self._encode_rows(layout, data)
+        return self.client.insert(collection_name=collection_name, data=data, **kwargs)
+
+    def upsert(self, collection_name, data, **kwargs):
+        layout = self.layout(collection_name)
+        if layout is not None:
+            data = self._encode_rows(layout, data)
+        return self.client.upsert(collection_name=collection_name, data=data, **kwargs)
+
+    def search(self, collection_name, data, limit=10, output_fields=None, **kwargs):
+        layout = self.layout(collection_name)
+        if layout is None:
+            return self.client.search(collection_name=collection_name, data=data, limit=limit,
+                                      output_fields=output_fields, **kwargs)
+        queries = normalize(data)
+        fields = list(output_fields or [])
+        candidates = limit
+        if layout.rerank:
+            candidates = limit * self.rerank_candidates
+            fields.append(FULL_VECTOR_FIELD)
+        results = self.client.search(collection_name=collection_name, data=layout.prepare(queries).tolist(),
+                                     limit=candidates, output_fields=fields, **kwargs)
+        if not layout.rerank:
+            return results
+        reranked = []
+        for query, hits in zip(queries, results):
+            hits = [dict(hit, entity=dict(hit["entity"])) for hit in hits]
+            full = [hit["entity"].pop(FULL_VECTOR_FIELD) for hit in hits]
+            reranked.append(rerank(query, hits, full, limit))
+        return reranked
+
+    def _reading(self, collection_name, output_fields):
+        """Output fields to request, and a row mapper that serves "vector" at full precision if kept."""
+        layout = self.layout(collection_name)
+        fields = list(output_fields) if output_fields else output_fields
+        if layout is None or not layout.rerank or not fields or not ("vector" in fields or "*" in fields):
+            return fields, lambda row: row
+        fields = [FULL_VECTOR_FIELD if field == "vector" else field for field in fields]
+        if "*" in fields:
+            fields.append(FULL_VECTOR_FIELD)
+
+        def rename(row):
+            row = dict(row)
+            if FULL_VECTOR_FIELD in row:
+                row["vector"] = row.pop(FULL_VECTOR_FIELD)
+            return row
+
+        return fields, rename
+
+    def query(self, collection_name, output_fields=None, **kwargs):
+        fields, rename = self._reading(collection_name, output_fields)
+        return [rename(row) for row in self.client.query(collection_name=collection_name,
+                                                         output_fields=fields, **kwargs)]
+
+    def query_iterator(self, collection_name, output_fields=None, **kwargs):
+        fields, rename = self._reading(collection_name, output_fields)
+        return _RenamingIterator(self.client.query_iterator(collection_name=collection_name,
+                                                            output_fields=fields, **kwargs), rename)
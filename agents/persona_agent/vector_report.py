@@ -0,0 +1,144 @@
+"""
+Recall vs. size report for the compact vector layouts.
+
+    python3 vector_report.py [--collection persona_conversations] [--limit 20000]
+    python3 vector_report.py --synthetic 20000 [--dim 1536]
+
+Takes stored embeddings (or synthetic ones), holds out --queries of them as queries and,
+for each layout in --layouts, measures recall@k against exact full-precision search:
+without re-rank, and re-ranking --candidates multiples of k. Bytes per message count the
+searched code plus, when re-ranking, the full vector kept beside it.
+
+Recall depends on the embeddings: measure on a real collection before choosing a layout.
+The synthetic set (clustered vectors whose variance decays across dimensions) is only a
+smoke test. Results are printed as a table and written as JSON.
+"""
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from vector_layout import VectorLayout, normalize
+
+DEFAULT_LAYOUTS = ["full", "reduced:1024", "reduced:512", "reduced:256", "reduced:128", "int8", "binary"]
+
+
+def synthetic_vectors(count, dim, clusters=64, seed=0):
+    """Clustered unit vectors with a decaying spectrum, roughly shaped like text embeddings."""
+    rng = np.random.default_rng(seed)
+    decay = (1 + np.arange(dim) / 32) ** -0.5
+    centers = rng.standard_normal((clusters, dim)) * decay
+    vectors = centers[rng.integers(clusters, size=count)] + 0.6 * rng.standard_normal((count, dim)) * decay
+    return normalize(vectors)
+
+
+def load_vectors(client, collection_name, limit=None, batch_size=1000):
+    """Full-precision vectors of stored messages (summaries excluded)."""
+    iterator = client.query_iterator(collection_name=collection_name, batch_size=batch_size,
+                                     filter='role != "summary"', output_fields=["vector"])
+    vectors = []
+    try:
+        while limit is None or len(vectors) < limit:
+            page = iterator.next()
+            if not page:
+                break
+            vectors.extend(row["vector"] for row in page)
+    finally:
+        iterator.close()
+    return normalize(vectors[:limit] if limit else vectors)
+
+
+def top_k(scores, k):
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def evaluate(corpus, queries, specs, k=10, candidates=(2, 4, 8)):
+    """Recall@k and storage for each layout spec; one row per (layout, candidates) setting."""
+    k = min(k, len(corpus))
+    truth = top_k(queries @ corpus.T, k)
+    results = []
+    for spec in specs:
+        layout = VectorLayout.parse(spec, corpus.shape[1])
+        approx = layout.scores(layout.prepare(queries), layout.encode(corpus))
+        for multiple in (1,) + tuple(candidates if layout.compact else ()):
+            found = top_k(approx, min(k * multiple, len(corpus)))
+            if multiple > 1:
+                exact = np.einsum("qkd,qd->qk", corpus[found], queries)
+                found = np.take_along_axis(found, np.argsort(-exact, axis=1)[:, :k], axis=1)
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found.tolist(), truth.tolist())])
+            stored = VectorLayout.parse(spec, corpus.shape[1], rerank=multiple > 1)
+            results.append({
+                "layout": layout.spec,
+                "rerank_candidates": multiple if multiple > 1 else None,
+                f"recall@{k}": round(float(recall), 4),
+                "search_bytes": VectorLayout.parse(spec, corpus.shape[1], rerank=False).bytes_per_vector(),
+                "bytes_per_vector": stored.bytes_per_vector(),
+                "total_mb": round(stored.bytes_per_vector() * len(corpus) / 2**20, 2),
+            })
+    return results
+
+
+def print_table(results, k, file=sys.stderr):
+    print(f"{'layout':<14} {'re-rank':>8} {'recall@' + str(k):>10} {'search B':>9} {'stored B':>9} {'total MB':>9}",
+          file=file)
+    for r in results:
+        rerank = f"x{r['rerank_candidates']}" if r["rerank_candidates"] else "-"
+        print(f"{r['layout']:<14} {rerank:>8} {r[f'recall@{k}']:>10.4f} {r['search_bytes']:>9} "
+              f"{r['bytes_per_vector']:>9} {r['total_mb']:>9.2f}", file=file)
+    print("Rows with re-rank store the full vector too (VECTOR_RERANK=true), so they take more space than full.",
+          file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report recall vs. size of compact vector layouts")
+    parser.add_argument("--collection", help="collection to sample (default: the agent's collection)")
+    parser.add_argument("--limit", type=int, default=20000, help="at most this many stored vectors")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="use N synthetic vectors instead of a collection")
+    parser.add_argument("--dim", type=int, default=1536, help="dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="vectors held out as queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--layouts", nargs="+", default=DEFAULT_LAYOUTS)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[2, 4, 8],
+                        help="re-rank this many multiples of top-k")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic + args.queries, args.dim, seed=args.seed)
+        source = f"synthetic:{args.synthetic}x{args.dim}"
+    else:
+        import project
+
+        collection_name = args.collection or project.runtime.collection_name
+        vectors = load_vectors(project.runtime.milvus, collection_name, limit=args.limit + args.queries)
+        source = collection_name
+    if len(vectors) <= args.queries:
+        parser.error(f"{source} has {len(vectors)} vectors; need more than --queries ({args.queries})")
+
+    # Reduced layouts wider than the vectors don't apply
+    dim = vectors.shape[1]
+    specs = [spec for spec in args.layouts if not spec.startswith("reduced:") or int(spec.split(":")[1]) < dim]
+
+    held_out = np.random.default_rng(args.seed).permutation(len(vectors))
+    queries, corpus = vectors[held_out[:args.queries]], vectors[held_out[args.queries:]]
+    print(f"{source}: {len(corpus)} vectors, {len(queries)} queries, dim {dim}", file=sys.stderr)
+    results = evaluate(corpus, queries, specs, k=args.top_k, candidates=args.candidates)
+    print_table(results, min(args.top_k, len(corpus)))
+
+    report = {"source": source, "vectors": len(corpus), "queries": len(queries), "dim": dim,
+              "top_k": args.top_k, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Web search backends with a query-normalized TTL cache, single-flight deduplication
+and jittered retries bounded by an overall per-call deadline.
+"""
+
+import asyncio
+import math
+import os
+import random
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+
+class SearchProvider:
+    """Backend interface: search(query, max_results) -> list of {"title", "href", "body"} dicts."""
+
+    name = "base"
+
+    def search(self, query, max_results=5, timeout=None):
+        raise NotImplementedError
+
+
+class DuckDuckGoProvider(SearchProvider):
+    """DuckDuckGo text search, reusing DDGS clients per thread instead of building one per call.
+
+    DDGS takes its timeout at construction, so each thread keeps one client per timeout step,
+    rounded down so a request never outlives the caller's deadline.
+    """
+
+    name = "duckduckgo"
+    timeout_step = 0.5
+
+    def __init__(self, ddgs_class=None):
+        if ddgs_class is None:
+            from duckduckgo_search import DDGS as ddgs_class
+
+        self._ddgs_class = ddgs_class
+        self._local = threading.local()
+
+    def _timeout_key(self, timeout):
+        step = self.timeout_step
+        return max(step, math.floor((timeout or 10) / step) * step)
+
+    def search(self, query, max_results=5, timeout=None):
+        seconds = self._timeout_key(timeout)
+        clients = self._local.__dict__.setdefault("clients", {})
+        ddgs = clients.get(seconds)
+        if ddgs is None:
+            ddgs = clients[seconds] = self._ddgs_class(timeout=seconds)
+        try:
+            return list(ddgs.text(query, max_results=max_results))
+        except Exception:
+            # A DDGS client refuses every call after one has failed, so retries get a fresh one
+            clients.pop(seconds, None)
+            raise
+
+
+class StubSearchProvider(SearchProvider):
+    """Deterministic offline provider for tests and benchmarks.
+
+    latency: seconds slept per call; failures: number of initial calls that raise.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.0, failures=0, results=None):
+        self.latency = latency
+        self.failures = failures
+        self.results = results or {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def search(self, query, max_results=5, timeout=None):
+        with self._lock:
+            self.calls += 1
+            failing = self.calls <= self.failures
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            raise ConnectionError("stub search failure")
+        if query in self.results:
+            return self.results[query][:max_results]
+        slug = "-".join(query.lower().split())
+        return [
+            {"title": f"Result {i} for {query}", "href": f"https://example.com/{slug}/{i}"}
+            for i in range(1, max_results + 1)
+        ]
+
+
+def normalize_query(query):
+    return " ".join((query or "").lower().split())
+
+
+def format_results(results):
+    if not results:
+        return "(no results)"
+    lines = []
+    for r in results:
+        title = r.get("title") or r.get("body") or "result"
+        href = r.get("href") or r.get("link") or ""
+        lines.append(f"- {title} {(' - ' + href) if href else ''}")
+    return "\n".join(lines)
+
+
+class WebSearch:
+    """Cached, deduplicated, deadline-bounded search over a SearchProvider."""
+
+    def __init__(self, provider, ttl=600, max_entries=512, max_results=5,
+                 attempts=3, base_delay=0.5, deadline=8.0, on_fetch=None):
+        """on_fetch(elapsed_ms, error) is called after each uncached fetch (error is None on success)."""
+        self.provider = provider
+        self.on_fetch = on_fetch
+        self.max_results = max_results
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.deadline = deadline
+        self.cache = TTLCache(ttl=ttl, max_entries=max_entries)
+        self._async_inflight = {}
+
+    def _backoff(self, attempt, remaining):
+        """Full-jitter exponential backoff, never past the deadline."""
+        return min(random.uniform(0, self.base_delay * 2 ** attempt), max(0.0, remaining))
+
+    def _report(self, started, error=None):
+        if self.on_fetch is not None:
+            self.on_fetch((time.monotonic() - started) * 1000, error)
+
+    def _fetch(self, query):
+        """Fetch with retries; raises the last error once attempts or the deadline run out."""
+        started = time.monotonic()
+        try:
+            results = self._fetch_with_retries(query)
+        except Exception as e:
+            self._report(started, e)
+            raise
+        self._report(started)
+        return results
+
+    async def _afetch(self, query):
+        started = time.monotonic()
+        try:
+            results = await self._afetch_with_retries(query)
+        except Exception as e:
+            self._report(started, e)
+            raise
+        self._report(started)
+        return results
+
+    def _fetch_with_retries(self, query):
+        end = time.monotonic() + self.deadline
+        last_err = None
+        for attempt in range(self.attempts):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return self.provider.search(query, max_results=self.max_results, timeout=remaining)
+            except Exception as e:
+                last_err = e
+            if attempt + 1 < self.attempts:
+                delay = self._backoff(attempt, end - time.monotonic())
+                if time.monotonic() + delay >= end:
+                    break
+                time.sleep(delay)
+        raise last_err or TimeoutError("search deadline exceeded")
+
+    async def _afetch_with_retries(self, query):
+        end = time.monotonic() + self.deadline
+        last_err = None
+        for attempt in range(self.attempts):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(self.provider.search, query, self.max_results, remaining),
+                    timeout=remaining,
+                )
+            except asyncio.TimeoutError:
+                last_err = TimeoutError("search deadline exceeded")
+                break
+            except Exception as e:
+                last_err = e
+            if attempt + 1 < self.attempts:
+                delay = self._backoff(attempt, end - time.monotonic())
+                if time.monotonic() + delay >= end:
+                    break
+                await asyncio.sleep(delay)
+        raise last_err or TimeoutError("search deadline exceeded")
+
+    def search(self, query):
+        """Search and return a concise bullet list (or a parenthesized status message)."""
+        query = (query or "").strip()
+        if not query:
+            return "(no query)"
+        try:
+            results = self.cache.get_or_load(normalize_query(query), lambda: self._fetch(query))
+        except Exception as e:
+            return f"(search unavailable: {e})"
+        return format_results(results)
+
+    async def asearch(self, query):
+        """Async variant of search; retries wait with asyncio.sleep instead of blocking the thread."""
+        query = (query or "").strip()
+        if not query:
+            return "(no query)"
+        key = normalize_query(query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.hits += 1
+            return format_results(cached)
+
+        task = self._async_inflight.get(key)
+        if task is None:
+            self.cache.misses += 1
+            task = asyncio.ensure_future(self._afetch(query))
+            self._async_inflight[key] = task
+            task.add_done_callback(lambda _: self._async_inflight.pop(key, None))
+        else:
+            self.cache.coalesced += 1
+        try:
+            results = await asyncio.shield(task)
+        except Exception as e:
+            return f"(search unavailable: {e})"
+        self.cache.set(key, results)
+        return format_results(results)
+
+    def stats(self):
+        return dict(self.cache.stats(), provider=self.provider.name)
+
+
+def provider_from_env():
+    """Build the provider named by SEARCH_PROVIDER (duckduckgo by default, or stub)."""
+    name = os.getenv("SEARCH_PROVIDER", "duckduckgo").lower()
+    if name == "stub":
+        return StubSearchProvider(latency=float(os.getenv("SEARCH_STUB_LATENCY", "0")))
+    return DuckDuckGoProvider()
@@ -0,0 +1,154 @@
+"""
+Write-behind queue that batches message records into one embedding call and one Milvus insert.
+"""
+
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Collect records on a background thread and flush them in bulk on a size or time threshold."""
+
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self, milvus_client, collection_name, embeddings, embedding_dim,
+                 batch_size=32, flush_interval=1.0, retry_delay=0.1, debug=False):
+        self.milvus = milvus_client
+        self.collection_name = collection_name
+        self.embeddings = embeddings
+        self.embedding_dim = embedding_dim
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.debug = debug
+        self.written = 0
+        self.failed = 0
+        self.last_error = None
+        self.retry_delay = retry_delay
+        self._error = None
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """Queue a record for persistence; records that already carry a vector are not re-embedded."""
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        self._check_worker()
+        self._queue.put(record)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written."""
+        if self._closed:
+            return True
+        self._check_worker()
+        done = threading.Event()
+        self._queue.put(done)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Wait in slices so a worker that dies mid-flush is noticed instead of hanging the caller
+        while not done.wait(self._POLL_INTERVAL):
+            self._check_worker()
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self, timeout=None):
+        """Flush pending records and stop the worker thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._check_worker()
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise RuntimeError(f"write-behind worker stopped: {self._error!r}") from self._error
+
+    def _check_worker(self):
+        if not self._thread.is_alive():
+            raise RuntimeError(f"write-behind worker stopped: {self._error!r}") from self._error
+
+    def _run(self):
+        try:
+            self._loop()
+        except BaseException as e:
+            self._error = e
+            print(f"⚠️  Write-behind worker stopped: {e}")
+            raise
+
+    def _loop(self):
+        batch = []
+        deadline = None
+        while True:
+            wait = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(batch)
+                return
+            if isinstance(item, threading.Event):
+                self._write(batch)
+                batch = []
+                item.set()
+                continue
+            if item is None:
+                # Time threshold reached
+                self._write(batch)
+                batch = []
+                continue
+
+            batch.append(item)
+            if len(batch) == 1:
+                deadline = time.monotonic() + self.flush_interval
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            rows = self._rows(batch)
+            if not self._insert(rows) and len(rows) > 1:
+                # One bad row shouldn't take the whole batch down with it
+                for row in rows:
+                    self._insert([row], retries=0)
+        except Exception as e:
+            # Never let a single batch kill the worker; the records are counted as lost
+            self.failed += len(batch)
+            self.last_error = e
+            print(f"⚠️  Error flushing queued messages: {e}")
+
+    def _rows(self, batch):
+        missing = [r for r in batch if "vector" not in r]
+        try:
+            vectors = self.embeddings.embed_documents([r["content"] for r in missing]) if missing else []
+        except Exception:
+            vectors = [[0.0] * self.embedding_dim for _ in missing]
+
+        vectors = iter(vectors)
+        return [record if "vector" in record else dict(record, vector=next(vectors)) for record in batch]
+
+    def _insert(self, rows, retries=1):
+        """Insert rows, retrying transient failures; returns False once the retries are spent."""
+        for attempt in range(retries + 1):
+            try:
+                self.milvus.insert(collection_name=self.collection_name, data=rows)
+            except Exception as e:
+                self.last_error = e
+                if attempt < retries:
+                    time.sleep(self.retry_delay)
+                continue
+            self.written += len(rows)
+            if self.debug:
+                print(f"💾 Flushed {len(rows)} queued messages")
+            return True
+        if len(rows) == 1:
+            self.failed += 1
+            print(f"⚠️  Dropped a queued {rows[0].get('role', '')} message: {self.last_error}")
+        return False
@@ -1,4 +1,5 @@
 import os
+import sys
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 from sentence_transformers import SentenceTransformer
@@ -6,6 +7,8 @@ import markdown
 from dotenv import load_dotenv
 from openai import OpenAI
 import re
+import json
+import argparse
 from pathlib import Path
 import numpy as np
 import hashlib
@@ -18,10 +21,267 @@ load_dotenv()
 # Debug flag from environment (default to False)
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
 
+# Ingestion settings
+DOCS_DIR = os.getenv("DOCS_DIR", "docs")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "doc_chunks")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+STATE_FILE = os.getenv("INGEST_STATE_FILE", "ingest-state.json")
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "1500"))
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", "256"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "2048"))
+CONTENT_MAX_LENGTH = 65535
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_RE = re.compile(r"^\s*(```|~~~)")
+TAG_RE = re.compile(r"<[^>]+>")
+
 # Connect to Milvus (local server or Milvus Lite)
 # client_milvus = MilvusClient(uri="http://localhost:19530")
 #client_milvus = MilvusClient(uri="milvus-lite.db")
+# Not MILVUS_URI: pymilvus reads that variable itself and rejects a Milvus Lite file path
+MILVUS_URI = os.getenv("MILVUS_LITE_PATH", "milvus-lite.db")
+# "numpy" swaps Milvus for in-process exact search over memory-mapped arrays (small corpora)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "milvus").lower()
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", "doc-chunks.npstore")
+# numpy_store.py (and the vector_layout.py it uses) live with the persona agent; both agents share them
+SHARED_MODULES_DIR = Path(__file__).resolve().parent.parent / "persona_agent"
+
+
+def open_store():
+    """Open the configured vector store; both expose the same MilvusClient-style API."""
+    if VECTOR_STORE == "numpy":
+        if str(SHARED_MODULES_DIR) not in sys.path:
+            sys.path.append(str(SHARED_MODULES_DIR))
+        from numpy_store import NumpyVectorStore
+
+        return NumpyVectorStore(NUMPY_STORE_PATH)
+    return MilvusClient(uri=MILVUS_URI)
+
+
+def iter_markdown_files(root):
+    """Yield markdown files under root in a stable order."""
+    for path in sorted(Path(root).rglob("*")):
+        if path.is_file() and path.suffix.lower() in (".md", ".markdown"):
+            yield path
+
+
+def iter_chunks(lines, max_chars=CHUNK_MAX_CHARS):
+    """Stream markdown lines into heading-aware chunks.
+
+    Yields (heading_path, text) where heading_path is e.g. "Setup > Install". Sections longer
+    than max_chars are split at blank lines. Headings inside fenced code blocks are ignored.
+    """
+    headings = []
+    buffer = []
+    size = 0
+    in_fence = False
+
+    def emit():
+        text = "".join(buffer).strip()
+        return (" > ".join(h for _, h in headings), text) if text else None
+
+    for line in lines:
+        if FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else HEADING_RE.match(line)
+        if match:
+            chunk = emit()
+            if chunk:
+                yield chunk
+            buffer, size = [], 0
+            level = len(match.group(1))
+            headings = [(lvl, h) for lvl, h in headings if lvl < level] + [(level, match.group(2))]
+            continue
+
+        buffer.append(line)
+        size += len(line)
+        if size >= max_chars and not in_fence and not line.strip():
+            chunk = emit()
+            if chunk:
+                yield chunk
+            buffer, size = [], 0
+
+    chunk = emit()
+    if chunk:
+        yield chunk
+
+
+def plain_text(md_text):
+    """Render markdown to plain text for embedding."""
+    html = markdown.markdown(md_text)
+    return " ".join(TAG_RE.sub(" ", html).split())
+
+
+def chunk_file(path, rel_path):
+    """Return the chunks of one file as dicts keyed by a stable chunk id."""
+    chunks = []
+    seen = {}
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for heading, text in iter_chunks(f):
+            # The heading is part of the hash so a renamed section is re-embedded
+            content_hash = hashlib.sha256(f"{heading}\n{text}".encode("utf-8")).hexdigest()
+            # Identical chunks within one file get distinct ids by occurrence
+            n = seen.get(content_hash, 0)
+            seen[content_hash] = n + 1
+            chunk_id = hashlib.sha256(f"{rel_path}\0{content_hash}\0{n}".encode("utf-8")).hexdigest()
+            chunks.append({
+                "id": chunk_id,
+                "path": rel_path,
+                "heading": heading[:1024],
+                "content": text.encode("utf-8")[:CONTENT_MAX_LENGTH].decode("utf-8", errors="ignore"),
+                "content_hash": content_hash,
+            })
+    return chunks
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_state(state_file):
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"files": {}}
+
+
+def save_state(state_file, state):
+    tmp = f"{state_file}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_file)
+
+
+def init_collection(client, collection_name, dim):
+    """Create the chunk collection if needed."""
+    if client.has_collection(collection_name):
+        return
+    schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False)
+    schema.add_field("id", DataType.VARCHAR, is_primary=True, max_length=64)
+    schema.add_field("vector", DataType.FLOAT_VECTOR, dim=dim)
+    schema.add_field("path", DataType.VARCHAR, max_length=1024)
+    schema.add_field("heading", DataType.VARCHAR, max_length=1024)
+    schema.add_field("content", DataType.VARCHAR, max_length=CONTENT_MAX_LENGTH)
+    schema.add_field("content_hash", DataType.VARCHAR, max_length=64)
+    index_params = client.prepare_index_params()
+    index_params.add_index(field_name="vector", index_name="idx_vector", index_type="AUTOINDEX", metric_type="COSINE")
+    index_params.add_index(field_name="path", index_name="idx_path", index_type="INVERTED")
+    client.create_collection(collection_name=collection_name, schema=schema, index_params=index_params)
+    if DEBUG:
+        print(f"Created collection: {collection_name}")
+
+
+class Ingestor:
+    """Incrementally index a markdown tree into Milvus.
+
+    A state file records each file's size, mtime, content hash and chunk ids. Files whose
+    size and mtime are unchanged are skipped without being read; changed files are re-chunked
+    and only chunks with new ids are encoded and upserted; chunks that disappeared are deleted.
+    """
+
+    def __init__(self, client, model, collection_name=COLLECTION_NAME, state_file=STATE_FILE,
+                 encode_batch_size=ENCODE_BATCH_SIZE, upsert_batch_size=UPSERT_BATCH_SIZE):
+        self.client = client
+        self.model = model
+        self.collection_name = collection_name
+        self.state_file = state_file
+        self.encode_batch_size = encode_batch_size
+        self.upsert_batch_size = upsert_batch_size
+        self._pending = []
+        self.stats = {"files_seen": 0, "files_changed": 0, "files_deleted": 0,
+                      "chunks_upserted": 0, "chunks_deleted": 0, "chunks_unchanged": 0}
+        init_collection(client, collection_name, model.get_sentence_embedding_dimension())
+
+    def _flush(self):
+        """Encode pending chunks in large batches and upsert them."""
+        if not self._pending:
+            return
+        texts = [f"{c['heading']}\n{plain_text(c['content'])}" for c in self._pending]
+        vectors = self.model.encode(
+            texts,
+            batch_size=self.encode_batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32)
+        rows = [dict(chunk, vector=vector.tolist()) for chunk, vector in zip(self._pending, vectors)]
+        self.client.upsert(collection_name=self.collection_name, data=rows)
+        self.stats["chunks_upserted"] += len(rows)
+        self._pending = []
+
+    def _delete(self, ids):
+        if ids:
+            self.client.delete(collection_name=self.collection_name, ids=list(ids))
+            self.stats["chunks_deleted"] += len(ids)
+
+    def run(self, docs_dir=DOCS_DIR, full=False):
+        state = {"files": {}} if full else load_state(self.state_file)
+        old_files = state["files"]
+        new_files = {}
+        root = Path(docs_dir)
+
+        for path in iter_markdown_files(root):
+            rel_path = path.relative_to(root).as_posix()
+            st = path.stat()
+            entry = old_files.get(rel_path)
+            self.stats["files_seen"] += 1
+
+            # Fast path: untouched files are not even read
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime_ns:
+                new_files[rel_path] = entry
+                self.stats["chunks_unchanged"] += len(entry["chunks"])
+                continue
+
+            digest = file_hash(path)
+            if entry and entry["hash"] == digest:
+                new_files[rel_path] = dict(entry, size=st.st_size, mtime=st.st_mtime_ns)
+                self.stats["chunks_unchanged"] += len(entry["chunks"])
+                continue
+
+            self.stats["files_changed"] += 1
+            chunks = chunk_file(path, rel_path)
+            old_ids = set(entry["chunks"]) if entry else set()
+            new_ids = [c["id"] for c in chunks]
+            for chunk in chunks:
+                if chunk["id"] in old_ids:
+                    self.stats["chunks_unchanged"] += 1
+                else:
+                    self._pending.append(chunk)
+            self._delete(old_ids - set(new_ids))
+            if len(self._pending) >= self.upsert_batch_size:
+                self._flush()
+            new_files[rel_path] = {"size": st.st_size, "mtime": st.st_mtime_ns, "hash": digest, "chunks": new_ids}
+
+        # Files that disappeared take their chunks with them
+        for rel_path in old_files.keys() - new_files.keys():
+            self._delete(old_files[rel_path]["chunks"])
+            self.stats["files_deleted"] += 1
+
+        self._flush()
+        save_state(self.state_file, {"files": new_files})
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally index a markdown docs tree into Milvus")
+    parser.add_argument("docs_dir", nargs="?", default=DOCS_DIR)
+    parser.add_argument("--full", action="store_true", help="ignore the state file and re-index everything")
+    args = parser.parse_args()
+
+    print("Starting the project...")
+    client_milvus = open_store()
+    if args.full and client_milvus.has_collection(COLLECTION_NAME):
+        client_milvus.drop_collection(COLLECTION_NAME)
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    ingestor = Ingestor(client_milvus, model)
+    stats = ingestor.run(args.docs_dir, full=args.full)
+    print(f"✓ Indexed {args.docs_dir}: {stats}")
 
 
 if __name__ == "__main__":
-    print("Starting the project...")
\ No newline at end of file
+    main()
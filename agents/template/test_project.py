@@ -0,0 +1,176 @@
+"""
+Automated tests for incremental markdown ingestion
+"""
+
+import hashlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+from pymilvus import MilvusClient
+
+from project import Ingestor, chunk_file, iter_chunks
+
+
+class FakeModel:
+    """Deterministic stand-in for a SentenceTransformer that records what it encodes."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dim)
+            vectors.append(vector / np.linalg.norm(vector))
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def write(path, text, mtime):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # Pin the mtime so a rewrite is noticed even within the filesystem's timestamp resolution
+    os.utime(path, ns=(mtime, mtime))
+
+
+def stored(client):
+    rows = client.query(collection_name="chunks", filter='id != ""', output_fields=["path", "heading", "content"])
+    return sorted((row["path"], row["heading"], row["content"]) for row in rows)
+
+
+GUIDE = """# Guide
+Intro text.
+
+## Install
+Run pip install.
+
+```bash
+# not a heading
+pip install -r requirements.txt
+```
+
+## Usage
+Call main().
+"""
+
+
+class TestIngestor:
+    """Test suite for chunking and incremental ingestion"""
+
+    def test_chunking(self):
+        """Test heading-aware chunks, fenced code and splitting long sections at blank lines"""
+        print("Test 1: Chunking...", end=" ")
+
+        chunks = list(iter_chunks(GUIDE.splitlines(keepends=True)))
+        assert [heading for heading, _ in chunks] == ["Guide", "Guide > Install", "Guide > Usage"]
+        assert "# not a heading" in chunks[1][1]
+
+        long_section = "# Notes\n" + "".join(f"paragraph {i} " + "x" * 40 + "\n\n" for i in range(6))
+        parts = list(iter_chunks(long_section.splitlines(keepends=True), max_chars=100))
+        assert len(parts) > 1 and all(heading == "Notes" for heading, _ in parts)
+        assert "".join(text for _, text in parts).count("paragraph") == 6
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "dup.md")
+            write(path, "# A\nsame\n# A\nsame\n", 1_000_000_000)
+            first, second = chunk_file(path, "dup.md")
+            # Identical chunks share a content hash but get distinct, stable ids
+            assert first["content_hash"] == second["content_hash"] and first["id"] != second["id"]
+            assert [c["id"] for c in chunk_file(path, "dup.md")] == [first["id"], second["id"]]
+
+        print("✓ PASSED")
+        return True
+
+    def test_incremental_ingestion(self):
+        """Test that unchanged chunks are skipped and stale or deleted chunks are removed"""
+        print("Test 2: Incremental Ingestion...", end=" ")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            docs = os.path.join(tmp, "docs")
+            state_file = os.path.join(tmp, "state.json")
+            write(os.path.join(docs, "guide.md"), GUIDE, 1_000_000_000)
+            write(os.path.join(docs, "faq", "faq.md"), "# FAQ\nAsk away.\n", 1_000_000_000)
+            client = MilvusClient(uri=os.path.join(tmp, "milvus.db"))
+            model = FakeModel()
+
+            def ingest():
+                return Ingestor(client, model, collection_name="chunks", state_file=state_file).run(docs)
+
+            stats = ingest()
+            assert stats["files_changed"] == 2 and stats["chunks_upserted"] == 4
+            assert len(stored(client)) == 4 and len(model.encoded) == 4
+
+            # Nothing changed: no file is re-chunked and nothing is encoded
+            stats = ingest()
+            assert stats["files_changed"] == 0 and stats["chunks_upserted"] == 0 and stats["chunks_unchanged"] == 4
+            # A touched file with the same content is recognized by its hash
+            os.utime(os.path.join(docs, "guide.md"), ns=(2_000_000_000, 2_000_000_000))
+            stats = ingest()
+            assert stats["files_changed"] == 0 and len(model.encoded) == 4
+
+            # Editing one section re-encodes that chunk only and deletes the stale one
+            write(os.path.join(docs, "guide.md"), GUIDE.replace("Call main().", "Call run()."), 3_000_000_000)
+            stats = ingest()
+            assert stats["files_changed"] == 1 and stats["chunks_upserted"] == 1
+            assert stats["chunks_deleted"] == 1 and stats["chunks_unchanged"] == 3
+            assert model.encoded[-1].startswith("Guide > Usage") and len(model.encoded) == 5
+            contents = [content for _, _, content in stored(client)]
+            assert "Call run()." in contents and "Call main()." not in contents and len(contents) == 4
+
+            # A deleted file takes its chunks with it
+            os.remove(os.path.join(docs, "faq", "faq.md"))
+            stats = ingest()
+            assert stats["files_deleted"] == 1 and stats["chunks_deleted"] == 1
+            assert {path for path, _, _ in stored(client)} == {"guide.md"}
+            client.close()
+
+        print("✓ PASSED")
+        return True
+
+
+def run_all_tests():
+    """Run all tests"""
+    print("=" * 60)
+    print("🧪 Running Ingestion Tests")
+    print("=" * 60)
+    print()
+
+    test_suite = TestIngestor()
+    tests = [
+        test_suite.test_chunking,
+        test_suite.test_incremental_ingestion,
+    ]
+
+    passed = 0
+    failed = 0
+
+    for test in tests:
+        try:
+            if test():
+                passed += 1
+        except Exception as e:
+            print(f"✗ FAILED - {e}")
+            if os.getenv("DEBUG", "false").lower() == "true":
+                import traceback
+                traceback.print_exc()
+            failed += 1
+
+    print()
+    print("=" * 60)
+    print(f"Test Results: {passed} passed, {failed} failed")
+    print("=" * 60)
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)